@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Measure how much of a scanned tree is left in the page cache by each --io-mode.
+
+Creates a tree of files (which must not be on a tmpfs, where everything is
+always "cached"), evicts them, indexes them in each mode, and reports how many
+of their pages are resident afterwards, and how long the scan took.
+
+    python benchmarks/cache_residency.py --dir /scratch/bench --count 64 --size 16M
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from uindex import create
+from uindex.create import Indexer
+from uindex.fs import IO_MODES, path_cached_pages
+from uindex.utils import format_bytes, parse_bytes
+
+
+def residency(paths):
+    resident = total = 0
+    for path in paths:
+        r, t = path_cached_pages(path)
+        resident += r
+        total += t
+    return resident, total
+
+
+def evict(paths):
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dir', default='.',
+        help="Where to create the test tree.")
+    parser.add_argument('--count', type=int, default=32)
+    parser.add_argument('--size', type=parse_bytes, default='8M')
+    parser.add_argument('-t', '--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    tree = tempfile.mkdtemp(prefix='uindex-bench-', dir=args.dir)
+    try:
+
+        paths = []
+        for i in range(args.count):
+            path = os.path.join(tree, 'file{:04d}'.format(i))
+            with open(path, 'wb') as fh:
+                fh.write(os.urandom(args.size))
+            paths.append(path)
+
+        print('{} files of {} in {}'.format(args.count, format_bytes(args.size), tree))
+        print('{:10s} {:>12s} {:>12s} {:>10s}'.format('mode', 'before', 'after', 'seconds'))
+
+        for mode in IO_MODES:
+
+            # Don't let the previous run's checksums short-circuit the reads.
+            create._checksum_cache.clear()
+            evict(paths)
+            before, total = residency(paths)
+
+            start = time.time()
+            with open(os.devnull, 'w') as out:
+                Indexer(tree, io_mode=mode).run(out, threads=args.threads)
+            elapsed = time.time() - start
+
+            after, _ = residency(paths)
+            print('{:10s} {:>11.1f}% {:>11.1f}% {:>10.3f}'.format(
+                mode,
+                100.0 * before / total,
+                100.0 * after / total,
+                elapsed,
+            ))
+
+    finally:
+        shutil.rmtree(tree)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,11 @@ setup(
     
     packages=find_packages(exclude=['build*', 'tests*']),
     include_package_data=True,
+
+    extras_require={
+        'chunks': ['numpy'],
+        'report': ['numpy'],
+    },
     
     author='Mike Boers',
     author_email='floss+uindex@vfxetc.com',
@@ -20,6 +25,11 @@ setup(
             uindex-create = uindex.create:main
             uindex-dedupe = uindex.dedupe:main
             uindex-diff = uindex.diff:main
+            uindex-merge = uindex.merge:main
+            uindex-query = uindex.query:main
+            uindex-report = uindex.report:main
+            uindex-verify = uindex.verify:main
+            uindex-watch = uindex.watch:main
         ''',
     },
 
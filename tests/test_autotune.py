@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import time
+
+from . import *
+
+from uindex import create
+from uindex.autotune import Autotuner, parse_threads
+from uindex.create import Indexer, WalkItem, _WorkerCount, _checksum_cost, _checksum_path, _threaded_map
+
+
+def feed(tuner, jobs, bytes_, latency):
+    # Pretend an interval has passed with the given totals.
+    tuner.window_start = time.time() - tuner.interval
+    tuner.jobs = jobs
+    tuner.bytes = bytes_
+    tuner.latency = latency * jobs
+    return tuner.poll()
+
+
+class TestAutotuner(TestCase):
+
+    def test_parse_threads(self):
+        self.assertEqual(parse_threads('3'), 3)
+        self.assertEqual(parse_threads('auto'), 'auto')
+        self.assertEqual(parse_threads('auto:8'), 'auto:8')
+        self.assertRaises(ValueError, parse_threads, '0')
+        self.assertRaises(ValueError, parse_threads, 'auto:0')
+        self.assertEqual(Autotuner.from_spec('auto:8').max_threads, 8)
+
+    def test_grow_and_turn_around(self):
+
+        tuner = Autotuner(start=4, interval=1)
+        self.assertEqual(feed(tuner, 100, 1e8, 0.01), 5)
+        self.assertEqual(feed(tuner, 200, 2e8, 0.01), 6)
+        # Worse, so turn around.
+        self.assertEqual(feed(tuner, 100, 1e8, 0.01), 5)
+        # No better for fewer, so keep shedding.
+        self.assertEqual(feed(tuner, 100, 1e8, 0.01), 4)
+
+    def test_waits_for_enough_jobs(self):
+        tuner = Autotuner(start=4, interval=1)
+        self.assertEqual(feed(tuner, 2, 1e6, 0.01), 4)
+        self.assertIs(tuner.last_score, None)
+
+    def test_back_off_on_latency(self):
+        tuner = Autotuner(start=8, interval=1)
+        self.assertEqual(feed(tuner, 100, 1e8, 0.01), 10)
+        # Same throughput, but much slower jobs.
+        self.assertEqual(feed(tuner, 100, 1e8, 0.05), 8)
+        self.assertEqual(tuner.direction, -1)
+
+    def test_pinned_at_limit(self):
+        tuner = Autotuner(start=4, max_threads=4, interval=1)
+        self.assertEqual(feed(tuner, 100, 1e8, 0.01), 4)
+        self.assertEqual(feed(tuner, 200, 2e8, 0.01), 4)
+        # Probes below the limit next.
+        self.assertEqual(tuner.direction, -1)
+        self.assertEqual(feed(tuner, 400, 4e8, 0.01), 3)
+
+        tuner = Autotuner(start=1, min_threads=1, interval=1)
+        tuner.direction = -1
+        tuner.last_score = 1000.0
+        self.assertEqual(feed(tuner, 10, 1e5, 0.01), 1)
+        self.assertEqual(tuner.direction, 1)
+
+
+class TestDynamicPool(TestCase):
+
+    def test_worker_count(self):
+
+        count = _WorkerCount()
+        self.assertEqual(count.resize(3), 3)
+        self.assertEqual(count.resize(1), 0)
+        self.assertTrue(count.should_retire())
+        self.assertEqual(count.resize(3), 1) # Cancels the other retirement.
+        self.assertFalse(count.should_retire())
+        self.assertEqual(count.active, 3)
+
+        count.finish()
+        self.assertEqual(count.resize(10), 0)
+
+    def test_threaded_map_in_order(self):
+
+        def work(x):
+            time.sleep(0.001 * (x % 3))
+            return x
+
+        tuner = Autotuner(start=2, max_threads=6, interval=0.01)
+        results = list(_threaded_map(tuner, work, range(300)))
+        self.assertEqual(results, list(range(300)))
+        self.assertTrue(tuner.history)
+
+
+class TestCost(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        with open(os.path.join(self.dir, 'a'), 'wb') as fh:
+            fh.write(b'x' * 100000)
+        create._checksum_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def cost(self, **kwargs):
+        item = WalkItem(self.dir, 'a')
+        return _checksum_cost(_checksum_path(item, Indexer(self.dir, **kwargs)))
+
+    def test_only_what_was_read(self):
+        self.assertEqual(self.cost(head='1k', tail='2k'), 3072)
+        self.assertEqual(self.cost(samples=2, sample_size='1k'), 4096)
+        self.assertEqual(self.cost(), 100000)
+        # Served from the cache.
+        self.assertEqual(self.cost(), 0)
@@ -0,0 +1,184 @@
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+from . import *
+
+from uindex import chunks
+from uindex.chunks import Chunker, estimate_chunk_dedupe
+from uindex.create import Indexer, main as create_main
+from uindex.dedupe import main as dedupe_main
+
+
+def random_bytes(size, seed):
+    rand = random.Random(seed)
+    return bytes(bytearray(rand.getrandbits(8) for _ in range(size)))
+
+
+def chunk(data, avg_size=4096, feed_size=10000, **kwargs):
+    chunker = Chunker(avg_size, **kwargs)
+    for i in range(0, len(data), feed_size):
+        chunker.feed(data[i:i + feed_size])
+    return chunker.finish()
+
+
+class TestChunker(TestCase):
+
+    def test_boundaries(self):
+
+        data = random_bytes(200000, 1)
+        found = chunk(data)
+
+        self.assertEqual(sum(length for _, _, length in found), len(data))
+        self.assertEqual([offset for _, offset, _ in found],
+            [sum(length for _, _, length in found[:i]) for i in range(len(found))])
+        for _, _, length in found[:-1]:
+            self.assertTrue(1024 <= length <= 32768, length)
+        self.assertTrue(20 < len(found) < 100, len(found))
+
+        # Boundaries don't depend on how the data arrives.
+        self.assertEqual(chunk(data, feed_size=1), found)
+        self.assertEqual(chunk(data, feed_size=len(data)), found)
+
+    def test_insertion(self):
+
+        data = random_bytes(200000, 2)
+        before = set(x[0] for x in chunk(data))
+        after = chunk(data[:100000] + b'inserted' + data[100000:])
+
+        # Only the chunk around the insertion differs.
+        shared = [x for x in after if x[0] in before]
+        self.assertTrue(len(after) - len(shared) <= 2, (len(after), len(shared)))
+
+    @unittest.skipIf(chunks.np is None, "requires numpy")
+    def test_numpy(self):
+        data = random_bytes(100000, 3)
+        self.assertEqual(chunk(data, use_numpy=True), chunk(data, use_numpy=False))
+
+    def test_sizes(self):
+        self.assertRaises(ValueError, Chunker, 16)
+        self.assertEqual(chunk(b''), [])
+        self.assertEqual([x[2] for x in chunk(b'x' * 100)], [100])
+        # No content-defined boundaries at all; cut at the maximum.
+        self.assertEqual([x[2] for x in chunk(b'\0' * 100000)][:3], [32768] * 3)
+
+
+class TestChunkIndex(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.tree = os.path.join(self.dir, 'tree')
+        os.makedirs(self.tree)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.tree, name)
+        with open(path, 'wb') as fh:
+            fh.write(data)
+        return path
+
+    def report(self, *argv):
+        out = io.StringIO()
+        stdout = sys.stdout
+        sys.stdout = out
+        try:
+            dedupe_main(list(argv))
+        finally:
+            sys.stdout = stdout
+        return out.getvalue()
+
+    def test_create_and_report(self):
+
+        data = random_bytes(100000, 4)
+        self.write('v1', data)
+        self.write('v2', data[:50000] + b'edited' + data[50000:])
+        os.link(os.path.join(self.tree, 'v1'), os.path.join(self.tree, 'v1.link'))
+
+        index = os.path.join(self.dir, 'index.txt')
+        create_main([self.tree, '-o', index, '--chunks', '--chunk-avg', '4k'])
+
+        with open(index + '.chunks') as fh:
+            lines = fh.read().splitlines()
+        self.assertTrue(lines[0].startswith('#chunks-start '))
+        self.assertIn('"avg_size": 4096', lines[0])
+        rows = [line.split('\t') for line in lines[1:]]
+
+        # The hardlink is not read again, so doesn't count as a duplicate.
+        self.assertEqual(set(row[3] for row in rows), set(['v1', 'v2']))
+        self.assertEqual(sum(int(row[2]) for row in rows if row[3] == 'v1'), 100000)
+
+        stats = estimate_chunk_dedupe([index + '.chunks'], processes=1)
+        total = stats[-1]
+        self.assertEqual(total.bytes, 200006)
+        # Almost all of v2 is shared with v1.
+        self.assertTrue(100000 < total.unique_bytes < 120000, total.unique_bytes)
+
+        # A second index of an unchanged copy adds nothing new.
+        other = os.path.join(self.dir, 'other')
+        os.makedirs(other)
+        shutil.copy(os.path.join(self.tree, 'v1'), other)
+        other_index = os.path.join(self.dir, 'other.txt')
+        create_main([other, '-o', other_index, '--chunks', '--chunk-avg', '4k'])
+
+        stats = estimate_chunk_dedupe([index + '.chunks', other_index + '.chunks'],
+            processes=2, min_chunk_size=1024)
+        self.assertEqual(stats[1].unique_bytes, 100000)
+        self.assertEqual(stats[1].new_bytes, 0)
+        self.assertEqual(stats[2].unique_bytes, total.unique_bytes)
+
+        output = self.report('--chunk-report', index, other_index, '-j', '2')
+        self.assertIn('other.txt.chunks: 97.656kB in', output)
+        self.assertIn('0B new', output)
+        self.assertTrue(output.splitlines()[-1].startswith('Total: 292.975kB in 60 chunks'), output)
+
+    def test_sampling(self):
+
+        self.write('a', random_bytes(200000, 5))
+        self.write('b', random_bytes(200000, 5))
+        index = os.path.join(self.dir, 'index.txt')
+        create_main([self.tree, '-o', index, '--chunks', '--chunk-avg', '1k'])
+
+        exact = estimate_chunk_dedupe([index + '.chunks'], processes=1)[-1]
+        sampled = estimate_chunk_dedupe([index + '.chunks'], processes=1, sample=4)[-1]
+        self.assertEqual(exact.unique_bytes, 200000)
+        self.assertEqual(sampled.bytes, exact.bytes)
+        self.assertTrue(100000 < sampled.unique_bytes < 300000, sampled.unique_bytes)
+
+    def test_update(self):
+
+        data = random_bytes(100000, 6)
+        self.write('a', data)
+        self.write('b', random_bytes(100000, 7))
+        index = os.path.join(self.dir, 'index.txt')
+        create_main([self.tree, '-o', index, '--chunks', '--chunk-avg', '4k'])
+        before = estimate_chunk_dedupe([index + '.chunks'], processes=1)[-1]
+
+        # Make sure the mtime changes.
+        path = self.write('a', data[:50000] + b'edited' + data[50000:])
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+        create_main([self.tree, '-o', index, '--chunks', '--chunk-avg', '4k', '--update'])
+
+        with open(index + '.chunks') as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(len([x for x in lines if x.startswith('#')]), 1)
+
+        # Only the latest chunks of a count, and b is still there.
+        after = estimate_chunk_dedupe([index + '.chunks'], processes=1)[-1]
+        self.assertEqual(after.bytes, 200006)
+        self.assertTrue(after.unique_bytes - before.unique_bytes < 20000, (before, after))
+        self.assertEqual(sum(int(x.split('\t')[2]) for x in lines[1:] if x.endswith('\tb')), 100000)
+
+        # Chunks of another size can't be mixed in.
+        with self.assertRaises(SystemExit):
+            create_main([self.tree, '-o', index, '--chunks', '--chunk-avg', '8k', '--update'])
+
+    def test_requires_whole_files(self):
+        self.assertRaises(ValueError, Indexer, self.tree, head='1k', chunk_avg='4k')
+        self.assertRaises(ValueError, Indexer, self.tree, chunk_avg='1')
@@ -0,0 +1,558 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+
+from . import *
+
+from uindex import create
+from uindex.changes import Change, iter_changes
+from uindex.create import Indexer, WalkItem, _checksum_path, _elevator, _extent_order, _iter_ranges, _threaded_map, run_sharded
+from uindex.index import Index
+from uindex.merge import walk_sort_key
+
+
+class TestSampledChecksums(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.dir, name), 'wb') as fh:
+            fh.write(data)
+        return WalkItem(self.dir, name)
+
+    def test_ranges(self):
+
+        self.assertEqual(list(_iter_ranges(100)), [(0, None)])
+        self.assertEqual(list(_iter_ranges(100, head=10)), [(0, 10)])
+        self.assertEqual(list(_iter_ranges(100, tail=10)), [(0, None)])
+        self.assertEqual(list(_iter_ranges(100, head=10, tail=10)), [(0, 10), (90, None)])
+        self.assertEqual(list(_iter_ranges(100, head=60, tail=60)), [(0, 60)])
+
+        self.assertEqual(list(_iter_ranges(100, samples=2, sample_size=25)), [(0, None)])
+        self.assertEqual(list(_iter_ranges(1000, samples=4, sample_size=10)), [
+            (0, 10),
+            (127, 10),
+            (372, 10),
+            (617, 10),
+            (862, 10),
+            (990, 10),
+        ])
+
+    def test_interior_change(self):
+
+        data = bytearray(os.urandom(1024 * 1024))
+        a = self.write('a', bytes(data))
+        # The centre of the 5th of 8 interior blocks.
+        data[64 * 1024 + 896 * 1024 * 9 // 16] ^= 0xff
+        b = self.write('b', bytes(data))
+
+        ends = Indexer(self.dir, head='64k', tail='64k')
+        self.assertEqual(_checksum_path(a, ends)[1], _checksum_path(b, ends)[1])
+
+        sampled = Indexer(self.dir, samples=8, sample_size='64k')
+        self.assertEqual(sampled.algo_key, 'sha256,s=8x64k')
+        checksum_a = _checksum_path(a, sampled)[1]
+        checksum_b = _checksum_path(b, sampled)[1]
+        self.assertTrue(checksum_a.startswith('sha256,s=8x64k:'))
+        self.assertNotEqual(checksum_a, checksum_b)
+
+    def test_small_files_include_size(self):
+        item = self.write('small', b'hello')
+        indexer = Indexer(self.dir, samples=4)
+        expected = hashlib.sha256(b'5\nhello').hexdigest()
+        self.assertEqual(_checksum_path(item, indexer)[1], 'sha256,s=4x1M:' + expected)
+
+
+class TestSharding(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.tree = os.path.join(self.dir, 'tree')
+        for i in range(5):
+            for path in ('a.txt', 'B/c.txt', 'b/d/e.txt', 'b/f.txt'):
+                path = os.path.join(self.tree, 'top{}'.format(i), path)
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'w') as fh:
+                    fh.write(path)
+        with open(os.path.join(self.tree, 'z.txt'), 'w') as fh:
+            fh.write('z')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, path):
+        rows = []
+        meta = {}
+        with open(path) as fh:
+            for line in fh:
+                if line.startswith('#'):
+                    kind, data = line.split(None, 1)
+                    meta[kind] = json.loads(data)
+                else:
+                    rows.append(line)
+        return rows, meta
+
+    def assert_sharded(self, shard_by, dirs=False):
+
+        single = os.path.join(self.dir, 'single.txt')
+        with open(single, 'w') as out:
+            Indexer(self.tree, dirs=dirs).run(out)
+
+        sharded = os.path.join(self.dir, 'sharded.txt')
+        run_sharded(sharded, 3, path_to_index=self.tree, shard_by=shard_by, dirs=dirs)
+
+        expected, _ = self.read(single)
+        rows, meta = self.read(sharded)
+        self.assertEqual(len(expected), 21 + (21 if dirs else 0))
+        self.assertEqual(rows, expected)
+        self.assertEqual(meta['#scan-end']['total_count'], 21)
+        self.assertEqual(len(meta['#scan-start']['merged']), 3)
+        self.assertFalse([x for x in os.listdir(self.dir) if 'shard-' in x])
+
+    def test_by_top(self):
+        self.assert_sharded('top')
+
+    def test_by_hash(self):
+        self.assert_sharded('hash')
+
+    def test_hup_with_throttle_control(self):
+
+        control = os.path.join(self.dir, 'throttle')
+        with open(control, 'w') as fh:
+            fh.write('ops=60\n')
+
+        # We (the parent) must survive this, and pass it on to the shards.
+        timer = threading.Timer(0.3, os.kill, (os.getpid(), signal.SIGHUP))
+        timer.start()
+        try:
+            sharded = os.path.join(self.dir, 'sharded.txt')
+            run_sharded(sharded, 2, path_to_index=self.tree, throttle_control=control)
+        finally:
+            timer.cancel()
+
+        rows, meta = self.read(sharded)
+        self.assertEqual(len(rows), 21)
+        self.assertGreater(meta['#scan-end']['throttled_seconds'], 0)
+
+    def test_dirs(self):
+        # Including the row for the top, which no one shard can build.
+        self.assert_sharded('top', dirs=True)
+
+
+class TestChanges(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.tree = os.path.join(self.dir, 'tree')
+        for path in ('a.txt', 'b/c.txt', 'b/d/e.txt', 'f/g.txt', 'h.txt'):
+            self.write(path, path)
+        self.index = os.path.join(self.dir, 'index.txt')
+        with open(self.index, 'w') as out:
+            Indexer(self.tree).run(out)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, data):
+        path = os.path.join(self.tree, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(data)
+
+    def rows(self, path):
+        with open(path) as fh:
+            return [line for line in fh if not line.startswith('#')]
+
+    def test_zfs_diff(self):
+
+        os.unlink(os.path.join(self.tree, 'h.txt'))
+        os.rename(os.path.join(self.tree, 'b'), os.path.join(self.tree, 'b 2'))
+        self.write('a.txt', 'modified')
+        self.write('f/new.txt', 'new')
+
+        t = self.tree
+        diff = '\n'.join((
+            'M\tF\t{}/a.txt'.format(t),
+            '-\tF\t{}/h.txt'.format(t),
+            'R\t/\t{}/b -> {}/b\\00402'.format(t, t),
+            'M\t/\t{}/f'.format(t),
+            '+\tF\t{}/f/new.txt'.format(t),
+            '',
+        ))
+        changes = list(iter_changes(io.StringIO(diff)))
+        self.assertEqual(changes[2], Change('R', '/', t + '/b', t + '/b 2'))
+
+        indexer = Indexer(self.tree)
+        indexer.load_existing(self.index)
+        updated = os.path.join(self.dir, 'updated.txt')
+        with open(updated, 'w') as out:
+            indexer.run_changes(out, changes)
+
+        # Only the modified and new files were read.
+        self.assertEqual(indexer.added_count, 2)
+        self.assertEqual(indexer.total_count, 5)
+
+        expected = os.path.join(self.dir, 'expected.txt')
+        with open(expected, 'w') as out:
+            Indexer(self.tree).run(out)
+        self.assertEqual(self.rows(updated), self.rows(expected))
+
+    def test_zfs_diff_without_types(self):
+
+        os.unlink(os.path.join(self.tree, 'h.txt'))
+        self.write('a.txt', 'modified')
+        self.write('f/new.txt', 'new')
+
+        # Without -F, the top is listed as modified.
+        t = self.tree
+        diff = '\n'.join((
+            'M\t{}/'.format(t),
+            'M\t{}/a.txt'.format(t),
+            '-\t{}/h.txt'.format(t),
+            'M\t{}/f'.format(t),
+            '+\t{}/f/new.txt'.format(t),
+            '',
+        ))
+
+        indexer = Indexer(self.tree)
+        indexer.load_existing(self.index)
+        updated = os.path.join(self.dir, 'updated.txt')
+        with open(updated, 'w') as out:
+            indexer.run_changes(out, iter_changes(io.StringIO(diff)))
+        self.assertEqual(indexer.added_count, 2)
+
+        expected = os.path.join(self.dir, 'expected.txt')
+        with open(expected, 'w') as out:
+            Indexer(self.tree).run(out)
+        self.assertEqual(self.rows(updated), self.rows(expected))
+
+    def test_top_changed(self):
+
+        os.unlink(os.path.join(self.tree, 'h.txt'))
+        self.write('b/d/e.txt', 'modified')
+
+        indexer = Indexer(self.tree)
+        indexer.load_existing(self.index)
+        indexer.apply_changes([Change(None, None, self.tree, None)])
+
+        # Everything is re-examined, but only the changed file is read.
+        self.assertEqual(indexer.added_count, 1)
+        self.assertEqual(sorted(indexer.existing), ['a.txt', 'b/c.txt', 'b/d/e.txt', 'f/g.txt'])
+
+    def test_new_directory_and_contents(self):
+
+        self.write('n/x.txt', 'x')
+        self.write('n/y/z.txt', 'z')
+
+        t = self.tree
+        diff = '\n'.join((
+            'M\t/\t{}'.format(t),
+            '+\tF\t{}/n/y/z.txt'.format(t),
+            '+\t/\t{}/n'.format(t),
+            '+\tF\t{}/n/x.txt'.format(t),
+            '+\t/\t{}/n/y'.format(t),
+            '',
+        ))
+
+        indexer = Indexer(self.tree)
+        indexer.load_existing(self.index)
+        indexer.apply_changes(iter_changes(io.StringIO(diff)))
+
+        # Each new file is read once.
+        self.assertEqual(indexer.added_count, 2)
+        self.assertEqual(indexer.added_bytes, 2)
+        self.assertIn('n/y/z.txt', indexer.existing)
+
+    def test_path_list(self):
+        changes = list(iter_changes(io.StringIO('a\0b c\0')))
+        self.assertEqual([c.path for c in changes], ['a', 'b c'])
+
+
+class TestInodeReuse(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.tree = os.path.join(self.dir, 'tree')
+        os.makedirs(os.path.join(self.tree, 'publish'))
+        for name in ('a', 'b', 'c'):
+            with open(os.path.join(self.tree, name), 'w') as fh:
+                fh.write(name * 100)
+        os.symlink('a', os.path.join(self.tree, 'link'))
+        self.index = os.path.join(self.dir, 'index.txt')
+        with open(self.index, 'w') as out:
+            Indexer(self.tree).run(out)
+
+        # Only what was read this process may be reused.
+        create._checksum_cache.clear()
+        self.read = []
+        self._iter_chunks = create.iter_chunks
+        def iter_chunks(path, *args, **kwargs):
+            self.read.append(os.path.relpath(path, self.tree))
+            return self._iter_chunks(path, *args, **kwargs)
+        create.iter_chunks = iter_chunks
+
+    def tearDown(self):
+        create.iter_chunks = self._iter_chunks
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.tree, name)
+
+    def checksums(self):
+        return dict((e.path, e.raw_checksum) for e in Index(self.index).by_path.values())
+
+    def test_symlink(self):
+        self.assertEqual(self.checksums()['link'],
+            'sha256:' + hashlib.sha256(b'a').hexdigest())
+
+    def test_update(self):
+
+        os.rename(self.path('a'), self.path('moved'))
+        os.link(self.path('b'), self.path('publish/b'))
+        with open(self.path('c'), 'w') as fh:
+            fh.write('changed')
+        with open(self.path('new'), 'w') as fh:
+            fh.write('new')
+
+        indexer = Indexer(self.tree)
+        indexer.load_existing(self.index)
+        with open(self.index, 'a') as out:
+            indexer.run(out)
+
+        # The rename and new hardlink were free.
+        self.assertEqual(sorted(self.read), ['c', 'new'])
+        checksums = self.checksums()
+        self.assertEqual(checksums['moved'], checksums['a'])
+        self.assertEqual(checksums['publish/b'], checksums['b'])
+        self.assertEqual(checksums['c'], 'sha256:' + hashlib.sha256(b'changed').hexdigest())
+
+    def test_changes(self):
+
+        os.link(self.path('b'), self.path('publish/b'))
+        indexer = Indexer(self.tree)
+        indexer.load_existing(self.index)
+        indexer.apply_changes([Change('+', 'F', self.path('publish/b'), None)])
+
+        self.assertEqual(self.read, [])
+        self.assertEqual(indexer.added_count, 0)
+        self.assertEqual(indexer.existing['publish/b'].raw_checksum, indexer.existing['b'].raw_checksum)
+
+    def test_changes_keep_inodes_current(self):
+
+        # As uindex-watch does, with one indexer for many batches.
+        indexer = Indexer(self.tree)
+        indexer.load_existing(self.index)
+
+        with open(self.path('new'), 'w') as fh:
+            fh.write('new')
+        indexer.apply_changes([Change('+', 'F', self.path('new'), None)])
+        self.assertEqual(self.read, ['new'])
+
+        os.link(self.path('new'), self.path('publish/new'))
+        indexer.apply_changes([Change('+', 'F', self.path('publish/new'), None)])
+        self.assertEqual(self.read, ['new'])
+
+        # Deleted files are forgotten.
+        inode = os.stat(self.path('c')).st_ino
+        os.unlink(self.path('c'))
+        indexer.apply_changes([Change('-', 'F', self.path('c'), None)])
+        self.assertNotIn(inode, indexer._existing_inodes)
+
+    def test_other_device(self):
+
+        os.rename(self.path('a'), self.path('moved'))
+        indexer = Indexer(self.tree)
+        indexer.load_existing(self.index)
+        self.assertEqual(indexer.existing_dev, os.stat(self.tree).st_dev)
+
+        # Inode numbers from elsewhere can't be trusted.
+        indexer.existing_dev += 1
+        with open(os.devnull, 'w') as out:
+            indexer.run(out)
+        self.assertEqual(self.read, ['moved'])
+
+    def test_other_parameters(self):
+
+        os.rename(self.path('a'), self.path('moved'))
+        indexer = Indexer(self.tree, checksum_algo='md5')
+        indexer.load_existing(self.index)
+        with open(os.devnull, 'w') as out:
+            indexer.run(out)
+        # Checksums made with other parameters are not reused for the move.
+        self.assertEqual(self.read, ['moved'])
+
+
+class TestDirectoryRows(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_tree(self, name, files):
+        top = os.path.join(self.dir, name)
+        for path, data in files.items():
+            path = os.path.join(top, path)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fh:
+                fh.write(data)
+        return top
+
+    def index(self, top, mode='w', update=None):
+        path = os.path.join(self.dir, os.path.basename(top) + '.txt')
+        indexer = Indexer(top, dirs=True)
+        if update:
+            indexer.load_existing(path)
+        with open(path, mode) as out:
+            indexer.run(out)
+        return path, indexer
+
+    def test_rows(self):
+
+        top = self.make_tree('a', {'x.txt': 'x', 'sub/y.txt': 'yy', 'sub/deep/z.txt': 'zzz'})
+        path, _ = self.index(top)
+
+        entries = list(Index(path))
+        self.assertEqual([(e.path, e.type) for e in entries], [
+            ('x.txt', 'F'),
+            ('sub/y.txt', 'F'),
+            ('sub/deep/z.txt', 'F'),
+            ('sub/deep', '/'),
+            ('sub', '/'),
+            ('.', '/'),
+        ])
+        self.assertEqual([e.size for e in entries[3:]], [3, 5, 6])
+        self.assertEqual([e.checksum_params['n'] for e in entries[3:]], ['1', '2', '3'])
+
+        keys = [walk_sort_key(e.path, e.is_dir) for e in entries]
+        self.assertEqual(keys, sorted(keys))
+
+        # Identical subtrees have identical hashes, wherever they are.
+        other = self.make_tree('b', {'other/y.txt': 'yy', 'other/deep/z.txt': 'zzz'})
+        other_path, _ = self.index(other)
+        other_entries = Index(other_path).by_path
+        self.assertEqual(other_entries['other'].checksum, entries[4].checksum)
+
+    def test_update(self):
+
+        top = self.make_tree('a', {'x.txt': 'x', 'sub/y.txt': 'yy', 'sub/deep/z.txt': 'zzz'})
+        path, _ = self.index(top)
+        self.assertEqual(len(Index(path)), 6)
+
+        # Nothing changed, so nothing is written, and nothing is listed.
+        listed = []
+        original = os.listdir
+        def listdir(path):
+            listed.append(path)
+            return original(path)
+        os.listdir = listdir
+        try:
+            _, indexer = self.index(top, 'a', update=True)
+        finally:
+            os.listdir = original
+        self.assertEqual(listed, [])
+        self.assertEqual(len(Index(path)), 6)
+        self.assertEqual(indexer.total_count, 3)
+
+        # A modification is written along with all of its parents.
+        with open(os.path.join(top, 'sub/deep/z.txt'), 'w') as fh:
+            fh.write('zz')
+        self.index(top, 'a', update=True)
+        self.assertEqual([e.path for e in Index(path)][6:], ['sub/deep/z.txt', 'sub/deep', 'sub', '.'])
+        self.assertEqual(Index(path).by_path['.'].size, 5)
+
+    def test_update_after_delete(self):
+
+        top = self.make_tree('a', {'x.txt': 'x', 'sub/y.txt': 'yy', 'sub/w.txt': 'w'})
+        path, _ = self.index(top)
+        os.unlink(os.path.join(top, 'sub/y.txt'))
+
+        _, indexer = self.index(top, 'a', update=True)
+        self.assertEqual(indexer.total_count, 2)
+        count = len(Index(path))
+
+        # The second time the directory is listed from the index, which
+        # still has the deleted file.
+        _, indexer = self.index(top, 'a', update=True)
+        self.assertEqual(indexer.total_count, 2)
+        self.assertEqual(len(Index(path)), count)
+        with open(path) as fh:
+            end = json.loads(fh.read().splitlines()[-1].split(None, 1)[1])
+        self.assertEqual(end['total_count'], 2)
+
+
+class TestIOOrder(TestCase):
+
+    def test_elevator(self):
+        keys = [5, 1, 9, 3, 7, 2, 8]
+        jobs = list(enumerate((k, ) for k in keys))
+        order = [keys[i] for i, _ in _elevator(iter(jobs), lambda k: k, 4)]
+        # Sweeps upwards through what is in the window, then starts again.
+        self.assertEqual(order, [1, 3, 5, 7, 8, 9, 2])
+
+    def test_results_stay_sorted(self):
+        keys = [5, 1, 9, 3, 7, 2, 8] * 10
+        results = list(_threaded_map(3, lambda k: k, keys, order_key=lambda k: -k, window=8))
+        self.assertEqual(results, keys)
+
+    def test_extent_order(self):
+        dir_ = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(dir_, 'a'), 'wb') as fh:
+                fh.write(b'x' * 65536)
+                fh.flush()
+                os.fsync(fh.fileno())
+            item = WalkItem(dir_, 'a')
+            indexer = Indexer(dir_, max_ops=1000)
+            self.assertIsInstance(_extent_order(item, indexer), int)
+            self.assertLess(indexer.throttle.ops.tokens, 0)
+        finally:
+            shutil.rmtree(dir_)
+
+    def test_reads_in_extent_order(self):
+
+        dir_ = tempfile.mkdtemp()
+        offsets = dict(a=300, b=100, c=None, d=200)
+        for name in offsets:
+            with open(os.path.join(dir_, name), 'w') as fh:
+                fh.write(name)
+
+        read = []
+        def iter_chunks(path, *args, **kwargs):
+            read.append(os.path.basename(path))
+            return original_iter_chunks(path, *args, **kwargs)
+
+        original_iter_chunks = create.iter_chunks
+        original_physical_offset = create.physical_offset
+        create.iter_chunks = iter_chunks
+        create.physical_offset = lambda path: offsets[os.path.basename(path)]
+        create._checksum_cache.clear()
+        try:
+            out = io.StringIO()
+            Indexer(dir_, io_order='extent').run(out)
+        finally:
+            create.iter_chunks = original_iter_chunks
+            create.physical_offset = original_physical_offset
+            shutil.rmtree(dir_)
+
+        # Files without extents fall back to their inode.
+        inode_c = [int(line.split('\t')[1]) for line in out.getvalue().splitlines() if line.endswith('\tc')][0]
+        expected = sorted(offsets, key=lambda name: inode_c if offsets[name] is None else offsets[name])
+        self.assertEqual(read, expected)
+
+        # The index is still in walk order.
+        rows = [line.split('\t')[-1] for line in out.getvalue().splitlines() if not line.startswith('#')]
+        self.assertEqual(rows, ['a', 'b', 'c', 'd'])
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+
+from . import *
+
+from uindex.create import Indexer
+from uindex.exclude import Excluder, translate_glob
+
+
+class TestExcluder(TestCase):
+
+    def test_translate_glob(self):
+        self.assertEqual(translate_glob('*.tmp'), (r'[^/]*\.tmp', False, False))
+        self.assertEqual(translate_glob('cache/'), ('cache', False, True))
+        self.assertEqual(translate_glob('/renders/cache'), ('renders/cache', True, False))
+        self.assertEqual(translate_glob('**/cache'), ('cache', False, False))
+        self.assertEqual(translate_glob('a/**/b'), ('a/(?:.*/)?b', True, False))
+        self.assertRaises(ValueError, translate_glob, '!keep')
+
+    def test_matching(self):
+
+        excluder = Excluder('/root', regexes=['core\\.\\d+', '/shows/tmp'], globs=['*.tmp', 'cache/', '/renders/*/scratch'])
+
+        top = excluder.for_dir('/root')
+        self.assertTrue(top('.DS_Store'))
+        self.assertTrue(top('core.123'))
+        self.assertTrue(top('x.tmp'))
+        self.assertFalse(top('cache'))
+        self.assertTrue(top('cache', True))
+        self.assertFalse(top('x.txt'))
+
+        self.assertTrue(excluder.for_dir('/root/shows')('tmp'))
+        self.assertFalse(excluder.for_dir('/root/other')('tmp'))
+        self.assertTrue(excluder.for_dir('/root/renders/a')('scratch'))
+        self.assertFalse(excluder.for_dir('/root/renders/a/b')('scratch'))
+
+        self.assertTrue(excluder.excludes_path('/root/a/cache/b.txt'))
+        self.assertTrue(excluder.excludes_path('/root/a/.git/config'))
+        self.assertFalse(excluder.excludes_path('/root/a/cache'))
+        self.assertTrue(excluder.excludes_path('/root/a/cache', True))
+        self.assertFalse(excluder.excludes_path('/root/a/b.txt'))
+
+    def test_backreferences(self):
+
+        # Each would be renumbered (or collide) if joined with the others.
+        excluder = Excluder('/root', regexes=['x(y)', r'(a)\1', r'(?P<c>b)(?P=c)', r'(?P<c>d)'], include_dotfiles=True)
+        top = excluder.for_dir('/root')
+        self.assertTrue(top('aa'))
+        self.assertFalse(top('ab'))
+        self.assertTrue(top('bb'))
+        self.assertTrue(top('d'))
+        self.assertTrue(top('xy'))
+
+        self.assertRaises(ValueError, Excluder, '/root', regexes=['(unclosed'])
+
+
+class TestIndexerExcludes(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for path in ('a.txt', 'b.tmp', 'cache/c.txt', 'shows/tmp/d.txt', 'shows/e.txt', '.hidden'):
+            path = os.path.join(self.dir, path)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_pruning(self):
+
+        stated = []
+        original = os.lstat
+        def lstat(path):
+            stated.append(os.path.relpath(path, self.dir))
+            return original(path)
+
+        indexer = Indexer(self.dir, excludes=['/shows/tmp'], exclude_globs=['*.tmp', 'cache/'])
+        os.lstat = lstat
+        try:
+            paths = [item.rel_path for item in indexer._iter_file_paths()]
+        finally:
+            os.lstat = original
+
+        self.assertEqual(paths, ['a.txt', 'shows/e.txt'])
+        for path in ('b.tmp', 'shows/tmp', 'cache/c.txt', '.hidden'):
+            self.assertNotIn(path, stated)
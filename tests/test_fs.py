@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+
+from . import *
+
+from uindex.create import _iter_ranges
+from uindex.fs import IO_MODES, iter_chunks, path_cached_pages
+
+
+class TestIterChunks(TestCase):
+
+    def setUp(self):
+        # Not in /tmp, which may be a tmpfs (which doesn't support O_DIRECT).
+        self.dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(__file__)))
+        self.path = os.path.join(self.dir, 'data')
+        self.data = os.urandom(3 * 1024 * 1024 + 12345)
+        with open(self.path, 'wb') as fh:
+            fh.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_modes_agree(self):
+
+        size = len(self.data)
+        for ranges in (
+            [(0, None)],
+            [(0, 1000), (size - 5000, None)],
+            list(_iter_ranges(size, samples=5, sample_size=10000)),
+        ):
+            expected = b''.join(
+                self.data[offset:None if length is None else offset + length]
+                for offset, length in ranges
+            )
+            for mode in IO_MODES:
+                data = b''.join(bytes(x) for x in iter_chunks(self.path, ranges, mode))
+                self.assertEqual(data, expected, mode)
+
+    def test_cached_pages(self):
+        resident, total = path_cached_pages(self.path)
+        self.assertEqual(total, (len(self.data) + 4095) // 4096)
+        self.assertTrue(0 <= resident <= total)
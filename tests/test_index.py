@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+
+from . import *
+
+from uindex import Index
+from uindex import index as index_module
+
+
+INDEX = '''#scan-start {"columns": ["checksum", "inode", "type", "perms", "size", "uid", "gid", "mtime", "ctime", "path"]}
+sha256:aaa\t1\tF\t644\t10\t0\t0\t1.0\t1.0\ta/one
+sha256:bbb\t2\tF\t644\t20\t0\t0\t1.0\t1.0\ta/two
+sha256:aaa\t3\tF\t644\t10\t0\t0\t1.0\t1.0\tb/three
+sha256:ccc\t2\tF\t644\t20\t0\t0\t2.0\t2.0\ta/two
+'''
+
+
+class TestIndex(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'index.txt')
+        with open(self.path, 'w') as fh:
+            fh.write(INDEX)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_secondary_indexes(self):
+
+        index = Index(self.path)
+        self.assertEqual(len(index), 4)
+
+        self.assertEqual(index.by_path['a/two'].checksum, 'ccc')
+        self.assertEqual(sorted(e.path for e in index.by_checksum[('aaa', 10)]), ['a/one', 'b/three'])
+        self.assertEqual(len(index.by_inode[2]), 2)
+        self.assertEqual(sorted(index.by_directory), ['a', 'b'])
+        self.assertEqual([e.checksum for e in index.iter_prefix('a/')], ['aaa', 'bbb', 'ccc'])
+
+    def test_filters(self):
+        index = Index(self.path, prepend_path='x', search_path='three')
+        self.assertEqual([e.path for e in index], ['x/b/three'])
+
+    def test_snapshot(self):
+
+        Index(self.path, snapshot=True, lazy=False)
+        self.assertTrue(os.path.exists(self.path + '.snapshot'))
+
+        # Loads from the snapshot while the source is unchanged.
+        index = Index(self.path, snapshot=True)
+        self.assertEqual(len(index._load_snapshot()), 4)
+
+        # Different filters invalidate it.
+        index = Index(self.path, snapshot=True, search_path='three')
+        self.assertIs(index._load_snapshot(), None)
+        self.assertEqual(len(index), 1)
+
+        # As do snapshots of entries from another version.
+        Index(self.path, snapshot=True, lazy=False)
+        version = index_module.SNAPSHOT_VERSION
+        index_module.SNAPSHOT_VERSION = version + 1
+        try:
+            self.assertIs(Index(self.path, snapshot=True)._load_snapshot(), None)
+        finally:
+            index_module.SNAPSHOT_VERSION = version
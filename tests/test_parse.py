@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+
+from . import *
+
+from uindex import Index
+from uindex.parse import iter_entries, load_entries, split_ranges
+
+
+def write_index(path):
+    # Two segments, where the columns change between them.
+    with open(path, 'w') as fh:
+        fh.write('#scan-start {"columns": ["checksum", "perms", "size", "uid", "gid", "mtime", "path"]}\n')
+        for i in range(500):
+            fh.write('sha256:{:04x}\t644\t{}\t0\t0\t1.0\told/{}\n'.format(i, i, i))
+        fh.write('#scan-end {}\n')
+        fh.write('#scan-start {"columns": ["checksum", "inode", "type", "perms", "size", "uid", "gid", "mtime", "ctime", "path"]}\n')
+        for i in range(500):
+            fh.write('sha256:{:04x}\t{}\tF\t644\t{}\t0\t0\t1.0\t2.0\tnew/{}\n'.format(i, i, i, i))
+        fh.write('#scan-end {}\n')
+
+
+class TestParallelParse(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'index.txt')
+        write_index(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def summary(self, entries):
+        return [(e.path, e.checksum, e.size, e.inode, e.ctime) for e in entries]
+
+    def test_ranges(self):
+        ranges = split_ranges(self.path, 8, min_size=1)
+        self.assertEqual(len(ranges), 8)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(self.path))
+        self.assertEqual(len(ranges[1][2]), 7)
+        self.assertEqual(len(ranges[-1][2]), 10)
+        with open(self.path, 'rb') as fh:
+            data = fh.read()
+        for start, end, _ in ranges:
+            self.assertEqual(data[start - 1:start] or b'\n', b'\n')
+
+    def test_matches_serial(self):
+
+        for filters in ({}, dict(prepend_path='x', search_path='/1', invert_search=True), dict(pop_path=1)):
+            with open(self.path) as fh:
+                serial = list(iter_entries(fh, **filters))
+            parallel = load_entries(self.path, processes=3, min_chunk_size=1, **filters)
+            self.assertTrue(serial)
+            self.assertEqual(self.summary(parallel), self.summary(serial))
+
+        index = Index(self.path, processes=3)
+        self.assertEqual(len(index), 1000)
+        self.assertEqual(index.by_path['new/7'].inode, 7)
+
+    def test_carriage_returns(self):
+
+        # Only newlines end rows, however the index is read.
+        with open(self.path, 'a') as fh:
+            fh.write('sha256:ffff\t1\tF\t644\t1\t0\t0\t1.0\t2.0\tnew/a\rb\n')
+
+        serial = Index(self.path)
+        self.assertEqual(len(serial), 1001)
+        self.assertEqual(self.summary(load_entries(self.path, processes=3, min_chunk_size=1)), self.summary(serial))
+        self.assertEqual(serial.entries[-1].path, 'new/a\rb')
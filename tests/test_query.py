@@ -0,0 +1,135 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+from . import *
+
+from uindex import Index
+from uindex import entry as entry_module
+from uindex.query import Query, main, parse_predicate, parse_time
+
+
+INDEX = '''#scan-start {"columns": ["checksum", "inode", "type", "perms", "size", "uid", "gid", "mtime", "ctime", "path"], "root": "/data"}
+sha256:aaa\t1\tF\t644\t10\t0\t0\t1000.0\t1000.0\tshows/xyz/one
+sha256:bbb\t2\tF\t644\t20000000000\t501\t20\t2000.0\t2000.0\tshows/xyz/two
+sha256:ccc\t3\tF\t644\t30\t501\t20\t3000.0\t3000.0\tshows/xyzzy/three
+tree,sha256,n=2,m=2:ddd\t4\t/\t755\t0\t0\t0\t3000.0\t3000.0\tshows/xyz
+sha256:aaa\t5\tF\t644\t10\t0\t0\t4000.0\t4000.0\tother/four
+'''
+
+
+class TestQuery(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'index.txt')
+        with open(self.path, 'w') as fh:
+            fh.write(INDEX)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def query(self, *exprs):
+        return [e.path for e in Query.parse(exprs).scan(self.path)]
+
+    def test_parse(self):
+
+        self.assertEqual(parse_predicate('size>10G').value, 10 * 1024 ** 3)
+        self.assertEqual(parse_predicate('mtime >= 1000').value, 1000.0)
+        self.assertEqual(parse_predicate('prefix=shows/xyz/').value, 'shows/xyz')
+        self.assertEqual(parse_time('2024-06-01T12:30'), parse_time('2024-06-01 12:30'))
+
+        self.assertRaises(ValueError, parse_predicate, 'size')
+        self.assertRaises(ValueError, parse_predicate, 'colour=red')
+        self.assertRaises(ValueError, parse_predicate, 'path<x')
+        self.assertRaises(ValueError, parse_predicate, 'mtime>yesterday')
+
+    def test_conditions(self):
+
+        self.assertEqual(self.query('size>1G'), ['shows/xyz/two'])
+        self.assertEqual(self.query('mtime>=2000', 'mtime<4000', 'type=F'), ['shows/xyz/two', 'shows/xyzzy/three'])
+        self.assertEqual(self.query('uid=501', 'gid!=20'), [])
+        self.assertEqual(self.query('type=/'), ['shows/xyz'])
+        self.assertEqual(self.query('path=*/t*'), ['shows/xyz/two', 'shows/xyzzy/three'])
+        self.assertEqual(self.query('prefix=shows/xyz'), ['shows/xyz/one', 'shows/xyz/two', 'shows/xyz'])
+        self.assertEqual(self.query('prefix!=shows'), ['other/four'])
+        self.assertEqual(self.query('checksum=aaa'), ['shows/xyz/one', 'other/four'])
+
+        checksums = os.path.join(self.dir, 'checksums')
+        with open(checksums, 'w') as fh:
+            fh.write('bbb\nsha256:ccc\n')
+        self.assertEqual(self.query('checksum@' + checksums), ['shows/xyz/two', 'shows/xyzzy/three'])
+        self.assertEqual(len(self.query('checksum!@' + checksums)), 3)
+
+        # Another index works as a set of checksums too.
+        self.assertEqual(len(self.query('checksum@' + self.path)), 5)
+
+    def test_entries_only_for_matches(self):
+
+        built = []
+        original = entry_module.Entry.__init__
+        def init(self, *args, **kwargs):
+            built.append(kwargs.get('path'))
+            original(self, *args, **kwargs)
+
+        entry_module.Entry.__init__ = init
+        try:
+            self.assertEqual(self.query('size>1G'), ['shows/xyz/two'])
+        finally:
+            entry_module.Entry.__init__ = original
+        self.assertEqual(built, ['shows/xyz/two'])
+
+    def test_missing_columns(self):
+
+        legacy = os.path.join(self.dir, 'legacy.txt')
+        with open(legacy, 'w') as fh:
+            fh.write('sha256:aaa\t644\t10\t0\t0\t1.0\ta/one\n')
+
+        query = Query.parse(['size=10'])
+        self.assertEqual([e.path for e in query.scan(legacy)], ['a/one'])
+        query = Query.parse(['ctime>0'])
+        self.assertEqual(list(query.scan(legacy)), [])
+
+    def test_search_index(self):
+
+        query = Query.parse(['prefix=shows/xyz', 'type=F'])
+        self.assertEqual(query.prefix, 'shows/xyz')
+        index = Index(self.path)
+        self.assertEqual([e.path for e in query.search(index)], ['shows/xyz/one', 'shows/xyz/two'])
+
+    def test_parallel_scan(self):
+
+        with open(self.path, 'a') as fh:
+            for i in range(500):
+                fh.write('sha256:eee\t{0}\tF\t644\t{0}\t0\t0\t1.0\t1.0\tmore/{0}\n'.format(i))
+
+        query = Query.parse(['size>=250', 'prefix=more'])
+        entries = list(query.scan(self.path, processes=3, min_chunk_size=1024))
+        self.assertEqual([e.size for e in entries], list(range(250, 500)))
+
+    def test_subindex(self):
+
+        out = os.path.join(self.dir, 'sub.txt')
+        main([self.path, 'prefix=shows', 'type=F', '-o', out])
+
+        index = Index(out)
+        self.assertEqual([e.path for e in index], ['shows/xyz/one', 'shows/xyz/two', 'shows/xyzzy/three'])
+        self.assertEqual(index.entries[1].size, 20000000000)
+        with open(out) as fh:
+            header = fh.readline()
+        self.assertIn('"root": "/data"', header)
+        self.assertIn('"query": ["prefix=shows", "type=F"]', header)
+
+    def test_columns(self):
+
+        out = io.StringIO()
+        stdout = sys.stdout
+        sys.stdout = out
+        try:
+            main([self.path, 'checksum=aaa', '-c', 'size,path'])
+            main([self.path, 'checksum=aaa', '--count'])
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(out.getvalue(), '10\tshows/xyz/one\n10\tother/four\n2\t20\n')
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import *
+
+from uindex import entry as entry_module
+from uindex.report import Columns, np
+
+
+INDEX = '''#scan-start {"columns": ["checksum", "inode", "type", "perms", "size", "uid", "gid", "mtime", "ctime", "path"]}
+sha256:aaa\t1\tF\t644\t100\t1\t10\t1000.0\t1.0\tshows/x/a.exr
+sha256:aaa\t2\tF\t644\t100\t1\t10\t1000.0\t1.0\tshows/y/a.EXR
+sha256:bbb\t3\tF\t644\t5000\t2\t10\t1000.0\t1.0\tshows/y/b.mov
+sha256:aaa\t4\tF\t644\t100\t2\t20\t1000.0\t1.0\tlib/c.exr
+sha256:ccc\t5\tF\t644\t7\t2\t20\t1000.0\t1.0\treadme
+tree,sha256,n=2,m=1.0:ddd\t6\t/\t755\t5200\t1\t10\t1000.0\t1.0\tshows/y
+'''
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestReport(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'index.txt')
+        with open(self.path, 'w') as fh:
+            fh.write(INDEX)
+        self.columns = Columns.load(self.path, depth=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_rollups(self):
+
+        columns = self.columns
+        self.assertEqual(len(columns), 5)
+
+        self.assertEqual(columns.report('du', 1), [('shows', 5200, 3), ('lib', 100, 1), ('.', 7, 1)])
+        self.assertEqual(columns.report('du', 2)[0], ('shows/y', 5100, 2))
+        self.assertEqual(columns.report('uid'), [(2, 5107, 3), (1, 200, 2)])
+        self.assertEqual(columns.report('ext'), [('mov', 5000, 1), ('exr', 300, 3), ('', 7, 1)])
+
+    def test_histograms(self):
+
+        age = self.columns.report('age', now=1000.0 + 2 * 24 * 60 * 60)
+        self.assertEqual(age[1], ('< 1 week', 5307, 5))
+
+        size = self.columns.report('size')
+        self.assertEqual(size[0], ('< 4kB', 307, 4))
+        self.assertEqual(size[1], ('< 64kB', 5000, 1))
+
+    def test_dupes(self):
+        # The first copy (in the index) is the original.
+        self.assertEqual(list(self.columns.duplicates()), [False, True, False, True, False])
+        self.assertEqual(self.columns.report('dupes'), [('shows/y', 100, 1), ('lib', 100, 1)])
+
+    def test_latest_rows(self):
+
+        with open(self.path, 'a') as fh:
+            # A file that changed, and one which became a directory.
+            fh.write('sha256:eee\t5\tF\t644\t70\t2\t20\t1000.0\t2.0\treadme\n')
+            fh.write('tree,sha256,n=0,m=1.0:fff\t4\t/\t755\t0\t2\t20\t1000.0\t2.0\tlib/c.exr\n')
+
+        columns = Columns.load(self.path)
+        self.assertEqual(len(columns), 4)
+        self.assertEqual(columns.report('du', 1), [('shows', 5200, 3), ('.', 70, 1)])
+
+    def test_no_entries(self):
+
+        with open(self.path, 'a') as fh:
+            for i in range(500):
+                fh.write('sha256:{0:03d}\t{0}\tF\t644\t{0}\t3\t30\t1.0\t1.0\tmore/{0}.txt\n'.format(i))
+
+        original = entry_module.Entry.__init__
+        def init(self, *args, **kwargs):
+            raise AssertionError("built an entry")
+
+        entry_module.Entry.__init__ = init
+        try:
+            serial = Columns.load(self.path)
+            parallel = Columns.load(self.path, processes=3, min_chunk_size=1024)
+        finally:
+            entry_module.Entry.__init__ = original
+
+        self.assertEqual(len(parallel), 505)
+        for name in ('size', 'mtime', 'uid', 'gid'):
+            self.assertEqual(getattr(parallel, name).tolist(), getattr(serial, name).tolist())
+        self.assertEqual(parallel.report('ext'), serial.report('ext'))
+        self.assertEqual(parallel.report('du', 1)[0], ('more', sum(range(500)), 500))
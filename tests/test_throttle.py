@@ -0,0 +1,67 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from . import *
+
+from uindex.create import Indexer
+from uindex.throttle import Throttle, TokenBucket, read_control_file
+
+
+class TestThrottle(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_bucket(self):
+
+        bucket = TokenBucket()
+        self.assertEqual(bucket.take(1000000), 0)
+
+        bucket.set_rate(1000)
+        start = time.time()
+        slept = bucket.take(100) + bucket.take(100)
+        self.assertGreater(slept, 0.15)
+        self.assertGreater(time.time() - start, 0.15)
+
+    def test_control_file(self):
+
+        path = os.path.join(self.dir, 'throttle')
+        with open(path, 'w') as fh:
+            fh.write('# Daytime budget.\nbytes=10M\nops=none\n')
+        self.assertEqual(read_control_file(path), dict(bytes=10 * 1024 * 1024, ops=None))
+
+        throttle = Throttle(ops_per_sec=5, control_path=path)
+        throttle.op()
+        self.assertEqual(throttle.bytes_per_sec, 10 * 1024 * 1024)
+        self.assertIs(throttle.ops_per_sec, None)
+
+        # Removing it restores the original rates.
+        os.unlink(path)
+        throttle.request_reload()
+        throttle.op()
+        self.assertIs(throttle.bytes_per_sec, None)
+        self.assertEqual(throttle.ops_per_sec, 5)
+
+    def test_indexer_reports_throttling(self):
+
+        tree = os.path.join(self.dir, 'tree')
+        os.makedirs(tree)
+        for i in range(4):
+            with open(os.path.join(tree, 'file{}'.format(i)), 'wb') as fh:
+                fh.write(b'x' * 50000)
+
+        indexer = Indexer(tree, max_bytes=1000000)
+        out = io.StringIO()
+        indexer.run(out, threads=2)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len([x for x in lines if not x.startswith('#')]), 4)
+        end = json.loads(lines[-1].split(' ', 1)[1])
+        self.assertGreater(end['throttled_seconds'], 0.1)
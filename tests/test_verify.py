@@ -0,0 +1,81 @@
+import io
+import os
+import shutil
+import tempfile
+
+from . import *
+
+from uindex.create import Indexer
+from uindex.verify import CHANGED, FAIL, MISSING, OK, Verifier, read_history
+
+
+class TestVerify(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.tree = os.path.join(self.dir, 'tree')
+        os.makedirs(self.tree)
+        for name in 'abcd':
+            self.write(name, name * 1000)
+        self.index = os.path.join(self.dir, 'index.txt')
+        with open(self.index, 'w') as out:
+            Indexer(self.tree).run(out)
+        # A segment with different parameters.
+        self.write('e', 'e' * 100000)
+        with open(self.index, 'a') as out:
+            Indexer(self.tree, head='1k', tail='1k', samples=2, sample_size='1k').run(out)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.tree, name), 'w') as fh:
+            fh.write(data)
+
+    def test_statuses(self):
+
+        counts = Verifier(self.index).run(threads=2)
+        self.assertEqual(counts[OK], 5)
+
+        # Rot, which doesn't touch the mtime.
+        path = os.path.join(self.tree, 'a')
+        st = os.stat(path)
+        self.write('a', 'x' + 'a' * 999)
+        os.utime(path, (st.st_atime, st.st_mtime))
+
+        # Rot in the middle of the sampled file, under a sample.
+        path = os.path.join(self.tree, 'e')
+        st = os.stat(path)
+        with open(path, 'r+') as fh:
+            fh.seek(100000 // 4)
+            fh.write('x')
+        os.utime(path, (st.st_atime, st.st_mtime))
+
+        os.unlink(os.path.join(self.tree, 'b'))
+        self.write('c', 'changed')
+
+        out = io.StringIO()
+        counts = Verifier(self.index).run(out=out)
+        self.assertEqual((counts[OK], counts[FAIL], counts[MISSING], counts[CHANGED]), (1, 2, 1, 1))
+        self.assertEqual(sorted(out.getvalue().splitlines()), ['CHANGED\tc', 'FAIL\ta', 'FAIL\te', 'MISSING\tb'])
+
+    def test_rotation(self):
+
+        verifier = Verifier(self.index)
+        self.assertEqual(verifier.run(percent=40)[OK], 2)
+        first = set(read_history(self.index + '.verify'))
+        self.assertEqual(len(first), 2)
+
+        # The next run does the least recently verified.
+        Verifier(self.index).run(percent=60)
+        self.assertEqual(len(read_history(self.index + '.verify')), 5)
+
+        self.assertEqual(Verifier(self.index).run(time_budget=0)[OK], 0)
+
+    def test_cost(self):
+        verifier = Verifier(self.index)
+        by_path = verifier.index.by_path
+        self.assertEqual(verifier.cost((by_path['a'], OK)), 1000)
+        # Only the size, head, tail, and samples of the sampled file are read.
+        self.assertEqual(verifier.cost((by_path['e'], FAIL)), 4096)
+        self.assertEqual(verifier.cost((by_path['b'], MISSING)), 0)
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from . import *
+
+from uindex.create import Indexer
+from uindex.index import Index
+from uindex.watch import IN_MOVED_FROM, IN_MOVED_TO, Watcher
+
+
+class TestWatcher(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.tree = os.path.join(self.dir, 'tree')
+        os.makedirs(os.path.join(self.tree, 'sub'))
+        self.write('a.txt', 'a')
+        self.write('sub/b.txt', 'b')
+        self.index = os.path.join(self.dir, 'index.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, data):
+        with open(os.path.join(self.tree, path), 'w') as fh:
+            fh.write(data)
+
+    def wait_for(self, func, timeout=10):
+        end = time.time() + timeout
+        while time.time() < end:
+            try:
+                value = func()
+            except (IOError, OSError):
+                value = None
+            if value:
+                return value
+            time.sleep(0.05)
+        self.fail('timed out')
+
+    def paths(self):
+        return sorted(e.path for e in Index(self.index))
+
+    def test_watch(self):
+
+        watcher = Watcher(Indexer(self.tree), self.index, debounce=0.1, checkpoint=0)
+        thread = threading.Thread(target=watcher.run)
+        thread.start()
+        try:
+
+            self.wait_for(lambda: self.paths() == ['a.txt', 'sub/b.txt'])
+
+            os.makedirs(os.path.join(self.tree, 'new'))
+            self.write('new/c.txt', 'c')
+            os.rename(os.path.join(self.tree, 'sub'), os.path.join(self.tree, 'moved'))
+            os.unlink(os.path.join(self.tree, 'a.txt'))
+
+            self.wait_for(lambda: self.paths() == ['moved/b.txt', 'new/c.txt'])
+
+        finally:
+            watcher.stop()
+            thread.join()
+
+    def test_existing_index(self):
+
+        with open(self.index, 'w') as out:
+            Indexer(self.tree).run(out)
+
+        # Changes while the watcher wasn't running.
+        os.unlink(os.path.join(self.tree, 'a.txt'))
+        self.write('sub/b.txt', 'changed')
+        self.write('sub/c.txt', 'c')
+
+        indexer = Indexer(self.tree)
+        watcher = Watcher(indexer, self.index, debounce=0.1, checkpoint=0)
+        thread = threading.Thread(target=watcher.run)
+        thread.start()
+        try:
+            self.wait_for(lambda: watcher.checkpoint_count)
+            self.assertEqual(self.paths(), ['sub/b.txt', 'sub/c.txt'])
+            self.assertEqual(indexer.added_count, 2)
+        finally:
+            watcher.stop()
+            thread.join()
+
+    def test_moves_out_of_tree(self):
+
+        watcher = Watcher(Indexer(self.tree), self.index, debounce=0)
+        watcher.watches[1] = self.tree
+
+        watcher._handle(1, IN_MOVED_FROM, 10, 'a.txt')
+        watcher._handle(1, IN_MOVED_FROM, 11, 'gone.txt')
+        watcher._handle(1, IN_MOVED_TO, 10, 'c.txt')
+        self.assertEqual(list(watcher.renames), [11])
+
+        changes = watcher._take_due()
+        self.assertEqual(watcher.renames, {})
+        self.assertEqual(sorted((c.path, c.new_path or '') for c in changes), [
+            (os.path.join(self.tree, 'a.txt'), ''),
+            (os.path.join(self.tree, 'a.txt'), os.path.join(self.tree, 'c.txt')),
+            (os.path.join(self.tree, 'gone.txt'), ''),
+        ])
@@ -0,0 +1,140 @@
+from __future__ import print_function
+
+import math
+import time
+
+
+DEFAULT_MAX_THREADS = 64
+
+
+def parse_threads(x):
+    """Parse a thread count: an integer, ``auto``, or ``auto:MAX``."""
+    if x == 'auto' or x.startswith('auto:'):
+        if x != 'auto' and int(x[5:]) < 1:
+            raise ValueError("Thread limit must be at least 1.", x)
+        return x
+    count = int(x)
+    if count < 1:
+        raise ValueError("Thread count must be at least 1.", x)
+    return count
+
+
+class Autotuner(object):
+
+    """Hill-climbs the size of a worker pool on measured throughput.
+
+    Completed jobs are :meth:`record`-ed, and every ``interval`` seconds
+    :meth:`poll` compares throughput (the geometric mean of jobs/s and
+    bytes/s) with the previous interval. If it improved we keep moving the
+    same way, if it got worse we turn around, and if it didn't change we
+    shed threads which aren't helping. If job latency has risen well above
+    the best we have seen without a throughput gain, the storage is
+    congested and we back off.
+
+    :param int min_threads: The fewest threads to run.
+    :param int max_threads: The most threads to run.
+    :param int start: How many threads to start with.
+    :param float interval: Seconds between adjustments.
+    :param cost: Function of a job's result to the number of bytes it read.
+    :param float tolerance: Relative change in throughput which is considered noise.
+    :param float latency_factor: How far latency may rise before we back off.
+    :param log: Function to call with a message on each adjustment.
+
+    """
+
+    def __init__(self, min_threads=1, max_threads=DEFAULT_MAX_THREADS, start=4, interval=2.0,
+        cost=None, tolerance=0.05, latency_factor=2.0, log=None):
+
+        self.min_threads = int(min_threads)
+        self.max_threads = max(self.min_threads, int(max_threads))
+        self.threads = max(self.min_threads, min(self.max_threads, int(start)))
+        self.interval = float(interval)
+        self.cost = cost
+        self.tolerance = tolerance
+        self.latency_factor = latency_factor
+        self.log = log
+
+        self.direction = 1
+        self.last_score = None
+        self.best_latency = None
+
+        # (threads, jobs/s, bytes/s, latency) for each interval.
+        self.history = []
+
+        self._reset()
+
+    @classmethod
+    def from_spec(cls, spec, **kwargs):
+        """Build from ``auto`` or ``auto:MAX`` (see :func:`parse_threads`)."""
+        if spec != 'auto':
+            kwargs['max_threads'] = int(spec.split(':', 1)[1])
+        return cls(**kwargs)
+
+    def _reset(self):
+        self.window_start = time.time()
+        self.jobs = 0
+        self.bytes = 0
+        self.latency = 0
+
+    def record(self, result, elapsed):
+        """Record a completed job, which took ``elapsed`` seconds."""
+        self.jobs += 1
+        self.latency += elapsed
+        if self.cost is not None:
+            self.bytes += self.cost(result)
+
+    def poll(self):
+        """Return how many threads should be running now."""
+
+        span = time.time() - self.window_start
+        if span < self.interval:
+            return self.threads
+
+        # Not enough happened to judge by (e.g. the walker is the bottleneck).
+        if self.jobs < self.threads:
+            if span > 4 * self.interval:
+                self._reset()
+            return self.threads
+
+        jobs_rate = self.jobs / span
+        bytes_rate = self.bytes / span
+        latency = self.latency / self.jobs
+        score = math.sqrt(jobs_rate * max(bytes_rate, 1.0))
+        self.history.append((self.threads, jobs_rate, bytes_rate, latency))
+
+        # Slowly forget the best latency, since the workload changes as we
+        # move through the tree.
+        if self.best_latency is None:
+            self.best_latency = latency
+        else:
+            self.best_latency = min(latency, self.best_latency * 1.1)
+
+        last = self.last_score
+        improved = last is not None and score > last * (1 + self.tolerance)
+        worse = last is not None and score < last * (1 - self.tolerance)
+        congested = latency > self.best_latency * self.latency_factor
+
+        step = max(1, self.threads // 4)
+        if congested and not improved:
+            self.direction = -1
+        elif last is None or improved:
+            pass
+        elif worse:
+            self.direction = -self.direction
+        else:
+            # More threads didn't help (or fewer didn't hurt).
+            self.direction = -1
+
+        threads = max(self.min_threads, min(self.max_threads, self.threads + self.direction * step))
+        if threads == self.threads and last is not None and not congested:
+            # Pinned at a limit; probe the other way next time.
+            self.direction = -self.direction
+
+        if self.log and threads != self.threads:
+            self.log('# threads: {} -> {} ({:.1f} files/s, {:.1f} MB/s, {:.1f}ms latency)'.format(
+                self.threads, threads, jobs_rate, bytes_rate / 1e6, 1000 * latency))
+
+        self.last_score = score
+        self.threads = threads
+        self._reset()
+        return threads
@@ -0,0 +1,115 @@
+from __future__ import print_function
+
+import collections
+import re
+
+
+# A change to a path. The kind and type are from `zfs diff` (e.g. "M" and
+# "F"), or None if not known. Only renames have a new_path.
+Change = collections.namedtuple('Change', 'kind type path new_path')
+
+
+def _unescape_zfs(path):
+    # `zfs diff` escapes whitespace and non-printable bytes as "\\0ooo".
+    if '\\' not in path:
+        return path
+    raw = re.sub(br'\\([0-7]{4})', lambda m: bytes((int(m.group(1), 8), )), path.encode('utf8'))
+    return raw.decode('utf8', 'surrogateescape')
+
+
+def iter_zfs_diff(fh):
+    """Parse `zfs diff` output, with or without its ``-F`` type column."""
+
+    for line_i, line in enumerate(fh):
+
+        line = line.rstrip('\n')
+        if not line:
+            continue
+
+        parts = line.split('\t')
+        if len(parts) == 2:
+            kind, path = parts
+            type_ = None
+        elif len(parts) == 3:
+            kind, type_, path = parts
+        else:
+            raise ValueError("Could not parse zfs diff line {}.".format(line_i), line)
+
+        new_path = None
+        if kind == 'R':
+            path, new_path = path.split(' -> ', 1)
+            new_path = _unescape_zfs(new_path)
+
+        yield Change(kind, type_, _unescape_zfs(path), new_path)
+
+
+def iter_path_list(fh, sep='\n'):
+    """Parse a list of paths (e.g. from ``find -print0``) which may have changed."""
+
+    if sep == '\n':
+        for line in fh:
+            line = line.rstrip('\n')
+            if line:
+                yield Change(None, None, line, None)
+        return
+
+    buf = ''
+    while True:
+        chunk = fh.read(65536)
+        if not chunk:
+            break
+        buf += chunk
+        paths = buf.split(sep)
+        buf = paths.pop()
+        for path in paths:
+            if path:
+                yield Change(None, None, path, None)
+    if buf:
+        yield Change(None, None, buf, None)
+
+
+def iter_changes(fh, format='auto'):
+    """Parse a change list in the given format ('zfs', 'lines', 'nul', or 'auto')."""
+
+    if format == 'auto':
+        head = fh.read(65536)
+        if '\0' in head:
+            format = 'nul'
+        elif re.match(r'^[-+MR]\t', head):
+            format = 'zfs'
+        else:
+            format = 'lines'
+        fh = _Prefixed(head, fh)
+
+    if format == 'zfs':
+        return iter_zfs_diff(fh)
+    if format == 'lines':
+        return iter_path_list(fh)
+    if format == 'nul':
+        return iter_path_list(fh, '\0')
+    raise ValueError("Unknown change list format.", format)
+
+
+class _Prefixed(object):
+
+    """A file-like object with some already consumed data put back in front."""
+
+    def __init__(self, head, fh):
+        self.head = head
+        self.fh = fh
+
+    def read(self, size=-1):
+        if self.head:
+            out, self.head = self.head, ''
+            return out
+        return self.fh.read(size)
+
+    def __iter__(self):
+        if self.head:
+            rest = self.fh.readline()
+            lines = (self.head + rest).splitlines(True)
+            self.head = ''
+            for line in lines:
+                yield line
+        for line in self.fh:
+            yield line
@@ -0,0 +1,331 @@
+from __future__ import print_function
+
+import collections
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .parse import MIN_CHUNK_SIZE, split_ranges
+
+
+DEFAULT_CHUNK_AVG = '1M'
+
+CHUNK_COLUMNS = ('fingerprint', 'offset', 'length', 'path')
+
+# How much data to collect before finding boundaries in it (which is
+# much faster in bulk with NumPy).
+SCAN_SIZE = 1024 * 1024
+
+# A fixed pseudo-random value for every byte, so that boundaries (and
+# therefore fingerprints) are the same from run to run.
+GEAR = tuple(struct.unpack('>I', hashlib.md5(struct.pack('B', i)).digest()[:4])[0] for i in range(256))
+_GEAR_NP = np.array(GEAR, dtype=np.uint32) if np is not None else None
+
+
+def _gear_candidates(data, h, base, mask):
+    # Returns the new hash and [(position, hash)] where none of the mask bits are set.
+    gear = GEAR
+    found = []
+    for i, byte in enumerate(bytearray(data)):
+        h = ((h << 1) + gear[byte]) & 0xFFFFFFFF
+        if not h & mask:
+            found.append((base + i, h))
+    return h, found
+
+
+def _gear_candidates_numpy(data, tail, base, mask):
+
+    # The rolling hash shifts left once per byte, so only the last 32 bytes
+    # contribute to a 32 bit hash; it is the sum of those bytes' gear values
+    # shifted by their distance. The tail is the 31 bytes before the data.
+
+    values = _GEAR_NP[np.frombuffer(tail + data, dtype=np.uint8)]
+    h = values.copy()
+    for shift in range(1, 32):
+        h[shift:] += values[:-shift] << np.uint32(shift)
+    h = h[len(tail):]
+
+    found = np.flatnonzero((h & np.uint32(mask)) == 0)
+    return [(base + int(i), int(h[i])) for i in found]
+
+
+class Chunker(object):
+
+    """Splits a stream into content-defined chunks, and fingerprints them.
+
+    Boundaries are found with a Gear rolling hash, and normalized as in
+    FastCDC: chunks are at least ``min_size``, a stricter mask is used before
+    ``avg_size`` and a looser one after, and they are cut at ``max_size``
+    regardless. Since boundaries depend only on nearby content, an insertion
+    only changes the chunks around it.
+
+    The hash is vectorized with NumPy if it is available (it is far too slow
+    for real use without); boundaries are the same either way.
+
+    :param int avg_size: The target average chunk size.
+    :param str algo: The hashlib algorithm to fingerprint chunks with.
+    :param int min_size: Defaults to a quarter of the average.
+    :param int max_size: Defaults to eight times the average.
+
+    """
+
+    def __init__(self, avg_size, algo='sha256', min_size=None, max_size=None, use_numpy=None):
+
+        bits = int(round(math.log(avg_size, 2))) if avg_size > 0 else 0
+        if not 6 <= bits <= 30:
+            raise ValueError("Average chunk size must be between 64B and 1GB.", avg_size)
+
+        self.avg_size = int(avg_size)
+        self.min_size = int(min_size or avg_size // 4)
+        self.max_size = int(max_size or avg_size * 8)
+        self.algo = algo
+        self.use_numpy = (np is not None) if use_numpy is None else use_numpy
+
+        # The high bits of the hash depend on the most bytes.
+        self.strict_mask = ((1 << (bits + 1)) - 1) << (31 - bits)
+        self.loose_mask = ((1 << (bits - 1)) - 1) << (33 - bits)
+
+        # (fingerprint, offset, length) of every finished chunk.
+        self.chunks = []
+
+        self._pending = bytearray()
+        self._start = 0     # Stream offset of the first pending byte.
+        self._scanned = 0   # Stream offset up to which candidates are known.
+        self._hash = 0
+        self._tail = b''
+        # Positions (and hashes) which pass the loose mask.
+        self._candidates = collections.deque()
+
+    def feed(self, data):
+        self._pending.extend(data)
+        if self._start + len(self._pending) - self._scanned >= SCAN_SIZE:
+            self._scan()
+            self._cut()
+
+    def passthrough(self, chunks):
+        """Feed every chunk of an iterable, yielding them on."""
+        for chunk in chunks:
+            self.feed(chunk)
+            yield chunk
+
+    def finish(self):
+        """Chunk whatever remains, and return all :attr:`chunks`."""
+        self._scan()
+        self._cut(final=True)
+        return self.chunks
+
+    def _scan(self):
+
+        data = bytes(self._pending[self._scanned - self._start:])
+        if not data:
+            return
+
+        if self.use_numpy:
+            found = _gear_candidates_numpy(data, self._tail, self._scanned, self.loose_mask)
+            self._tail = (self._tail + data)[-31:]
+        else:
+            self._hash, found = _gear_candidates(data, self._hash, self._scanned, self.loose_mask)
+
+        self._candidates.extend(found)
+        self._scanned += len(data)
+
+    def _find_cut(self, final):
+
+        start = self._start
+        low = start + self.min_size
+        middle = start + self.avg_size
+        high = start + self.max_size
+
+        candidates = self._candidates
+        while candidates and candidates[0][0] + 1 < low:
+            candidates.popleft()
+
+        for pos, h in candidates:
+            end = pos + 1
+            if end >= high:
+                break
+            # Every candidate passes the loose mask.
+            if end >= middle or not h & self.strict_mask:
+                return end
+
+        if self._scanned >= high:
+            return high
+        if final and self._scanned > start:
+            return self._scanned
+
+    def _cut(self, final=False):
+        while True:
+            end = self._find_cut(final)
+            if end is None:
+                return
+            length = end - self._start
+            fingerprint = hashlib.new(self.algo, bytes(self._pending[:length])).hexdigest()
+            self.chunks.append((fingerprint, self._start, length))
+            del self._pending[:length]
+            self._start = end
+
+
+def write_chunks_header(out, chunker, extra=None):
+    header = dict(extra or {})
+    header.update(
+        columns=CHUNK_COLUMNS,
+        algo=chunker.algo,
+        avg_size=chunker.avg_size,
+        min_size=chunker.min_size,
+        max_size=chunker.max_size,
+    )
+    out.write('#chunks-start {}\n'.format(json.dumps(header, sort_keys=True)))
+
+
+def format_chunks(rel_path, chunks):
+    return ''.join('{}\t{}\t{}\t{}\n'.format(fingerprint, offset, length, rel_path)
+        for fingerprint, offset, length in chunks)
+
+
+def chunks_path_for(path):
+    """The chunk sidecar of an index (or the sidecar itself)."""
+    return path if path.endswith('.chunks') else path + '.chunks'
+
+
+def read_chunks_header(path):
+    """Return the parsed JSON of the last ``#chunks-start`` header, or ``None``."""
+    header = None
+    with open(path) as fh:
+        for line in fh:
+            if line.startswith('#chunks-start'):
+                header = json.loads(line.split(None, 1)[1])
+    return header
+
+
+def compact_chunks(path):
+    """Rewrite a sidecar which has been appended to, keeping only the latest
+    chunks of each path (as an index keeps only the latest row).
+
+    """
+
+    header = None
+    latest = collections.OrderedDict()
+    previous = None
+    with open(path) as fh:
+        for line in fh:
+            if line.startswith('#'):
+                if line.startswith('#chunks-start'):
+                    header = line
+                previous = None
+                continue
+            rel_path = line.rstrip('\n').split('\t', 3)[3]
+            # Every chunk of a file is written together.
+            if rel_path != previous:
+                latest.pop(rel_path, None)
+                latest[rel_path] = []
+                previous = rel_path
+            latest[rel_path].append(line)
+
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as out:
+        if header is not None:
+            out.write(header)
+        for lines in latest.values():
+            out.writelines(lines)
+    os.rename(tmp_path, path)
+
+
+def _is_sampled(fingerprint, sample):
+    return sample <= 1 or not int(fingerprint[:8], 16) % sample
+
+
+def _scan_chunks_range(args):
+
+    path, start, end, sample = args
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        data = fh.read(end - start)
+
+    count = 0
+    bytes_ = 0
+    seen = {}
+    for line in data.decode('utf8').split('\n'):
+        if not line or line.startswith('#'):
+            continue
+        fingerprint, _, length, _ = line.split('\t', 3)
+        length = int(length)
+        count += 1
+        bytes_ += length
+        if _is_sampled(fingerprint, sample):
+            seen[fingerprint] = length
+
+    return count, bytes_, seen
+
+
+ChunkStats = collections.namedtuple('ChunkStats', 'path count bytes unique_bytes new_bytes')
+
+
+def estimate_chunk_dedupe(paths, processes=None, sample=1, min_chunk_size=MIN_CHUNK_SIZE):
+    """Estimate block-level dedupe across chunk sidecars, streaming them in parallel.
+
+    Returns a :class:`ChunkStats` for each sidecar, in order, and one for
+    all of them together (with a ``path`` of ``None``). ``unique_bytes`` is
+    what would be stored if that sidecar's chunks were deduplicated among
+    themselves, and ``new_bytes`` what it adds to those before it.
+
+    :param int sample: Only track fingerprints which are a multiple of this,
+        to bound memory; unique bytes are scaled up to estimate the rest.
+
+    """
+
+    processes = processes or multiprocessing.cpu_count()
+
+    jobs = []
+    for path_i, path in enumerate(paths):
+        for start, end, _ in split_ranges(path, processes * 4, min_chunk_size):
+            jobs.append((path_i, (path, start, end, sample)))
+
+    seen = {}
+    by_path_i = {}
+
+    def finish(path_i, count, bytes_, own):
+        new = sum(length for fingerprint, length in own.items() if fingerprint not in seen)
+        seen.update(own)
+        by_path_i[path_i] = ChunkStats(paths[path_i], count, bytes_,
+            sum(own.values()) * sample, new * sample)
+
+    def iter_results():
+        if processes < 2 or len(jobs) < 2:
+            for path_i, args in jobs:
+                yield path_i, _scan_chunks_range(args)
+            return
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            for path_i, result in zip((x[0] for x in jobs), pool.imap(_scan_chunks_range, [x[1] for x in jobs])):
+                yield path_i, result
+        finally:
+            pool.close()
+            pool.join()
+
+    current = None
+    for path_i, (count, bytes_, partial) in iter_results():
+        if current is not None and current[0] != path_i:
+            finish(*current)
+            current = None
+        if current is None:
+            current = [path_i, 0, 0, {}]
+        current[1] += count
+        current[2] += bytes_
+        current[3].update(partial)
+    if current is not None:
+        finish(*current)
+
+    # Empty sidecars have no ranges.
+    stats = [by_path_i.get(i) or ChunkStats(path, 0, 0, 0, 0) for i, path in enumerate(paths)]
+
+    unique = sum(seen.values()) * sample
+    stats.append(ChunkStats(None, sum(x.count for x in stats), sum(x.bytes for x in stats), unique, unique))
+    return stats
@@ -3,22 +3,35 @@
 from queue import Queue, Empty
 from uuid import uuid4
 import argparse
+import bisect
 import datetime
+import errno
 import functools
 import hashlib
 import itertools
 import json
 import math
+import multiprocessing
 import os
-import re
+import signal
 import stat
 import sys
 import threading
 import time
 import traceback
+import zlib
 
-from .parse import iter_entries
-from .utils import parse_bytes
+from .autotune import Autotuner, parse_threads
+from .changes import iter_changes
+from .chunks import DEFAULT_CHUNK_AVG, Chunker, compact_chunks, format_chunks, read_chunks_header, write_chunks_header
+from .entry import Entry
+from .exclude import Excluder, read_exclude_file
+from .fs import IO_MODES, iter_chunks, physical_offset
+from .index import Index
+from .merge import merge_indexes, walk_sort_key
+from .parse import read_headers
+from .throttle import Throttle
+from .utils import cached_property, parse_bytes
 
 
 # Stat times are nanoseconds underneath, but in Python 2 we
@@ -29,6 +42,20 @@ from .utils import parse_bytes
 STAT_TIME_DIGITS = int((53 - math.log(int(time.time()), 2)) / math.log(10, 2))
 
 
+COLUMNS = '''
+    checksum
+    inode
+    type
+    perms
+    size
+    uid
+    gid
+    mtime
+    ctime
+    path
+'''.strip().split()
+
+
 # These types are from `zfs diff`.
 REG = 'F'
 LNK = '@'
@@ -49,7 +76,11 @@ class WalkItem(object):
         self.parent = parent
         self.name = name
         self.path = os.path.join(parent, name)
-        
+        self.checksum = None
+        self.unchanged = False
+        self.chunks = None
+        self.read_size = 0
+
         self.stat = os.lstat(self.path)
         mode = self.stat.st_mode
         self.perms = stat.S_IMODE(mode)
@@ -72,14 +103,34 @@ class WalkItem(object):
         return 'WalkItem({!r}, {!r})'.format(self.parent, self.name)
 
 
-def resumeable_walk(dir_, start=None):
+class WalkBatch(list):
+
+    """The items within one directory, as yielded by :func:`resumeable_walk`."""
+
+    def __init__(self, path):
+        super(WalkBatch, self).__init__()
+        self.path = path
+
+
+def resumeable_walk(dir_, start=None, listdir=os.listdir, exclude=None, throttle=None):
+    """Walk a tree, yielding a :class:`WalkBatch` of items for each directory.
+
+    :param exclude: An :class:`.Excluder` to prune entries before they
+        are stat-ed, and directories before they are walked.
+    :param throttle: A :class:`.Throttle` to account every listdir and stat against.
+
+    """
     if start:
         start = os.path.relpath(os.path.join(dir_, start), dir_)
         start = start.split(os.path.sep)
-    return _resumeable_walk(dir_, start)
+    return _resumeable_walk(dir_, start, listdir, exclude, throttle)
+
+
+def _walk_name_key(name):
+    return name.lower(), name
 
 
-def _resumeable_walk(dir_, start):
+def _resumeable_walk(dir_, start, listdir, exclude, throttle):
 
     if start:
         this_start = start[0]
@@ -87,22 +138,40 @@ def _resumeable_walk(dir_, start):
     else:
         this_start = next_start = None
 
-    items = []
+    items = WalkBatch(dir_)
+    excluded = exclude.for_dir(dir_) if exclude else None
 
-    names = sorted(os.listdir(dir_), key=str.lower)
+    if throttle:
+        throttle.op()
+    names = sorted(listdir(dir_), key=_walk_name_key)
     for name in names:
 
         if this_start and this_start > name:
             continue
 
+        if excluded and excluded(name):
+            continue
+
+        if throttle:
+            throttle.op()
+
         try:
             item = WalkItem(dir_, name)
+        except OSError as e:
+            # It was removed since it was listed (or it was listed from an
+            # index which still has it; see Indexer._listdir).
+            if e.errno == errno.ENOENT:
+                continue
+            printerr('# Exception in resumable walk:', e)
+            raise
         except Exception as e:
             printerr('# Exception in resumable walk:', e)
             raise
 
         if item.is_special:
             continue
+        if excluded and item.is_dir and excluded(name, True):
+            continue
         items.append(item)
 
     # Since files and dirs are yielded at the same time, files after
@@ -121,117 +190,279 @@ def _resumeable_walk(dir_, start):
         if this_start and item.name > this_start:
             next_start = None
 
-        for x in _resumeable_walk(item.path, next_start):
+        for x in _resumeable_walk(item.path, next_start, listdir, exclude, throttle):
             yield x
 
 
 
+# Directory items are passed through the checksum pool in order with the
+# files, but their checksums are computed from their children afterwards.
+_DIR_PENDING = 'tree:pending'
+
+
+class _DirFrame(object):
+
+    def __init__(self, item):
+        self.item = item
+        self.children = []
+        self.count = 0
+        self.bytes = 0
+        self.max_mtime = item.stat.st_mtime
+
+    def add(self, name, checksum, count, bytes_, mtime):
+        self.children.append((name, checksum.split(':')[-1]))
+        self.count += count
+        self.bytes += bytes_
+        self.max_mtime = max(self.max_mtime, mtime)
+
+    def checksum(self, algo_key, algo_name):
+        # A Merkle hash over the (sorted) names and checksums of the children.
+        hasher = getattr(hashlib, algo_name)()
+        for name, hexdigest in sorted(self.children):
+            hasher.update('{}\0{}\n'.format(name, hexdigest).encode('utf8', 'surrogateescape'))
+        return 'tree,{},n={},m={:.{}f}:{}'.format(algo_key, self.count, self.max_mtime,
+            STAT_TIME_DIGITS, hasher.hexdigest())
+
+
 _checksum_cache = {}
 
-def _checksum_path(item, indexer):
+def _iter_ranges(size, head=None, tail=None, samples=None, sample_size=None):
+    """Yield the ``(offset, length)`` ranges of a file to checksum.
 
-    algo_name = indexer.checksum_algo
-    head = indexer.head
-    tail = indexer.tail
-    
-    algo_key = algo_name
-    if head:
-        algo_key = '{},h={}'.format(algo_key, indexer.raw_head)
-    if tail:
-        algo_key = '{},t={}'.format(algo_key, indexer.raw_tail)
+    A length of ``None`` means to read until EOF.
+
+    """
+
+    if not samples:
+        # Without a head we read the whole file (even if given a tail).
+        yield 0, head
+        # The tail is only read if it doesn't overlap the head.
+        if tail and head and size - tail > head:
+            yield size - tail, None
+        return
+
+    head = head or sample_size
+    tail = tail or sample_size
+
+    # Small files are not worth sampling.
+    if size <= head + tail + samples * sample_size:
+        yield 0, None
+        return
+
+    yield 0, head
+
+    # Interior blocks are centered in N even divisions of the middle, so
+    # they never overlap each other or the ends.
+    span = size - head - tail
+    for i in range(samples):
+        center = head + span * (2 * i + 1) // (2 * samples)
+        yield center - sample_size // 2, sample_size
+
+    yield size - tail, tail
+
+
+def _read_size(size, indexer):
+    """How many bytes checksumming a file of the given size reads."""
+    total = 0
+    for offset, length in _iter_ranges(size, indexer.head, indexer.tail,
+        indexer.samples, indexer.sample_size):
+        available = max(0, size - offset)
+        total += available if length is None else min(length, available)
+    return total
+
+
+def _checksum_path(item, indexer, cache=True):
+
+    # Some items are known to be unchanged, or are directories.
+    if item.checksum:
+        return item, item.checksum
+
+    algo_key = indexer.algo_key
 
     # We cache every checksum by device/inode so we don't bother re-indexing things which
-    # are hardlinked.
+    # are hardlinked. Verification must always read.
     st = item.stat
     cache_key = (st.st_dev, st.st_ino, algo_key)
     try:
         checksum, ctime = _checksum_cache[cache_key]
-        if ctime == st.st_ctime:
-            return to_index, checksum
+        if cache and ctime == st.st_ctime:
+            return item, checksum
     except KeyError:
         pass
 
-    hasher = getattr(hashlib, algo_name)()
+    hasher = getattr(hashlib, indexer.checksum_algo)()
+    throttle = indexer.throttle
 
     if item.is_reg:
 
-        with open(item.path, 'rb') as fh:
-            
-            loc = 0
-
-            for todo, is_tail in ((head, False), (tail, True)):
-
-                if is_tail:
-                    if tail:
-                        # Only do the remaining parts.
-                        offset = max(loc, st.st_size - tail)
-                        if offset == loc:
-                            continue
-                        fh.seek(offset)
-                    else:
-                        # Don't bother with the tail if it isn't requested.
-                        continue
+        if indexer.samples:
+            # The size is part of what is being sampled, so that we are
+            # sensitive to truncation/extension in the unsampled regions.
+            hasher.update('{}\n'.format(st.st_size).encode('ascii'))
+
+        ranges = _iter_ranges(st.st_size, indexer.head, indexer.tail,
+            indexer.samples, indexer.sample_size)
+
+        chunks = iter_chunks(item.path, ranges, indexer.io_mode)
+        chunker = indexer.chunker() if indexer.chunk_avg else None
+        if chunker is not None:
+            chunks = chunker.passthrough(chunks)
 
-                chunksize = 65536
-                while todo is None or todo > 0:
-                    if todo:
-                        chunksize = min(chunksize, todo)
-                    try:
-                        chunk = fh.read(chunksize)
-                    except IOError as e:
-                        # For some reason, some files in "System Volume Information"
-                        # throw an error no matter what you do.
-                        if e.errno != 1:
-                            raise
-                        return item, None
-                    if not chunk:
-                        break
-                    if todo:
-                        todo -= len(chunk)    
+        try:
+            if throttle:
+                throttle.op()
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    throttle.read(len(chunk))
+            else:
+                for chunk in chunks:
                     hasher.update(chunk)
+        except IOError as e:
+            # For some reason, some files in "System Volume Information"
+            # throw an error no matter what you do.
+            if e.errno != 1:
+                raise
+            return item, None
 
-                loc = fh.tell()
+        if chunker is not None:
+            item.chunks = chunker.finish()
+        item.read_size = _read_size(st.st_size, indexer)
 
     elif item.is_lnk:
+        if throttle:
+            throttle.op()
         path = os.readlink(item.path)
-        hasher.update(path)
+        hasher.update(os.fsencode(path))
 
     checksum = '{}:{}'.format(algo_key, hasher.hexdigest())
     _checksum_cache[cache_key] = checksum, st.st_ctime
     return item, checksum
 
 
+def _checksum_cost(result):
+    item, checksum = result
+    # Only what was actually read counts (not heads/tails/samples skipped,
+    # nor checksums from the cache).
+    return item.read_size
+
+
+def _inode_order(item, indexer):
+    return item.stat.st_ino
+
+
+def _extent_order(item, indexer):
+    # Items which won't be read don't matter.
+    if not item.is_reg or item.checksum:
+        return 0
+    # FIEMAP opens the file, which counts against the budget.
+    if indexer.throttle:
+        indexer.throttle.op()
+    offset = physical_offset(item.path)
+    return item.stat.st_ino if offset is None else offset
+
+
+IO_ORDERS = {
+    'walk': None,
+    'inode': _inode_order,
+    'extent': _extent_order,
+}
+
+
+class _WorkerCount(object):
+
+    """How many workers are running, and how many have been asked to retire."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.retiring = 0
+        self.finished = False
+
+    def resize(self, target):
+        """Ask workers to retire to reach the target; returns how many to spawn."""
+        with self.lock:
+            # There is no point starting workers once the jobs have run out.
+            if self.finished:
+                return 0
+            delta = target - (self.active - self.retiring)
+            if delta < 0:
+                self.retiring -= delta
+                return 0
+            cancelled = min(delta, self.retiring)
+            self.retiring -= cancelled
+            self.active += delta - cancelled
+            return delta - cancelled
+
+    def should_retire(self):
+        with self.lock:
+            if self.retiring:
+                self.retiring -= 1
+                self.active -= 1
+                return True
+            return False
+
+    def finish(self):
+        with self.lock:
+            self.active -= 1
+            self.finished = True
+
+
 def _threaded_map(num_threads, func, *args_iters, **kwargs):
 
+    # num_threads may be an :class:`.Autotuner` to resize the pool as we go.
+
     sorted = kwargs.pop('sorted', True)
     strict = kwargs.pop('strict', False)
+    order_key = kwargs.pop('order_key', None)
+    window = kwargs.pop('window', 256)
+
+    tuner = None
+    if isinstance(num_threads, Autotuner):
+        tuner = num_threads
+        num_threads = tuner.threads
 
-    work_queue = Queue(num_threads)
+    work_queue = Queue(tuner.max_threads if tuner else num_threads)
     result_queue = Queue()
     
     results = {}
     workers = []
     alive = 0
+    count = _WorkerCount()
 
-    scheduler = threading.Thread(target=_threaded_map_scheduler, args=(num_threads, work_queue, args_iters))
+    scheduler = threading.Thread(target=_threaded_map_scheduler, args=(work_queue, args_iters, order_key, window))
     scheduler.daemon = True
     scheduler.start()
 
-    for _ in range(num_threads):
-        worker = threading.Thread(target=_threaded_map_target, args=(work_queue, result_queue, func))
-        worker.daemon = True
-        worker.start()
-        workers.append(worker)
-        alive += 1
+    def spawn(n):
+        for _ in range(n):
+            worker = threading.Thread(target=_threaded_map_target, args=(work_queue, result_queue, func, count))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+    spawn(count.resize(num_threads))
+    alive = len(workers)
 
     next_job = 0
     while alive:
-        
-        job, ok, result = result_queue.get()
+
+        if tuner is not None:
+            new = count.resize(tuner.poll())
+            spawn(new)
+            alive += new
+
+        try:
+            job, ok, result, elapsed = result_queue.get(timeout=tuner.interval if tuner else None)
+        except Empty:
+            continue
+
         if job is None:
             alive -= 1
             continue
 
+        if tuner is not None and ok:
+            tuner.record(result, elapsed)
+
         if not sorted:
             if ok:
                 yield result
@@ -255,23 +486,63 @@ def _threaded_map(num_threads, func, *args_iters, **kwargs):
             raise ValueError('Worker survived.')
 
 
-def _threaded_map_scheduler(num_threads, work_queue, args_iters):
+def _elevator(jobs, order_key, window):
+
+    # Reorder jobs within a bounded window so that they sweep across their
+    # keys (e.g. physical locations on disk) in one direction, like a disk
+    # elevator. Job numbers are retained so results can be put back in order.
+
+    pending = []
+    position = None
+    jobs = iter(jobs)
+    exhausted = False
+
+    while True:
+
+        while not exhausted and len(pending) < window:
+            try:
+                i, args = next(jobs)
+            except StopIteration:
+                exhausted = True
+                break
+            bisect.insort(pending, (order_key(*args), i, args))
+
+        if not pending:
+            return
+
+        x = bisect.bisect_left(pending, (position, )) if position is not None else 0
+        if x >= len(pending):
+            # Start the next sweep.
+            x = 0
+        key, i, args = pending.pop(x)
+        position = key
+        yield i, args
+
+
+def _threaded_map_scheduler(work_queue, args_iters, order_key=None, window=256):
     try:
-        for i, args in enumerate(zip(*args_iters)):
+        jobs = enumerate(zip(*args_iters))
+        if order_key is not None:
+            jobs = _elevator(jobs, order_key, window)
+        for i, args in jobs:
             work_queue.put((i, args))
     except Exception as e:
         traceback.print_exc()
         raise
     finally:
-        for _ in range(num_threads):
-            work_queue.put((None, None))
+        # Every worker puts this back when it sees it, so it also stops
+        # any which are started later.
+        work_queue.put((None, None))
 
-def _threaded_map_target(work_queue, result_queue, func):
+def _threaded_map_target(work_queue, result_queue, func, count):
     try:
-        while True:
+        while not count.should_retire():
             job, args = work_queue.get()
             if args is None:
+                work_queue.put((None, None))
+                count.finish()
                 break
+            start = time.time()
             try:
                 result = func(*args)
             except Exception as e:
@@ -280,19 +551,22 @@ def _threaded_map_target(work_queue, result_queue, func):
                 ok = False
             else:
                 ok = True
-            result_queue.put((job, ok, result))
+            result_queue.put((job, ok, result, time.time() - start))
     except Exception as e:
         traceback.print_exc()
         raise
     finally:
-        result_queue.put((None, None, None))
+        result_queue.put((None, None, None, None))
 
 
 
 class Indexer(object):
 
-    def __init__(self, path_to_index, root=None, start=None, excludes=(),
-        include_dotfiles=False, head=None, tail=None, checksum_algo='sha256', verbosity=0):
+    def __init__(self, path_to_index, root=None, start=None, excludes=(), exclude_globs=(),
+        include_dotfiles=False, head=None, tail=None, samples=None, sample_size=None,
+        checksum_algo='sha256', shard=None, shard_by='top', dirs=False,
+        io_order='walk', io_window=256, io_mode='buffered', max_bytes=None, max_ops=None,
+        throttle_control=None, throttle_share=1, chunk_avg=None, verbosity=0):
 
         self.path_to_index = os.path.abspath(path_to_index)
         self.root = os.path.abspath(root or self.path_to_index)
@@ -304,20 +578,66 @@ class Indexer(object):
         self.head = parse_bytes(head) if head else None
         self.raw_tail = tail
         self.tail = parse_bytes(tail) if tail else None
+        self.samples = int(samples) if samples else None
+        self.raw_sample_size = (sample_size or '1M') if samples else None
+        self.sample_size = parse_bytes(self.raw_sample_size) if samples else None
+
+        # The parameters are recorded in the checksum so that checksums
+        # from different settings are never considered equal.
+        self.algo_key = checksum_algo
+        if self.head:
+            self.algo_key = '{},h={}'.format(self.algo_key, self.raw_head)
+        if self.tail:
+            self.algo_key = '{},t={}'.format(self.algo_key, self.raw_tail)
+        if self.samples:
+            self.algo_key = '{},s={}x{}'.format(self.algo_key, self.samples, self.raw_sample_size)
 
         self.raw_excludes = excludes
-        self.name_excludes = []
-        self.path_excludes = []
+        self.raw_exclude_globs = exclude_globs
+        self.excluder = Excluder(self.root, self.path_to_index,
+            regexes=excludes,
+            globs=exclude_globs,
+            include_dotfiles=include_dotfiles,
+        )
 
-        for raw in excludes:
-            if raw.startswith('/'):
-                self.path_excludes.append(re.compile(r'^%s$' % raw.strip('/')))
-            else:
-                self.name_excludes.append(re.compile(r'^%s$' % raw.strip('/')))
-        if not include_dotfiles:
-            self.name_excludes.append(re.compile(r'^\.'))
+        # Shards are given as (index, count).
+        if shard and shard_by not in ('top', 'hash'):
+            raise ValueError("Unknown shard_by.", shard_by)
+        self.shard = tuple(shard) if shard else None
+        self.shard_by = shard_by
+
+        # Directory rows need to see every file beneath them.
+        if dirs and (start or (shard and shard_by == 'hash')):
+            raise ValueError("Directory rows don't work with start or sharding by hash.")
+        self.dirs = bool(dirs)
+
+        if io_order not in IO_ORDERS:
+            raise ValueError("Unknown io_order.", io_order)
+        self.io_order = io_order
+        self.io_window = int(io_window)
+
+        if io_mode not in IO_MODES:
+            raise ValueError("Unknown io_mode.", io_mode)
+        self.io_mode = io_mode
+
+        # Shared by the walker and all checksumming threads.
+        self.throttle = Throttle(max_bytes, max_ops, throttle_control, throttle_share)
+
+        # Content-defined chunks need every byte of every file.
+        if chunk_avg and (self.head or self.tail or self.samples):
+            raise ValueError("Chunking doesn't work with head, tail, or samples.")
+        self.raw_chunk_avg = chunk_avg
+        self.chunk_avg = parse_bytes(chunk_avg) if chunk_avg else None
+        if self.chunk_avg:
+            self.chunker() # To validate the size.
 
         self.existing = {}
+        # The device the existing index was created on, if it says.
+        self.existing_dev = None
+
+    def chunker(self):
+        """A new :class:`.Chunker` for one file."""
+        return Chunker(self.chunk_avg, self.checksum_algo)
 
     def auto_start(self, index_path):
         with open(index_path, 'r') as out:
@@ -329,17 +649,91 @@ class Indexer(object):
             self.start = os.path.join(self.root, rel_start)
 
     def load_existing(self, input_):
-        if isinstance(input_, str):
-            input_ = open(input_, 'r')
-        for entry in iter_entries(input_):
-            self.existing[entry.path] = entry
+        if not isinstance(input_, Index):
+            headers = read_headers(input_)
+            if headers:
+                self.existing_dev = headers[-1].get('dev')
+            input_ = Index(input_)
+        self.existing.update(input_.by_path)
+        self.__dict__.pop('_existing_dirs', None)
+        self.__dict__.pop('_existing_children', None)
+        self.__dict__.pop('_existing_inodes', None)
+
+    @cached_property
+    def _root_dev(self):
+        return os.stat(self.path_to_index).st_dev
+
+    @cached_property
+    def _existing_inodes(self):
+
+        # Map of inode to the existing entry most recently changed, for files
+        # with checksums we can reuse. Inode numbers from another device
+        # (e.g. the filesystem was since remounted elsewhere) mean nothing.
+
+        inodes = {}
+        if self.existing_dev is not None and self.existing_dev != self._root_dev:
+            return inodes
+
+        for entry in self.existing.values():
+            self._remember_inode(inodes, entry)
+        return inodes
+
+    def _remember_inode(self, inodes, entry):
+        if entry.inode is None or entry.is_dir or not entry.raw_checksum.startswith(self.algo_key + ':'):
+            return
+        other = inodes.get(entry.inode)
+        if other is None or (entry.ctime or 0) >= (other.ctime or 0):
+            inodes[entry.inode] = entry
+
+    def _reuse_by_inode(self, item):
+
+        # A new or renamed path (or another hardlink) may be an inode we have
+        # already checksummed. Both link() and rename() change the ctime, so
+        # we trust the size and mtime, as we do for unchanged paths.
+
+        st = item.stat
+        if st.st_dev != self._root_dev:
+            return False
+        entry = self._existing_inodes.get(st.st_ino)
+        if (
+            entry is None or
+            entry.type != item.type_code or
+            entry.size != st.st_size or
+            abs(entry.mtime - st.st_mtime) >= entry.epsilon
+        ):
+            return False
+
+        item.checksum = entry.raw_checksum
+        if self.verbosity > 1:
+            printerr("# Reusing checksum of {} for {}".format(entry.path, item.rel_path))
+        return True
+
+    @cached_property
+    def _existing_children(self):
+        children = {}
+        for rel_path in self.existing:
+            if rel_path != '.':
+                parent, name = os.path.split(rel_path)
+                children.setdefault(parent or '.', []).append(name)
+        return children
+
+    def _listdir(self, path):
+        # Directories which haven't changed since the existing index can be
+        # listed from it instead of from the filesystem. Since --update never
+        # removes rows, this may include names which have since been deleted
+        # (which is why their directory changed before), and the walker skips them.
+        rel_path = os.path.relpath(path, self.root)
+        entry = self.existing.get(rel_path)
+        if entry is not None and entry.type == DIR:
+            st = os.lstat(path)
+            if abs(entry.mtime - st.st_mtime) < entry.epsilon:
+                return self._existing_children.get(rel_path, [])
+        return os.listdir(path)
 
 
     def _iter_file_paths(self):
 
         # Early-binding fo speed.
-        path_excludes = self.path_excludes
-        name_excludes = self.name_excludes
         existing = self.existing
         root = self.root
         S_ISREG = stat.S_ISREG
@@ -349,29 +743,34 @@ class Indexer(object):
         self.total_count = total_count = 0
         self.total_bytes = total_bytes = 0
 
-        for items in resumeable_walk(self.path_to_index, self.start):
+        path_to_index = self.path_to_index
+        shard_index, shard_count = self.shard or (None, None)
+        shard_by_top = self.shard_by == 'top'
+
+        # Directories are yielded as they are entered, before their contents.
+        dirs = self.dirs
+        dir_items = {}
+        if dirs and not self.shard:
+            dir_items[path_to_index] = WalkItem(*os.path.split(path_to_index))
 
-            if path_excludes or name_excludes:
+        listdir = self._listdir if (dirs and existing) else os.listdir
 
-                i = 0
-                while i < len(items):
+        exclude = None if self.excluder.is_empty else self.excluder
 
-                    item = items[i]
-                    name = item.name
-                    exclude = False
+        throttle = self.throttle if self.throttle else None
 
-                    if name_excludes and any(r.match(name) for r in name_excludes):
-                        exclude = True
+        for items in resumeable_walk(self.path_to_index, self.start, listdir, exclude, throttle):
 
-                    elif path_excludes:
-                        rel_path = os.path.relpath(os.path.join(dir_path, name), root)
-                        if any(r.match(rel_path) for r in path_excludes):
-                            exclude = True
+            if dirs:
+                item = dir_items.pop(items.path, None)
+                if item is not None:
+                    item.rel_path = os.path.relpath(item.path, root)
+                    item.checksum = _DIR_PENDING
+                    yield item
 
-                    if exclude:
-                        items.pop(i)
-                    else:
-                        i += 1
+            # Prune the top level so other shards' directories are never walked.
+            if shard_count and shard_by_top and items and items[0].parent == path_to_index:
+                items[:] = [item for item in items if shard_of(item.name, shard_count) == shard_index]
 
             for item in items:
 
@@ -379,10 +778,16 @@ class Indexer(object):
                 rel_path = item.rel_path = os.path.relpath(abs_path, root)
                 st = item.stat
 
+                if item.is_dir and dirs:
+                    dir_items[abs_path] = item
+
                 # We only care about actual files.
                 if not (item.is_reg or item.is_lnk):
                     continue
 
+                if shard_count and not shard_by_top and shard_of(rel_path, shard_count) != shard_index:
+                    continue
+
                 total_count += 1
                 total_bytes += st.st_size
 
@@ -394,6 +799,11 @@ class Indexer(object):
                     if entry.size == st.st_size and abs(entry.mtime - st.st_mtime) < entry.epsilon:
                         if self.verbosity > 1:
                             printerr("# Skipping unchanged {}".format(rel_path))
+                        # Directories still need to know about it.
+                        if dirs:
+                            item.checksum = entry.raw_checksum
+                            item.unchanged = True
+                            yield item
                         continue
                     elif self.verbosity > 1:
                         printerr("# Reindexing changed {}".format(rel_path))
@@ -401,6 +811,9 @@ class Indexer(object):
                 elif self.verbosity > 1:
                     printerr("# Indexing new {}".format(rel_path))
 
+                if existing:
+                    self._reuse_by_inode(item)
+
                 added_count += 1
                 added_bytes += st.st_size
 
@@ -411,9 +824,7 @@ class Indexer(object):
         self.total_count = total_count
         self.total_bytes = total_bytes
 
-    def run(self, out, threads=1, sorted=True, header_extra=None):
-
-        self.error_count = 0
+    def _write_header(self, out, header_extra=None):
 
         uuid = str(uuid4())
 
@@ -425,33 +836,66 @@ class Indexer(object):
             started_at=datetime.datetime.utcnow().isoformat('T'),
             uuid=uuid,
             excludes=self.raw_excludes,
+            exclude_globs=self.raw_exclude_globs,
             checksum_algo=self.checksum_algo,
             head=self.head,
             tail=self.tail,
-            columns='''
-                checksum
-                inode
-                type
-                perms
-                size
-                uid
-                gid
-                mtime
-                ctime
-                path
-            '''.strip().split()
+            shard=self.shard,
+            shard_by=self.shard_by if self.shard else None,
+            samples=self.samples,
+            sample_size=self.sample_size,
+            chunk_avg=self.chunk_avg,
+            dev=self._root_dev,
+            columns=COLUMNS,
         )
 
         out.write('#scan-start {}\n'.format(json.dumps(header, sort_keys=True)))
+        return uuid
+
+    def _write_footer(self, out, uuid):
+        out.write('#scan-end {}\n'.format(json.dumps(dict(
+            added_count=self.added_count,
+            added_bytes=self.added_bytes,
+            total_count=self.total_count,
+            total_bytes=self.total_bytes,
+            error_count=self.error_count,
+            throttled_seconds=round(self.throttle.throttled_seconds, 3),
+            ended_at=datetime.datetime.utcnow().isoformat('T'),
+            uuid=uuid,
+        ), sort_keys=True)))
+
+    def _pool_size(self, threads):
+        # Automatic thread counts are tuned on files and bytes checksummed per second.
+        if isinstance(threads, str):
+            return Autotuner.from_spec(threads,
+                cost=_checksum_cost,
+                log=printerr if self.verbosity else None,
+            )
+        return threads
+
+    def run(self, out, threads=1, sorted=True, header_extra=None, chunks_out=None):
+        """Index into ``out``, and the chunks of every file read into ``chunks_out`` (if chunking)."""
+
+        self.error_count = 0
+
+        uuid = self._write_header(out, header_extra)
+        if chunks_out is not None and self.chunk_avg:
+            write_chunks_header(chunks_out, self.chunker(), dict(root=self.root, uuid=uuid))
 
         last_flush = time.time()
 
+        # Directory rows must be built from their children in order.
+        sorted = sorted or self.dirs
+        dir_stack = []
+
         for item, checksum in _threaded_map(
-            threads,
+            self._pool_size(threads),
             _checksum_path,
             self._iter_file_paths(),
             itertools.cycle((self, )),
             sorted=sorted,
+            order_key=IO_ORDERS[self.io_order],
+            window=self.io_window,
         ):
 
             # Sometimes there are wierd errors.
@@ -460,45 +904,406 @@ class Indexer(object):
                 self.error_count += 1
                 continue
 
-            formatted = '\t'.join(str(x) for x in (
-                checksum,
-                item.stat.st_ino,
-                item.type_code,
-                '{:o}'.format(item.perms),
-                item.stat.st_size,
-                item.stat.st_uid,
-                item.stat.st_gid,
-
-                '{:.{}f}'.format(item.stat.st_mtime, STAT_TIME_DIGITS),
-                '{:.{}f}'.format(item.stat.st_ctime, STAT_TIME_DIGITS),
+            if self.dirs:
+                self._close_dirs(out, dir_stack, item.parent)
+                if item.is_dir:
+                    dir_stack.append(_DirFrame(item))
+                    continue
+                if dir_stack:
+                    dir_stack[-1].add(item.name, checksum, 1, item.stat.st_size, item.stat.st_mtime)
+                if item.unchanged:
+                    continue
 
-                item.rel_path,
-            ))
+            formatted = format_item(item, checksum)
             if self.verbosity:
                 print(formatted)
             out.write(formatted + '\n')
 
+            # Only files which were actually read have chunks (so not hardlinks to them).
+            if chunks_out is not None and item.chunks:
+                chunks_out.write(format_chunks(item.rel_path, item.chunks))
+
             now = time.time()
             if now - last_flush > 1:
                 out.flush()
+                if chunks_out is not None:
+                    chunks_out.flush()
                 last_flush = now
 
-        out.write('#scan-end {}\n'.format(json.dumps(dict(
-            added_count=self.added_count,
-            added_bytes=self.added_bytes,
-            total_count=self.total_count,
-            total_bytes=self.total_bytes,
-            error_count=self.error_count,
-            ended_at=datetime.datetime.utcnow().isoformat('T'),
-            uuid=uuid,
-        ), sort_keys=True)))
+        self._close_dirs(out, dir_stack, None)
+        self._write_footer(out, uuid)
+
+    def _close_dirs(self, out, stack, parent):
+
+        # Finish every directory that isn't the given parent (or its ancestor).
+
+        while stack and stack[-1].item.path != parent:
+
+            frame = stack.pop()
+            item = frame.item
+            checksum = frame.checksum(self.algo_key, self.checksum_algo)
+            if stack:
+                stack[-1].add(item.name, checksum, frame.count, frame.bytes, frame.max_mtime)
+
+            # Unchanged directories don't need to be written during an update.
+            entry = self.existing.get(item.rel_path)
+            if (
+                entry is not None and
+                entry.raw_checksum == checksum and
+                abs(entry.mtime - item.stat.st_mtime) < entry.epsilon
+            ):
+                continue
+
+            formatted = format_item(item, checksum, size=frame.bytes)
+            if self.verbosity:
+                print(formatted)
+            out.write(formatted + '\n')
+
+    def _is_excluded(self, abs_path, is_dir=False):
+        return self.excluder.excludes_path(abs_path, is_dir)
+
+    def _examine_item(self, item, source=None):
+
+        # Returns if the item needs to be checksummed, which isn't the case
+        # if it is unchanged from the given entry.
+
+        st = item.stat
+        if (
+            source is not None and
+            source.size == st.st_size and
+            abs(source.mtime - st.st_mtime) < source.epsilon and
+            source.raw_checksum.startswith(self.algo_key + ':')
+        ):
+            item.checksum = source.raw_checksum
+            return False
+        return not self._reuse_by_inode(item)
+
+    def _iter_changed_items(self, changes, source_for):
+
+        root = self.root
+        throttle = self.throttle if self.throttle else None
+
+        # Sorted so that directories come before anything within them, which
+        # their walk will find anyway (e.g. `zfs diff` lists new directories
+        # and their contents).
+        walked = set()
+        for abs_path in sorted(set(changes)):
+
+            parent = os.path.dirname(abs_path)
+            while parent not in walked and parent != root and len(parent) > 1:
+                parent = os.path.dirname(parent)
+            if parent in walked:
+                continue
+
+            if throttle:
+                throttle.op()
+            try:
+                item = WalkItem(*os.path.split(abs_path))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+
+            if item.is_dir:
+                if self._is_excluded(abs_path, True):
+                    continue
+                walked.add(abs_path)
+                walk = resumeable_walk(abs_path, exclude=self.excluder, throttle=throttle)
+            else:
+                walk = [[item]]
+
+            for items in walk:
+                for item in items:
+
+                    if not (item.is_reg or item.is_lnk):
+                        continue
+
+                    if self._is_excluded(item.path):
+                        continue
+                    rel_path = item.rel_path = os.path.relpath(item.path, root)
+
+                    if self._examine_item(item, source_for(rel_path)):
+                        self.added_count += 1
+                        self.added_bytes += item.stat.st_size
+                    yield item
+
+    @cached_property
+    def _existing_dirs(self):
+        # Every directory with something under it, so we know when
+        # forgetting a path needs to forget a whole subtree.
+        dirs = set()
+        for rel_path in self.existing:
+            _add_parents(dirs, rel_path)
+        return dirs
+
+    def apply_changes(self, changes, threads=1):
+        """Update :attr:`existing` by only re-examining paths from a change list.
+
+        Any changed path which no longer exists is removed (along with
+        everything under it), and any changed directory which does exist is
+        re-walked. Files are only read if they have changed.
+
+        :param changes: Iterable of :class:`.changes.Change`.
+
+        """
+
+        self.error_count = 0
+        self.added_count = self.added_bytes = 0
+
+        existing = self.existing
+        existing_dirs = self._existing_dirs
+        # Built before anything is forgotten, so that moves can still find
+        # their inodes, and kept up to date as we go.
+        inodes = self._existing_inodes
+
+        # Normalize the change list to absolute paths to re-examine, within
+        # the tree being indexed.
+        to_examine = []
+        to_forget = set()
+        renames = {}
+        for change in changes:
+
+            paths = [change.path, change.new_path] if change.new_path else [change.path]
+            paths = [os.path.join(self.root, path) for path in paths]
+            rel_paths = [os.path.relpath(path, self.root) for path in paths]
+            if any(os.path.relpath(path, self.path_to_index).startswith('..') for path in paths):
+                continue
+
+            if change.new_path:
+                renames[rel_paths[1]] = rel_paths[0]
+
+            # Directories which are only modified in `zfs diff` have their
+            # changed contents listed separately. Without `zfs diff -F` we
+            # have to look to see if it is a directory.
+            if change.kind == 'M' and (change.type == DIR or (change.type is None and os.path.isdir(paths[0]))):
+                continue
+
+            to_forget.update(rel_paths)
+            to_examine.extend(paths)
+
+        # Everything to be re-examined is forgotten, but kept aside so that
+        # unchanged (or renamed) files don't need to be read again.
+        forgotten = {}
+        for rel_path in to_forget:
+            entry = existing.pop(rel_path, None)
+            if entry is not None:
+                forgotten[rel_path] = entry
+        if '.' in to_forget:
+            # The top has changed, so everything is in question.
+            forgotten.update(existing)
+            existing.clear()
+        prefixes = tuple(rel_path + '/' for rel_path in to_forget if rel_path in existing_dirs)
+        if prefixes:
+            for rel_path in [x for x in existing if x.startswith(prefixes)]:
+                forgotten[rel_path] = existing.pop(rel_path)
+
+        # Directory rows are only built by full scans, so drop any which
+        # are now stale.
+        for rel_path in to_forget:
+            while rel_path != '.':
+                rel_path = os.path.dirname(rel_path) or '.'
+                entry = existing.get(rel_path)
+                if entry is not None and entry.is_dir:
+                    del existing[rel_path]
+
+        def source_for(rel_path):
+            entry = forgotten.get(rel_path)
+            if entry is not None:
+                return entry
+            # Was it (or a parent) renamed from somewhere we know about?
+            head = rel_path
+            tail = ''
+            while head:
+                old = renames.get(head)
+                if old is not None:
+                    return forgotten.get(old + tail)
+                head, name = os.path.split(head)
+                tail = '/' + name + tail
+
+        items = self._iter_changed_items(to_examine, source_for)
+
+        for item, checksum in _threaded_map(
+            self._pool_size(threads),
+            _checksum_path,
+            items,
+            itertools.cycle((self, )),
+        ):
+            if not checksum:
+                self.error_count += 1
+                continue
+            formatted = format_item(item, checksum)
+            if self.verbosity:
+                print(formatted)
+            entry = existing[item.rel_path] = parse_row(formatted)
+            _add_parents(existing_dirs, item.rel_path)
+            if item.stat.st_dev == self._root_dev:
+                self._remember_inode(inodes, entry)
+
+        # Anything forgotten which wasn't seen again is gone.
+        for entry in forgotten.values():
+            if inodes.get(entry.inode) is entry:
+                del inodes[entry.inode]
+
+    def write_existing(self, out, header_extra=None):
+        """Write all of :attr:`existing` as a complete index."""
+
+        files = [e for e in self.existing.values() if not e.is_dir]
+        self.total_count = len(files)
+        self.total_bytes = sum(e.size for e in files)
+
+        uuid = self._write_header(out, header_extra)
+        for entry in sorted(self.existing.values(), key=lambda e: walk_sort_key(e.path, e.is_dir)):
+            out.write(format_entry(entry) + '\n')
+        self._write_footer(out, uuid)
 
+    def run_changes(self, out, changes, threads=1, header_extra=None):
+        """Write a complete index, only re-examining paths from a change list.
 
+        The existing index must already be loaded (via :meth:`load_existing`).
+        See :meth:`apply_changes`.
 
+        """
+        self.apply_changes(changes, threads=threads)
+        self.write_existing(out, header_extra)
 
 
+def _add_parents(dirs, rel_path):
+    rel_path = os.path.dirname(rel_path)
+    while rel_path and rel_path not in dirs:
+        dirs.add(rel_path)
+        rel_path = os.path.dirname(rel_path)
 
 
+def parse_row(row):
+    return Entry(meta=None, **dict(zip(COLUMNS, row.split('\t'))))
+
+
+def format_item(item, checksum, size=None):
+    return '\t'.join(str(x) for x in (
+        checksum,
+        item.stat.st_ino,
+        item.type_code,
+        '{:o}'.format(item.perms),
+        item.stat.st_size if size is None else size,
+        item.stat.st_uid,
+        item.stat.st_gid,
+
+        '{:.{}f}'.format(item.stat.st_mtime, STAT_TIME_DIGITS),
+        '{:.{}f}'.format(item.stat.st_ctime, STAT_TIME_DIGITS),
+
+        item.rel_path,
+    ))
+
+
+def format_entry(entry):
+    return '\t'.join('' if x is None else str(x) for x in (
+        entry.raw_checksum,
+        entry.inode,
+        entry.type,
+        '{:o}'.format(entry.perms),
+        entry.size,
+        entry.uid,
+        entry.gid,
+        entry.raw_mtime,
+        entry.raw_ctime,
+        entry.path,
+    ))
+
+
+def shard_of(key, count):
+    """Deterministically assign a path (or name) to one of ``count`` shards."""
+    return zlib.crc32(key.encode('utf8')) % count
+
+
+def _run_shard(indexer_kwargs, out_path, threads, sorted, header_extra):
+    indexer = Indexer(**indexer_kwargs)
+    if indexer_kwargs.get('throttle_control') and hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: indexer.throttle.request_reload())
+    with open(out_path, 'w') as out:
+        indexer.run(out, threads=threads, sorted=sorted, header_extra=header_extra)
+
+
+def _sharded_root_row(indexer_kwargs, paths):
+
+    # No shard sees the whole top level, so the row for the top directory
+    # is built from the top-level rows of every shard.
+
+    indexer = Indexer(**indexer_kwargs)
+    item = WalkItem(*os.path.split(indexer.path_to_index))
+    item.rel_path = os.path.relpath(item.path, indexer.root)
+    parent = '' if item.rel_path == '.' else item.rel_path
+
+    frame = _DirFrame(item)
+    for path in paths:
+        for entry in Index(path):
+            if entry.path == '.' or os.path.dirname(entry.path) != parent:
+                continue
+            name = os.path.basename(entry.path)
+            if entry.is_dir:
+                params = entry.checksum_params
+                frame.add(name, entry.raw_checksum, int(params['n']), entry.size, float(params['m']))
+            else:
+                frame.add(name, entry.raw_checksum, 1, entry.size, entry.mtime)
+
+    return format_item(item, frame.checksum(indexer.algo_key, indexer.checksum_algo), size=frame.bytes)
+
+
+def run_sharded(out_path, shards, threads=1, header_extra=None, **indexer_kwargs):
+    """Index in ``shards`` parallel processes, and merge them into ``out_path``.
+
+    Each shard is written to ``{out_path}.shard-{i}-of-{n}`` first, and those
+    are removed once the merge succeeds. Shards are always sorted, since
+    the merge requires it.
+
+    """
+
+    # SIGHUP re-reads the throttle control file, so the shards get it
+    # instead of us. It is ignored until they are all started (and have
+    # taken it over from us).
+    forward_hup = indexer_kwargs.get('throttle_control') and hasattr(signal, 'SIGHUP')
+    if forward_hup:
+        previous_hup = signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    procs = []
+    paths = []
+    for i in range(shards):
+        # The I/O budget is split evenly between the shards.
+        kwargs = dict(indexer_kwargs, shard=(i, shards), throttle_share=1.0 / shards)
+        path = '{}.shard-{}-of-{}'.format(out_path, i, shards)
+        proc = multiprocessing.Process(target=_run_shard, args=(kwargs, path, threads, True, header_extra))
+        proc.start()
+        procs.append(proc)
+        paths.append(path)
+
+    def on_hup(signum, frame):
+        for proc in procs:
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGHUP)
+
+    if forward_hup:
+        signal.signal(signal.SIGHUP, on_hup)
+
+    failed = []
+    try:
+        for i, proc in enumerate(procs):
+            proc.join()
+            if proc.exitcode:
+                failed.append(i)
+    finally:
+        if forward_hup:
+            signal.signal(signal.SIGHUP, previous_hup)
+    if failed:
+        raise RuntimeError("Shards failed.", failed)
+
+    extra_rows = []
+    if indexer_kwargs.get('dirs'):
+        extra_rows.append(_sharded_root_row(indexer_kwargs, paths))
+
+    with open(out_path, 'w') as out:
+        merge_indexes(paths, out, extra_rows)
+    for path in paths:
+        os.unlink(path)
+
 
 def printerr(*args, **kwargs):
     kwargs['file'] = sys.stderr
@@ -514,6 +1319,10 @@ def main(argv=None):
 
     parser.add_argument('-e', '--exclude', action='append', default=[],
         help="Exclude files that match this regex; can be used multiple times.")
+    parser.add_argument('-g', '--exclude-glob', action='append', default=[],
+        help="Exclude files that match this gitignore-style glob; can be used multiple times.")
+    parser.add_argument('--exclude-from', action='append', default=[], metavar='FILE',
+        help="Exclude files that match gitignore-style globs from this file.")
 
     parser.add_argument('-o', '--out',
         help="File to write to instead of stdout.")
@@ -525,18 +1334,59 @@ def main(argv=None):
     parser.add_argument('-u', '--update', action='store_true',
         help="Update index with files that were missing or changed from last run.")
 
+    parser.add_argument('--changes', metavar='FILE',
+        help="Update index by only re-examining paths from this change list (`zfs diff` output, "
+             "or a list of paths); use - for stdin. The index is rewritten with the changes applied.")
+    parser.add_argument('--changes-format', choices=('auto', 'zfs', 'lines', 'nul'), default='auto',
+        help="Format of --changes; detected by default.")
+
     parser.add_argument('--unsorted', action='store_true',
         help="Will lose less work if there is a crash, but --auto-start will skip over any lost work.")
 
+    parser.add_argument('--dirs', action='store_true',
+        help="Also write directory rows, with totals and a Merkle hash of their contents.")
+
     parser.add_argument('--head',
         help="How much of front of file to checksum.")
     parser.add_argument('--tail',
         help="How much of end of file to checksum.")
-
-    parser.add_argument('-t', '--threads', type=int, default=1,
-        help="How many threads to run at once.")
+    parser.add_argument('--samples', type=int, metavar='N',
+        help="Only checksum the size, head, tail, and N evenly spaced blocks of each file.")
+    parser.add_argument('--sample-size', metavar='SIZE',
+        help="How large each sampled block is; defaults to 1M.")
+    parser.add_argument('--chunks', action='store_true',
+        help="Also record fingerprints of content-defined chunks of every file in OUT.chunks, "
+             "for uindex-dedupe --chunk-report.")
+    parser.add_argument('--chunk-avg', metavar='SIZE',
+        help="The average chunk size for --chunks; defaults to {}.".format(DEFAULT_CHUNK_AVG))
+
+    parser.add_argument('-t', '--threads', type=parse_threads, default=1,
+        help="How many threads to run at once, or auto (or auto:MAX) to continuously "
+             "tune it to whatever the storage handles best.")
     parser.add_argument('-H', '--checksum-algo', default='sha256',
         help="Which hashlib algorithm to use.")
+    parser.add_argument('--io-order', choices=sorted(IO_ORDERS), default='walk',
+        help="Order to read files in; inode or extent (physical location, via FIEMAP) "
+             "reduce seeking on spinning disks. The index is still written in walk order.")
+    parser.add_argument('--io-window', type=int, default=256, metavar='N',
+        help="How many files ahead --io-order can look.")
+    parser.add_argument('--io-mode', choices=IO_MODES, default='buffered',
+        help="nocache uses posix_fadvise to avoid evicting other users' files from the page cache; "
+             "direct uses O_DIRECT to bypass it entirely (where supported).")
+    parser.add_argument('--max-bytes', type=parse_bytes, metavar='SIZE',
+        help="Read at most this many bytes per second.")
+    parser.add_argument('--max-ops', type=float, metavar='N',
+        help="Perform at most this many stat/listdir/open operations per second.")
+    parser.add_argument('--throttle-control', metavar='FILE',
+        help="File of bytes=SIZE and ops=N lines to override --max-bytes and --max-ops while running; "
+             "it is re-read when it changes, or on SIGHUP.")
+
+    parser.add_argument('--shard', metavar='I/N',
+        help="Only index the I-th (from 0) of N shards; merge them with uindex-merge.")
+    parser.add_argument('--shards', type=int, metavar='N',
+        help="Index in N local processes, and merge them into --out.")
+    parser.add_argument('--shard-by', choices=('top', 'hash'), default='top',
+        help="Shard by top-level directory (the default), or by hashed path.")
 
     parser.add_argument('-C', '--root', type=os.path.abspath,
         help="Root from which relative paths will be derived.")
@@ -552,28 +1402,94 @@ def main(argv=None):
         if args.verbose:
             printerr(*a, **kwargs)
 
-    if sum(map(bool, (args.auto_start, args.start, args.update))) > 1:
-        printerr("--start, --auto-start, and --update don't work together.")
+    if sum(map(bool, (args.auto_start, args.start, args.update, args.changes))) > 1:
+        printerr("--start, --auto-start, --update, and --changes don't work together.")
         exit(1)
+    if args.changes and not args.out:
+        printerr("--changes requires --out.")
+        exit(2)
     if args.auto_start and not args.out:
         printerr("--auto-start requires --out.")
         exit(2)
     if args.update and not args.out:
         printerr("--update requires --out.")
         exit(2)
+    if args.shards and not args.out:
+        printerr("--shards requires --out.")
+        exit(2)
+    if args.shards and (args.shard or args.start or args.auto_start or args.update or args.changes or args.unsorted):
+        printerr("--shards doesn't work with --shard, --start, --auto-start, --update, --changes, or --unsorted.")
+        exit(1)
+
+    if args.chunks and not args.out:
+        printerr("--chunks requires --out.")
+        exit(2)
+    if args.chunks and (args.shards or args.changes or args.head or args.tail or args.samples):
+        printerr("--chunks doesn't work with --shards, --changes, --head, --tail, or --samples.")
+        exit(1)
+
+    if args.dirs and (args.start or args.auto_start or args.shard_by == 'hash' and (args.shard or args.shards)):
+        printerr("--dirs doesn't work with --start, --auto-start, or --shard-by hash.")
+        exit(1)
+
+    shard = None
+    if args.shard:
+        try:
+            shard = tuple(int(x) for x in args.shard.split('/'))
+            if len(shard) != 2 or not (0 <= shard[0] < shard[1]):
+                raise ValueError(args.shard)
+        except ValueError:
+            printerr("--shard must look like I/N.")
+            exit(2)
+
+    header_extra = dict(
+        cli=dict(
+            argv=sys.argv,
+            cwd=os.getcwd(),
+        )
+    )
 
-    indexer = Indexer(
+    indexer_kwargs = dict(
         path_to_index=args.path,
         root=args.root,
         start=args.start,
         excludes=args.exclude,
+        exclude_globs=args.exclude_glob + [x for path in args.exclude_from for x in read_exclude_file(path)],
         include_dotfiles=args.include_dotfiles,
         checksum_algo=args.checksum_algo,
         head=args.head,
         tail=args.tail,
+        samples=args.samples,
+        sample_size=args.sample_size,
+        shard=shard,
+        shard_by=args.shard_by,
+        dirs=args.dirs,
+        io_order=args.io_order,
+        io_window=args.io_window,
+        io_mode=args.io_mode,
+        max_bytes=args.max_bytes,
+        max_ops=args.max_ops,
+        throttle_control=args.throttle_control and os.path.abspath(args.throttle_control),
+        chunk_avg=(args.chunk_avg or DEFAULT_CHUNK_AVG) if args.chunks else None,
         verbosity=args.verbose,
     )
 
+    if args.shards:
+        run_sharded(args.out, args.shards,
+            threads=args.threads,
+            header_extra=header_extra,
+            **indexer_kwargs
+        )
+        return
+
+    indexer = Indexer(**indexer_kwargs)
+
+    if args.chunks and not indexer.chunker().use_numpy:
+        printerr("WARNING: --chunks is very slow without numpy; try `pip install numpy`.")
+
+    if args.throttle_control and hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: indexer.throttle.request_reload())
+
     if args.auto_start:
         if not os.path.exists(args.out):
             printerr("Output file must exist for --auto-start.")
@@ -588,18 +1504,52 @@ def main(argv=None):
         feedback("Reading existing index to update...")
         indexer.load_existing(args.out)
 
-    out = open(args.out, 'a' if (args.start or args.auto_start or args.update) else 'w') if args.out else sys.stdout
+    if args.changes:
+        if not os.path.exists(args.out):
+            printerr("Output file must exist for --changes.")
+            exit(3)
+        feedback("Reading existing index to update...")
+        indexer.load_existing(args.out)
+        changes = iter_changes(sys.stdin if args.changes == '-' else open(args.changes), args.changes_format)
+        tmp_path = '{}.{}.tmp'.format(args.out, os.getpid())
+        with open(tmp_path, 'w') as out:
+            indexer.run_changes(out, changes,
+                threads=args.threads,
+                header_extra=header_extra,
+            )
+        os.rename(tmp_path, args.out)
+        return
+
+    mode = 'a' if (args.start or args.auto_start or args.update) else 'w'
+
+    # Files which aren't read again keep their chunks from before, so they
+    # must already be there, and comparable.
+    chunks_path = args.out + '.chunks' if args.chunks else None
+    if chunks_path and mode == 'a':
+        header = read_chunks_header(chunks_path) if os.path.exists(chunks_path) else None
+        if header is None:
+            printerr("--chunks with --start, --auto-start, or --update requires an existing {}.".format(chunks_path))
+            exit(3)
+        chunker = indexer.chunker()
+        if (header.get('algo'), header.get('avg_size')) != (chunker.algo, chunker.avg_size):
+            printerr("--chunk-avg and --checksum-algo must match the existing {} ({} {}).".format(
+                chunks_path, header.get('algo'), header.get('avg_size')))
+            exit(2)
+
+    out = open(args.out, mode) if args.out else sys.stdout
+    chunks_out = open(chunks_path, mode) if chunks_path else None
     indexer.run(out,
         threads=args.threads,
         sorted=not args.unsorted,
-        header_extra=dict(
-            cli=dict(
-                argv=sys.argv,
-                cwd=os.getcwd(),
-            )
-        ),
+        header_extra=header_extra,
+        chunks_out=chunks_out,
     )
 
+    if chunks_out is not None:
+        chunks_out.close()
+        if mode == 'a':
+            compact_chunks(chunks_path)
+
 
 if __name__ == '__main__':
     exit(main())
@@ -3,7 +3,9 @@ from __future__ import print_function
 import argparse
 import os
 
+from .chunks import chunks_path_for, estimate_chunk_dedupe
 from .utils import prompt_bool, format_bytes, parse_bytes
+from .index import Index
 from .parse import iter_entries
 
 
@@ -13,7 +15,30 @@ def iter_relpaths(path):
         yield '/'.join(chunks[i:])
 
 
-def main():
+def chunk_report(paths, processes=None, sample=1):
+
+    stats = estimate_chunk_dedupe([chunks_path_for(x) for x in paths], processes=processes, sample=sample)
+    estimated = '~' if sample > 1 else ''
+
+    for x in stats:
+        if x.path is None:
+            continue
+        print('{}: {} in {} chunks; {}{} unique within, {}{} new'.format(x.path,
+            format_bytes(x.bytes), x.count,
+            estimated, format_bytes(x.unique_bytes),
+            estimated, format_bytes(x.new_bytes),
+        ))
+
+    total = stats[-1]
+    saved = max(0, total.bytes - total.unique_bytes)
+    print('Total: {} in {} chunks; {}{} unique; {}{} ({:.1f}%) could be saved by block-level dedupe.'.format(
+        format_bytes(total.bytes), total.count,
+        estimated, format_bytes(total.unique_bytes),
+        estimated, format_bytes(saved), 100.0 * saved / total.bytes if total.bytes else 0,
+    ))
+
+
+def main(argv=None):
 
     parser = argparse.ArgumentParser()
     
@@ -26,6 +51,11 @@ def main():
     
     parser.add_argument('-C', '--root', type=os.path.abspath, default=os.getcwd(),
         help="The root to manipulate files in.")
+
+    parser.add_argument('--snapshot', action='store_true',
+        help="Cache the parsed index next to it, to speed up the next run.")
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+        help="Parse the index with N processes.")
     
     # internal_args = parser.add_argument_group('Dedupe internal')
     # internal_args.add_argument('-H', '--link-self', action='store_true',
@@ -52,9 +82,27 @@ def main():
     external_args.add_argument('-S', '--minsize', metavar="SIZE", type=parse_bytes,
         help="Tighten matching so that file size is at least this large.")
 
-    parser.add_argument('index')
+    chunk_args = parser.add_argument_group('Chunk report',
+        description="Estimate block-level dedupe across indexes created with `uindex-create --chunks`.")
+    chunk_args.add_argument('--chunk-report', action='store_true',
+        help="Report on the .chunks of every index given.")
+    chunk_args.add_argument('--sample', type=int, default=1, metavar='N',
+        help="Only track 1/N of chunks (chosen by fingerprint) to bound memory; savings are scaled up.")
 
-    args = parser.parse_args()
+    parser.add_argument('index', nargs='+')
+
+    args = parser.parse_args(argv)
+
+    if args.chunk_report:
+        for path in args.index:
+            if not os.path.exists(chunks_path_for(path)):
+                parser.error("{} has no chunks; create it with --chunks.".format(path))
+        chunk_report(args.index, processes=args.jobs, sample=max(1, args.sample))
+        return
+
+    if len(args.index) > 1:
+        parser.error("Only --chunk-report takes more than one index.")
+    args.index = args.index[0]
 
     def verbose(lvl, *a, **kwargs):
         if args.verbose >= lvl:
@@ -62,23 +110,29 @@ def main():
 
     verbose(1, 'Loading', args.index)
 
+    index = Index(args.index,
+        snapshot=args.snapshot or None,
+        processes=args.jobs,
+        pop_path=args.pop_path,
+        prepend_path=args.prepend_path,
+    )
+    by_checksum = index.by_checksum
+
     bytes_ = 0
     dupes = 0
+    for (checksum, size), entries in by_checksum.items():
+        if len(entries) > 1:
+            bytes_ += size * (len(entries) - 1)
+            dupes += len(entries) - 1
 
-    by_checksum = {}
-    for entry in iter_entries(open(args.index), pop_path=args.pop_path, prepend_path=args.prepend_path):
-        if entry.checksum in by_checksum:
-            bytes_ += entry.size
-            dupes += 1
-        by_checksum.setdefault((entry.checksum, entry.size), []).append(entry)
-    
     verbose(1, '{} internal dupes (by checksum) across {} files.'.format(format_bytes(bytes_), dupes))
 
     if args.delete_matching:
 
         bytes_ = 0
 
-        for entry in iter_entries(open(args.delete_matching)):
+        # Only our own index needs to be in memory.
+        for entry in iter_entries(open(args.delete_matching, newline='\n')):
 
             self_entries = by_checksum.get((entry.checksum, entry.size))
             if not self_entries:
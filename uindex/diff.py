@@ -1,8 +1,9 @@
 import argparse
 import collections
+import os
 import re
 
-from .parse import iter_entries
+from .index import Index
 
 
 def main():
@@ -16,6 +17,10 @@ def main():
     parser.add_argument('--replace-b', '--rb', nargs=2)
     parser.add_argument('-v', '--invert-search', action='store_true')
     parser.add_argument('-L', '--ignore-links', action='count')
+    parser.add_argument('--snapshot', action='store_true',
+        help="Cache the parsed indexes next to them, to speed up the next run.")
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+        help="Parse each index with N processes.")
     parser.add_argument('a')
     parser.add_argument('b')
     args = parser.parse_args()
@@ -23,25 +28,54 @@ def main():
     match = missing = extra = 0
 
     print('---', args.a)
-    A = sorted(iter_entries(open(args.a),
+    A = collections.deque(Index(args.a,
+        snapshot=args.snapshot or None,
+        processes=args.jobs,
         prepend_path=args.prepend_a,
         replace_path=args.replace_a,
         search_path=args.search_a,
         invert_search=args.invert_search,
-    ), key=lambda x: x.path)
+    ).sorted_by_path)
 
     print('+++', args.b)
-    B = sorted(iter_entries(open(args.b),
+    B = collections.deque(Index(args.b,
+        snapshot=args.snapshot or None,
+        processes=args.jobs,
         prepend_path=args.prepend_b,
         replace_path=args.replace_b,
         search_path=args.search_b,
         invert_search=args.invert_search,
-    ), key=lambda x: x.path)
+    ).sorted_by_path)
+
+    # Directory rows (from `uindex-create --dirs`) let us skip identical
+    # subtrees in one comparison.
+    A_dirs = dict((os.path.normpath(a.path), a) for a in A if a.is_dir)
+    B_dirs = dict((os.path.normpath(b.path), b) for b in B if b.is_dir)
+    same = set(
+        path for path, a in A_dirs.items()
+        if path in B_dirs and B_dirs[path].checksum == a.checksum
+    )
+
+    def in_same(path):
+        path = os.path.dirname(path)
+        while path:
+            if path in same:
+                return True
+            path = os.path.dirname(path)
+        return '.' in same
+
+    for path in same:
+        if not in_same(path) or path == '.':
+            match += int(A_dirs[path].checksum_params.get('n', 0))
+
+    if A_dirs or B_dirs:
+        A = collections.deque(a for a in A if not (a.is_dir or in_same(a.path)))
+        B = collections.deque(b for b in B if not (b.is_dir or in_same(b.path)))
 
     def pop(X):
-        x = X.pop(0)
+        x = X.popleft()
         while X and X[0].path == x.path:
-            X.pop(0)
+            X.popleft()
         return x
 
     last_link = None
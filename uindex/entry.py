@@ -20,19 +20,46 @@ class Entry(object):
         self.inode = int(inode) if inode else None
         self.type  = type
         
+        self.raw_mtime = mtime
+        self.raw_ctime = ctime
         self.raw_time = ctime or mtime
 
+    @property
+    def is_dir(self):
+        return self.type == '/'
+
     @cached_property
     def checksum(self):
         return self.raw_checksum.split(':')[-1]
 
+    @cached_property
+    def checksum_params(self):
+        """Parameters from the prefix of the checksum.
+
+        E.g. ``tree,sha256,h=1M,n=3:...`` becomes
+        ``{'tree': True, 'algo': 'sha256', 'h': '1M', 'n': '3'}``.
+
+        """
+        params = {}
+        if ':' not in self.raw_checksum:
+            return params
+        for part in self.raw_checksum.rsplit(':', 1)[0].split(','):
+            if '=' in part:
+                key, value = part.split('=', 1)
+                params[key] = value
+            elif part == 'tree':
+                params['tree'] = True
+            else:
+                params['algo'] = part
+        return params
+
     @cached_property
     def epsilon(self):
         try:
             digits = self.raw_time.split('.')[1]
         except IndexError:
             return 0
-        return 2 * 10 ** -digits
+        return 2 * 10 ** -len(digits)
 
     def prepend_path(self, prefix):
         if prefix:
@@ -0,0 +1,223 @@
+from __future__ import print_function
+
+import os
+import re
+
+
+def translate_glob(pattern):
+    """Translate a gitignore-style glob into ``(regex, anchored, dir_only)``.
+
+    Patterns without a slash (other than a trailing one) match names at any
+    depth, and others match relative paths. A trailing slash only matches
+    directories. ``*`` and ``?`` don't match slashes, but ``**`` does.
+
+    """
+
+    if pattern.startswith('!'):
+        raise ValueError("Negated exclude patterns are not supported.", pattern)
+
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    if pattern.startswith('**/'):
+        # Leading "**/" is the same as matching at any depth.
+        pattern = pattern[3:]
+        anchored = '/' in pattern
+        if anchored:
+            pattern = '**/' + pattern
+
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif c == '*':
+            out.append('[^/]*')
+            i += 1
+        elif c == '?':
+            out.append('[^/]')
+            i += 1
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end < 0:
+                out.append(re.escape(c))
+                i += 1
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append('[{}]'.format(body.replace('\\', '\\\\')))
+                i = end + 1
+        elif c == '\\' and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(c))
+            i += 1
+
+    return ''.join(out), anchored, dir_only
+
+
+def _is_literal(pattern):
+    return not re.search(r'[*?\[\\]', pattern)
+
+
+# Numbered backreferences are renumbered by joining patterns, and named
+# groups may collide, so patterns with either are matched on their own.
+_backref_re = re.compile(r'\\[1-9]|\(\?P[<=]')
+
+
+def _compile(patterns):
+
+    if not patterns:
+        return None
+
+    joined = []
+    separate = []
+    for pattern in patterns:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ValueError("Invalid exclude regex: {}.".format(e), pattern)
+        (separate if _backref_re.search(pattern) else joined).append(pattern)
+
+    matchers = [re.compile('^(?:{})$'.format(x), re.DOTALL).match for x in separate]
+    if joined:
+        matchers.insert(0, re.compile('^(?:{})$'.format('|'.join('(?:{})'.format(x) for x in joined)), re.DOTALL).match)
+
+    if len(matchers) == 1:
+        return matchers[0]
+    return lambda x: any(match(x) for match in matchers)
+
+
+def read_exclude_file(path):
+    """Read gitignore-style globs from a file, skipping blank lines and comments."""
+    globs = []
+    with open(path) as fh:
+        for line in fh:
+            line = line.rstrip('\n').rstrip('\r')
+            if line.strip() and not line.startswith('#'):
+                globs.append(line)
+    return globs
+
+
+class Excluder(object):
+
+    """A single compiled matcher for all of the exclusion rules.
+
+    Every kind of rule is merged into (at most) one set of literal names
+    and one regex for each of names and paths (and again for rules
+    which only match directories), so the cost per directory entry
+    doesn't grow with the number of rules.
+
+    :param str root: What paths are relative to.
+    :param str base: Only names below this are matched; defaults to the root.
+    :param regexes: Regexes as given to ``uindex-create --exclude``; those
+        starting with a slash are matched against relative paths, and others
+        against names.
+    :param globs: Gitignore-style globs (see :func:`translate_glob`).
+    :param bool include_dotfiles: Don't exclude names starting with a dot.
+
+    """
+
+    def __init__(self, root, base=None, regexes=(), globs=(), include_dotfiles=False):
+
+        self.root = root
+        self.base = base or root
+
+        names = set()
+        dir_names = set()
+        name_patterns = []
+        path_patterns = []
+        dir_name_patterns = []
+        dir_path_patterns = []
+
+        for raw in regexes:
+            if raw.startswith('/'):
+                path_patterns.append(raw.strip('/'))
+            else:
+                name_patterns.append(raw.strip('/'))
+
+        for raw in globs:
+            regex, anchored, dir_only = translate_glob(raw)
+            stripped = raw.strip('/')
+            if not anchored and _is_literal(stripped):
+                (dir_names if dir_only else names).add(stripped)
+            elif anchored:
+                (dir_path_patterns if dir_only else path_patterns).append(regex)
+            else:
+                (dir_name_patterns if dir_only else name_patterns).append(regex)
+
+        if not include_dotfiles:
+            name_patterns.append(r'\..*')
+
+        self.names = frozenset(names)
+        self.dir_names = frozenset(dir_names)
+        self.match_name = _compile(name_patterns)
+        self.match_path = _compile(path_patterns)
+        self.match_dir_name = _compile(dir_name_patterns)
+        self.match_dir_path = _compile(dir_path_patterns)
+
+        self.is_empty = not (
+            names or dir_names or name_patterns or path_patterns or
+            dir_name_patterns or dir_path_patterns
+        )
+
+    def for_dir(self, dir_path):
+        """Return a function of ``(name, is_dir=False)`` for entries in the given directory.
+
+        The function should be called before stat-ing an entry, and then
+        again with ``is_dir=True`` once it is known to be a directory.
+
+        """
+
+        prefix = os.path.relpath(dir_path, self.root)
+        prefix = '' if prefix == '.' else prefix + '/'
+
+        # Early-binding for speed.
+        names = self.names
+        dir_names = self.dir_names
+        match_name = self.match_name
+        match_path = self.match_path
+        match_dir_name = self.match_dir_name
+        match_dir_path = self.match_dir_path
+
+        def excluded(name, is_dir=False):
+            if is_dir:
+                return bool(
+                    (name in dir_names) or
+                    (match_dir_name and match_dir_name(name)) or
+                    (match_dir_path and match_dir_path(prefix + name))
+                )
+            return bool(
+                (name in names) or
+                (match_name and match_name(name)) or
+                (match_path and match_path(prefix + name))
+            )
+
+        return excluded
+
+    def excludes_path(self, path, is_dir=False):
+        """Is the given absolute path (or anything above it) excluded?"""
+
+        rel_path = os.path.relpath(path, self.base)
+        if rel_path == '.' or rel_path.startswith('../'):
+            return False
+
+        dir_path = self.base
+        parts = rel_path.split('/')
+        for i, name in enumerate(parts):
+            excluded = self.for_dir(dir_path)
+            if excluded(name):
+                return True
+            if (i < len(parts) - 1 or is_dir) and excluded(name, True):
+                return True
+            dir_path = os.path.join(dir_path, name)
+        return False
@@ -0,0 +1,234 @@
+from __future__ import print_function
+
+import ctypes
+import ctypes.util
+import errno
+import mmap
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# From <linux/fs.h> and <linux/fiemap.h>.
+FS_IOC_FIEMAP = 0xC020660B
+_fiemap = struct.Struct('=QQIIII')
+_fiemap_extent = struct.Struct('=QQQQQI12x')
+
+
+def physical_offset(path):
+    """The physical byte offset of the start of a file on its device.
+
+    Uses the FIEMAP ioctl (on Linux), and returns None if it isn't
+    available, or the file has no extents (e.g. it is empty or inline).
+
+    """
+
+    if fcntl is None:
+        return
+
+    buf = bytearray(_fiemap.size + _fiemap_extent.size)
+    # Map everything, and ask for just the first extent.
+    _fiemap.pack_into(buf, 0, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOATIME', 0))
+    except OSError:
+        # O_NOATIME is only allowed for the owner.
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, buf)
+    except (IOError, OSError):
+        return
+    finally:
+        os.close(fd)
+
+    mapped = _fiemap.unpack_from(buf, 0)[3]
+    if not mapped:
+        return
+    return _fiemap_extent.unpack_from(buf, _fiemap.size)[1]
+
+
+IO_MODES = ('buffered', 'nocache', 'direct')
+
+# O_DIRECT requires aligned offsets, lengths, and buffers. 4k satisfies
+# every device we have seen; mmap gives us page aligned buffers.
+DIRECT_ALIGN = 4096
+DIRECT_CHUNK_SIZE = 1024 * 1024
+
+# How much to read between dropping pages from the cache.
+NOCACHE_DROP_SIZE = 8 * 1024 * 1024
+
+# How much of the start of a file to check for existing residency.
+RESIDENCY_PROBE_SIZE = 4 * 1024 * 1024
+
+
+def iter_chunks(path, ranges, mode='buffered', chunk_size=65536):
+    """Read the given ``(offset, length)`` ranges of a file, in chunks.
+
+    A length of ``None`` reads until EOF. The modes are:
+
+    - ``buffered``: normal reads through the page cache;
+    - ``nocache``: as above, but with ``posix_fadvise`` hints to read ahead
+      sequentially, and to drop the pages we have read from the cache (unless
+      the file was already cached when we started, since someone else is using it);
+    - ``direct``: ``O_DIRECT`` reads which bypass the cache entirely, falling
+      back to ``nocache`` where the filesystem does not support it.
+
+    Chunks may be memoryviews which are only valid until the next is requested.
+
+    """
+
+    if mode == 'direct' and hasattr(os, 'O_DIRECT') and hasattr(os, 'preadv'):
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+        else:
+            return _iter_direct(fd, ranges, path)
+
+    if mode in ('nocache', 'direct') and hasattr(os, 'posix_fadvise'):
+        return _iter_nocache(os.open(path, os.O_RDONLY), ranges, chunk_size)
+
+    return _iter_buffered(path, ranges, chunk_size)
+
+
+def _iter_buffered(path, ranges, chunk_size):
+    with open(path, 'rb') as fh:
+        for offset, todo in ranges:
+            if offset != fh.tell():
+                fh.seek(offset)
+            while todo is None or todo > 0:
+                chunk = fh.read(chunk_size if todo is None else min(chunk_size, todo))
+                if not chunk:
+                    break
+                if todo:
+                    todo -= len(chunk)
+                yield chunk
+
+
+def _iter_nocache(fd, ranges, chunk_size):
+
+    try:
+
+        # Don't evict a file which something else has in the cache.
+        resident, _ = cached_pages(fd, RESIDENCY_PROBE_SIZE)
+        drop = not resident
+
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_NOREUSE)
+
+        for offset, todo in ranges:
+
+            pos = dropped = offset
+            while todo is None or todo > 0:
+                chunk = os.pread(fd, chunk_size if todo is None else min(chunk_size, todo), pos)
+                if not chunk:
+                    break
+                if todo:
+                    todo -= len(chunk)
+                pos += len(chunk)
+                yield chunk
+                if drop and pos - dropped >= NOCACHE_DROP_SIZE:
+                    os.posix_fadvise(fd, dropped, pos - dropped, os.POSIX_FADV_DONTNEED)
+                    dropped = pos
+
+            if drop and pos > dropped:
+                os.posix_fadvise(fd, dropped, pos - dropped, os.POSIX_FADV_DONTNEED)
+
+    finally:
+        os.close(fd)
+
+
+def _iter_direct(fd, ranges, path):
+
+    # The buffer is freed once the last chunk is no longer referenced.
+    buf = mmap.mmap(-1, DIRECT_CHUNK_SIZE)
+    view = memoryview(buf)
+
+    try:
+
+        for offset, length in ranges:
+
+            end = None if length is None else offset + length
+            pos = offset
+            while end is None or pos < end:
+
+                aligned = pos - pos % DIRECT_ALIGN
+                try:
+                    size = os.preadv(fd, [buf], aligned)
+                except OSError as e:
+                    # Some filesystems accept O_DIRECT but then refuse to read.
+                    if e.errno != errno.EINVAL or pos != offset:
+                        raise
+                    for chunk in _iter_nocache(os.open(path, os.O_RDONLY), [(pos, None if end is None else end - pos)], 65536):
+                        yield chunk
+                    break
+
+                start = pos - aligned
+                if size <= start:
+                    break
+                stop = size if end is None else min(size, end - aligned)
+                yield view[start:stop]
+                pos = aligned + stop
+
+                if size < DIRECT_CHUNK_SIZE:
+                    break
+
+    finally:
+        os.close(fd)
+
+
+_libc = None
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int64)
+        libc.munmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+        libc.mincore.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte))
+        _libc = libc
+    return _libc
+
+
+def cached_pages(fd, size=None):
+    """Return ``(resident, total)`` pages of a file (up to ``size`` bytes) in the page cache."""
+
+    file_size = os.fstat(fd).st_size
+    size = file_size if size is None else min(size, file_size)
+    if not size:
+        return 0, 0
+
+    libc = _get_libc()
+    addr = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+    if addr is None or addr == ctypes.c_void_p(-1).value:
+        return 0, 0
+
+    try:
+        pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+        vec = (ctypes.c_ubyte * pages)()
+        if libc.mincore(addr, size, vec):
+            return 0, 0
+        # Only the low bit means resident; the others are reserved.
+        return sum(x & 1 for x in vec), pages
+    finally:
+        libc.munmap(addr, size)
+
+
+def path_cached_pages(path):
+    """Return ``(resident, total)`` pages of the given file in the page cache."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return cached_pages(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,161 @@
+from __future__ import print_function
+
+import bisect
+import os
+import pickle
+
+from .parse import iter_entries, load_entries
+from .utils import cached_property
+
+
+# Bump whenever the attributes of Entry change, since snapshots pickle them.
+SNAPSHOT_VERSION = 2
+
+
+class Index(object):
+
+    """A parsed index, with secondary indexes built on demand.
+
+    :param source: A path or file object to parse entries from.
+    :param entries: Entries to use instead of parsing a source.
+    :param bool lazy: Parse on first use, instead of immediately.
+    :param snapshot: Where to cache the parsed entries; ``True`` puts it
+        next to the source. The snapshot is only used if the source has not
+        changed, and was parsed with the same filters.
+    :param int processes: Parse a source path with this many processes
+        (see :func:`.load_entries`).
+    :param filters: Passed through to :func:`.iter_entries`.
+
+    """
+
+    def __init__(self, source=None, entries=None, lazy=True, snapshot=None, processes=None, **filters):
+
+        self.source = source
+        self.filters = filters
+        self.processes = processes
+
+        if snapshot is True:
+            if not isinstance(source, str):
+                raise ValueError("Default snapshot requires a source path.")
+            snapshot = source + '.snapshot'
+        self.snapshot_path = snapshot
+
+        self._entries = list(entries) if entries is not None else None
+        if not lazy:
+            self._load()
+
+    def __repr__(self):
+        return '<Index {!r}>'.format(self.source)
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._load()
+        return self._entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _load(self):
+
+        if self.snapshot_path:
+            entries = self._load_snapshot()
+            if entries is not None:
+                self._entries = entries
+                return
+
+        source = self.source
+        if isinstance(source, str) and self.processes and self.processes > 1:
+            self._entries = load_entries(source, self.processes, **self.filters)
+        elif isinstance(source, str):
+            with open(source, 'r', newline='\n') as fh:
+                self._entries = list(iter_entries(fh, **self.filters))
+        else:
+            self._entries = list(iter_entries(source, **self.filters))
+
+        if self.snapshot_path:
+            self.save_snapshot()
+
+    def _snapshot_key(self):
+        st = os.stat(self.source)
+        return (SNAPSHOT_VERSION, st.st_size, st.st_mtime, sorted(self.filters.items()))
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'rb') as fh:
+                key = pickle.load(fh)
+                if key != self._snapshot_key():
+                    return
+                return pickle.load(fh)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return
+
+    def save_snapshot(self, path=None):
+        """Pickle the entries so that the next load can skip parsing."""
+        path = path or self.snapshot_path
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as fh:
+            pickle.dump(self._snapshot_key(), fh, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(self.entries, fh, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+
+    def _invalidate(self):
+        for name in ('by_path', 'by_checksum', 'by_inode', 'by_directory', 'sorted_by_path', '_sorted_paths'):
+            self.__dict__.pop(name, None)
+
+    def add(self, entry):
+        self.entries.append(entry)
+        self._invalidate()
+
+    @cached_property
+    def by_path(self):
+        """Map of path to entry; later entries replace earlier ones."""
+        return {e.path: e for e in self.entries}
+
+    @cached_property
+    def by_checksum(self):
+        """Map of ``(checksum, size)`` to a list of (non-directory) entries."""
+        out = {}
+        for e in self.entries:
+            if e.is_dir:
+                continue
+            out.setdefault((e.checksum, e.size), []).append(e)
+        return out
+
+    @cached_property
+    def by_inode(self):
+        """Map of inode to a list of entries."""
+        out = {}
+        for e in self.entries:
+            if e.inode is not None:
+                out.setdefault(e.inode, []).append(e)
+        return out
+
+    @cached_property
+    def by_directory(self):
+        """Map of directory (``''`` for the top) to a list of entries within it."""
+        out = {}
+        for e in self.entries:
+            out.setdefault(os.path.dirname(e.path), []).append(e)
+        return out
+
+    @cached_property
+    def sorted_by_path(self):
+        """Entries sorted by path; entries with equal paths stay in file order."""
+        return sorted(self.entries, key=lambda e: e.path)
+
+    @cached_property
+    def _sorted_paths(self):
+        return [e.path for e in self.sorted_by_path]
+
+    def iter_prefix(self, prefix):
+        """Iterate, in path order, over entries with paths starting with the given prefix."""
+        entries = self.sorted_by_path
+        paths = self._sorted_paths
+        i = bisect.bisect_left(paths, prefix)
+        while i < len(paths) and paths[i].startswith(prefix):
+            yield entries[i]
+            i += 1
@@ -0,0 +1,152 @@
+from __future__ import print_function
+
+from uuid import uuid4
+import argparse
+import datetime
+import heapq
+import json
+import sys
+
+
+# Totals from `#scan-end` which are summed across inputs.
+TOTALS = ('added_count', 'added_bytes', 'total_count', 'total_bytes', 'error_count', 'throttled_seconds')
+
+
+# Sorts after any real name.
+_LAST = (u'\U0010ffff', u'\U0010ffff')
+
+
+def walk_sort_key(path, is_dir=False):
+    """The order in which :func:`.resumeable_walk` visits a relative path.
+
+    Every directory lists its files (case-insensitively) before descending
+    into its subdirectories (also case-insensitively). Names which differ
+    only by case are ordered case-sensitively. Directory rows come after
+    everything within them.
+
+    """
+    parts = [(x.lower(), x) for x in path.split('/')] if path != '.' else []
+    if is_dir:
+        return tuple(parts) + (_LAST, ), _LAST
+    return tuple(parts[:-1]), parts[-1]
+
+
+class _Input(object):
+
+    def __init__(self, path):
+
+        self.path = path
+        self.fh = open(path, 'r')
+        self.headers = []
+        self.ends = []
+        self.errors = []
+
+        # Read the first header eagerly so we can build ours before merging.
+        line = self.fh.readline()
+        if not line.startswith('#scan-start'):
+            raise ValueError("Index does not start with #scan-start.", path)
+        self._header(line)
+
+    def _header(self, line):
+        header = json.loads(line.split(None, 1)[1])
+        columns = header.get('columns')
+        if self.headers and columns != self.headers[0].get('columns'):
+            raise ValueError("Columns change within index.", self.path)
+        self.headers.append(header)
+
+    def __iter__(self):
+
+        columns = self.headers[0]['columns']
+        path_i = columns.index('path')
+        type_i = columns.index('type') if 'type' in columns else None
+
+        for line in self.fh:
+
+            if line.startswith('#'):
+                if line.startswith('#scan-start'):
+                    self._header(line)
+                elif line.startswith('#scan-end'):
+                    self.ends.append(json.loads(line.split(None, 1)[1]))
+                else:
+                    self.errors.append(line)
+                continue
+
+            line = line.rstrip('\n')
+            if not line:
+                continue
+
+            values = line.split('\t')
+            is_dir = type_i is not None and values[type_i] == '/'
+            yield walk_sort_key(values[path_i], is_dir), line
+
+        self.fh.close()
+
+
+def merge_indexes(paths, out, extra_rows=()):
+    """Merge indexes (e.g. from :func:`.run_sharded`) into one sorted index.
+
+    Each input must already be sorted, and all must have the same columns.
+    The header and totals of the output are combined from those of the inputs.
+
+    :param extra_rows: Formatted rows to write after the merged ones (e.g. the
+        top directory row, which sorts last).
+
+    """
+
+    inputs = [_Input(path) for path in paths]
+    if not inputs:
+        raise ValueError("Nothing to merge.")
+
+    columns = inputs[0].headers[0].get('columns')
+    for input_ in inputs:
+        if input_.headers[0].get('columns') != columns:
+            raise ValueError("Cannot merge indexes with different columns.", input_.path)
+    if not columns or 'path' not in columns:
+        raise ValueError("Cannot merge indexes without columns.")
+
+    uuid = str(uuid4())
+
+    header = dict(inputs[0].headers[0])
+    header.pop('shard', None)
+    header.update(
+        merged=[h.get('uuid') for input_ in inputs for h in input_.headers],
+        started_at=min(input_.headers[0].get('started_at') or '' for input_ in inputs),
+        uuid=uuid,
+    )
+    out.write('#scan-start {}\n'.format(json.dumps(header, sort_keys=True)))
+
+    for _, line in heapq.merge(*inputs):
+        out.write(line + '\n')
+    for line in extra_rows:
+        out.write(line + '\n')
+
+    end = dict((name, 0) for name in TOTALS)
+    ended_at = []
+    for input_ in inputs:
+        for line in input_.errors:
+            out.write(line)
+        for x in input_.ends:
+            for name in TOTALS:
+                end[name] += x.get(name) or 0
+            ended_at.append(x.get('ended_at') or '')
+    end.update(
+        ended_at=max(ended_at) if ended_at else datetime.datetime.utcnow().isoformat('T'),
+        uuid=uuid,
+    )
+    out.write('#scan-end {}\n'.format(json.dumps(end, sort_keys=True)))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Merge sorted indexes (e.g. shards) into one.")
+    parser.add_argument('-o', '--out',
+        help="File to write to instead of stdout.")
+    parser.add_argument('inputs', nargs='+')
+    args = parser.parse_args(argv)
+
+    out = open(args.out, 'w') if args.out else sys.stdout
+    merge_indexes(args.inputs, out)
+
+
+if __name__ == '__main__':
+    exit(main())
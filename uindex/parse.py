@@ -1,17 +1,43 @@
 from __future__ import print_function
 
 import json
+import mmap
+import multiprocessing
+import os
 import sys
 
 from .entry import Entry
 
 
+# The first versions didn't specify columns.
+LEGACY_COLUMNS = ('checksum', 'perms', 'size', 'uid', 'gid', 'mtime', 'path')
+
+# Parallel loading isn't worth it for less than this much per process.
+MIN_CHUNK_SIZE = 4 * 1024 * 1024
+
+
 def iter_entries(fh, pop_path=None, prepend_path=None, search_path=None, invert_search=False, replace_path=None):
+    filters = dict(
+        pop_path=pop_path,
+        prepend_path=prepend_path,
+        search_path=search_path,
+        invert_search=invert_search,
+        replace_path=replace_path,
+    )
+    return _iter_entries(fh, None, 'line {}', filters)
 
-    meta = None
-    columns = None
 
-    for line_i, line in enumerate(fh):
+def _iter_entries(lines, columns, where, filters):
+    return _iter_filtered(_iter_rows(lines, columns, where), filters)
+
+
+def _iter_rows(lines, columns, where):
+
+    # Yields (columns, values) of every row; the core shared by serial and
+    # parallel parsing. The columns are those in effect at the start of the
+    # lines (e.g. in the middle of a file).
+
+    for line_i, line in enumerate(lines):
 
         line = line.strip()
         if not line:
@@ -19,27 +45,33 @@ def iter_entries(fh, pop_path=None, prepend_path=None, search_path=None, invert_
 
         if line.startswith('#'):
             if line.startswith('#scan-start'):
-                meta = json.loads(line.split(None, 1)[1])
-                columns = meta.get('columns')
+                columns = json.loads(line.split(None, 1)[1]).get('columns')
             continue
 
         values = line.split('\t')
         if columns is not None:
             if len(columns) != len(values):
-                print('WARNING: Index parse failure at line {}; {}'.format(line_i, values), file=sys.stderr)
+                print('WARNING: Index parse failure at {}; {}'.format(where.format(line_i), values), file=sys.stderr)
                 continue
-            data = dict(zip(columns, values))
+            yield columns, values
         elif len(values) == 7:
-            # The first versions didn't specify columns.
-            data = dict(zip(
-                ('checksum', 'perms', 'size', 'uid', 'gid', 'mtime', 'path'),
-                values
-            ))
+            yield LEGACY_COLUMNS, values
         else:
-            print('WARNING: Index parse failure at line {}; {}'.format(line_i, values), file=sys.stderr)
+            print('WARNING: Index parse failure at {}; {}'.format(where.format(line_i), values), file=sys.stderr)
             continue
 
-        entry = Entry(meta=None, **data)
+
+def _iter_filtered(rows, filters):
+
+    pop_path = filters.get('pop_path')
+    prepend_path = filters.get('prepend_path')
+    replace_path = filters.get('replace_path')
+    search_path = filters.get('search_path')
+    invert_search = filters.get('invert_search')
+
+    for columns, values in rows:
+
+        entry = Entry(meta=None, **dict(zip(columns, values)))
 
         if pop_path:
             entry.pop_path(pop_path)
@@ -53,6 +85,122 @@ def iter_entries(fh, pop_path=None, prepend_path=None, search_path=None, invert_
             found = (not found) if invert_search else found
             if not found:
                 continue
-        
+
         yield entry
 
+
+def iter_headers(fh):
+    """Yield the parsed JSON of every ``#scan-start`` header."""
+    for line in fh:
+        if line.startswith('#scan-start'):
+            yield json.loads(line.split(None, 1)[1])
+
+
+def read_headers(path):
+    """Return the parsed JSON of every ``#scan-start`` header, without parsing any rows."""
+    if not os.path.getsize(path):
+        return []
+    with open(path, 'rb') as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return [header for _, header in _find_headers(mm)]
+        finally:
+            mm.close()
+
+
+def _find_headers(mm):
+    # Returns [(offset, header)] of every #scan-start at the start of a line.
+    headers = []
+    pos = 0
+    while True:
+        pos = mm.find(b'#scan-start', pos)
+        if pos < 0:
+            return headers
+        if pos == 0 or mm[pos - 1:pos] == b'\n':
+            end = mm.find(b'\n', pos)
+            line = mm[pos:end if end >= 0 else len(mm)].decode('utf8')
+            headers.append((pos, json.loads(line.split(None, 1)[1])))
+        pos += 1
+
+
+def split_ranges(path, count, min_size=MIN_CHUNK_SIZE):
+    """Split an index into at most ``count`` ``(start, end, columns)`` byte ranges.
+
+    Ranges start at line boundaries, and carry the columns which are in
+    effect where they start.
+
+    """
+
+    size = os.path.getsize(path)
+    if not size:
+        return []
+
+    with open(path, 'rb') as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+
+            count = max(1, min(count, size // max(1, min_size)))
+            bounds = [0]
+            for i in range(1, count):
+                pos = mm.find(b'\n', max(bounds[-1], i * size // count))
+                if pos < 0:
+                    break
+                if pos + 1 < size:
+                    bounds.append(pos + 1)
+            bounds.append(size)
+
+            headers = _find_headers(mm)
+
+        finally:
+            mm.close()
+
+    ranges = []
+    header_i = 0
+    columns = None
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        while header_i < len(headers) and headers[header_i][0] < start:
+            columns = headers[header_i][1].get('columns')
+            header_i += 1
+        ranges.append((start, end, columns))
+    return ranges
+
+
+def _parse_range(args):
+    # Returns raw rows, which are much cheaper to send back than entries.
+    path, start, end, columns = args
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        data = fh.read(end - start)
+    # Not splitlines(), which also splits on characters which may be in
+    # paths; files are opened with newline='\n' for the same reason.
+    lines = data.decode('utf8').split('\n')
+    return list(_iter_rows(lines, columns, 'line {{}} after byte {}'.format(start)))
+
+
+def load_entries(path, processes=None, min_chunk_size=MIN_CHUNK_SIZE, **filters):
+    """Parse an index file in parallel, returning a list of entries in file order.
+
+    The file is split into byte ranges on line boundaries (see :func:`split_ranges`),
+    which are split into raw fields by a pool of ``processes`` (defaulting to
+    one per core); entries are built from them here. Filters are as for
+    :func:`iter_entries`.
+
+    """
+
+    processes = processes or multiprocessing.cpu_count()
+    ranges = split_ranges(path, processes * 4, min_chunk_size)
+
+    if len(ranges) < 2 or processes < 2:
+        with open(path, 'r', newline='\n') as fh:
+            return list(iter_entries(fh, **filters))
+
+    jobs = [(path, start, end, columns) for start, end, columns in ranges]
+    pool = multiprocessing.Pool(min(processes, len(jobs)))
+    try:
+        entries = []
+        for rows in pool.imap(_parse_range, jobs):
+            entries.extend(_iter_filtered(rows, filters))
+        return entries
+    finally:
+        pool.close()
+        pool.join()
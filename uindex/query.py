@@ -0,0 +1,430 @@
+from __future__ import print_function
+
+from uuid import uuid4
+import argparse
+import datetime
+import fnmatch
+import grp
+import json
+import multiprocessing
+import operator
+import os
+import pwd
+import re
+import sys
+import time
+
+from .create import COLUMNS, format_entry, printerr
+from .entry import Entry
+from .index import Index
+from .parse import LEGACY_COLUMNS, MIN_CHUNK_SIZE, split_ranges
+from .utils import parse_bytes
+
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+TIME_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S')
+
+_expr_re = re.compile(r'^(\w+)\s*(<=|>=|!=|!@|=|<|>|@)\s*(.*)$')
+
+
+def parse_time(x):
+    """Parse seconds since the epoch, or a local ``YYYY-MM-DD[THH:MM[:SS]]``."""
+    try:
+        return float(x)
+    except ValueError:
+        pass
+    for format_ in TIME_FORMATS:
+        try:
+            dt = datetime.datetime.strptime(x, format_)
+        except ValueError:
+            continue
+        return time.mktime(dt.timetuple())
+    raise ValueError("Could not parse time.", x)
+
+
+def _parse_id(x, lookup):
+    if x.isdigit():
+        return int(x)
+    try:
+        return lookup(x)[2]
+    except KeyError:
+        raise ValueError("Unknown user or group.", x)
+
+
+def _raw_checksum(x):
+    return x.rsplit(':', 1)[-1]
+
+
+def read_checksums(path):
+    """Read a set of checksums from a file of them, one per line, or from an index."""
+    checksums = set()
+    with open(path) as fh:
+        for line in fh:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                checksums.add(_raw_checksum(line.split('\t', 1)[0]))
+    return checksums
+
+
+class Predicate(object):
+
+    """One condition of a :class:`Query`, e.g. ``size>10G``.
+
+    Conditions can be tested against the raw string from an index row
+    (via :meth:`test_raw`), or against an :class:`.Entry`.
+
+    """
+
+    # field: (column, operators, parse value, convert raw value, entry attribute, cost)
+    FIELDS = {
+        'type': ('type', ('=', '!='), lambda x: frozenset(x.split(',')), None, 'type', 0),
+        'prefix': ('path', ('=', '!='), lambda x: x.strip('/'), None, 'path', 1),
+        'size': ('size', tuple(OPERATORS), parse_bytes, int, 'size', 2),
+        'inode': ('inode', tuple(OPERATORS), int, int, 'inode', 2),
+        'uid': ('uid', tuple(OPERATORS), lambda x: _parse_id(x, pwd.getpwnam), int, 'uid', 2),
+        'gid': ('gid', tuple(OPERATORS), lambda x: _parse_id(x, grp.getgrnam), int, 'gid', 2),
+        'mtime': ('mtime', tuple(OPERATORS), parse_time, float, 'mtime', 3),
+        'ctime': ('ctime', tuple(OPERATORS), parse_time, float, 'ctime', 3),
+        'checksum': ('checksum', ('=', '!=', '@', '!@'), None, _raw_checksum, 'checksum', 4),
+        'path': ('path', ('=', '!='), lambda x: re.compile(fnmatch.translate(x)), None, 'path', 5),
+    }
+
+    def __init__(self, field, op, value):
+
+        spec = self.FIELDS.get(field)
+        if spec is None:
+            raise ValueError("Unknown field.", field)
+        self.column, ops, parse, self.convert, self.attr, self.cost = spec
+        if op not in ops:
+            raise ValueError("Operator {} does not apply to {}.".format(op, field), op)
+
+        self.field = field
+        self.op = op
+        self.raw_value = value
+
+        if field == 'checksum':
+            self.value = read_checksums(value) if '@' in op else _raw_checksum(value)
+        else:
+            self.value = parse(value)
+
+    def __repr__(self):
+        return 'Predicate({!r}, {!r}, {!r})'.format(self.field, self.op, self.raw_value)
+
+    def _test(self, x):
+
+        if x is None:
+            return False
+
+        field = self.field
+        if field == 'type':
+            found = x in self.value
+        elif field == 'prefix':
+            prefix = self.value
+            found = not prefix or prefix == '.' or x == prefix or x.startswith(prefix + '/')
+        elif field == 'path':
+            found = self.value.match(x) is not None
+        elif self.op in ('@', '!@'):
+            found = x in self.value
+        else:
+            return OPERATORS[self.op](x, self.value)
+
+        return found if self.op in ('=', '@') else not found
+
+    def test_raw(self, x):
+        """Test the string value of our column in an index row."""
+        if not x:
+            return False
+        return self._test(self.convert(x) if self.convert else x)
+
+    def test_entry(self, entry):
+        return self._test(getattr(entry, self.attr))
+
+
+def parse_predicate(expr):
+    """Parse ``FIELD OP VALUE``, e.g. ``size>=10G`` or ``checksum@FILE``."""
+    m = _expr_re.match(expr.strip())
+    if not m:
+        raise ValueError("Could not parse condition.", expr)
+    return Predicate(*m.groups())
+
+
+class Query(object):
+
+    """A conjunction of conditions on index rows.
+
+    Every condition must hold for a row to match, and rows without the
+    column that a condition is on (e.g. ``ctime`` in old indexes) never
+    match it. Fields are:
+
+    - ``size``, ``inode``, ``uid``, ``gid``: numbers (sizes may have units,
+      and ids may be names), compared with any of ``= != < <= > >=``;
+    - ``mtime``, ``ctime``: as above, with times as seconds since the epoch
+      or a local ``YYYY-MM-DD[THH:MM[:SS]]``;
+    - ``type``: ``=`` or ``!=`` one or more (comma separated) type codes;
+    - ``path``: ``=`` or ``!=`` a glob over the whole path;
+    - ``prefix``: ``=`` or ``!=`` a directory (matching it and everything in it);
+    - ``checksum``: ``=`` or ``!=`` a checksum, or ``@`` or ``!@`` a file
+      of them (see :func:`read_checksums`).
+
+    """
+
+    def __init__(self, predicates=()):
+        # Cheapest first, so that most rows are rejected early.
+        self.predicates = sorted(predicates, key=lambda p: p.cost)
+        self._compiled = {}
+
+    @classmethod
+    def parse(cls, exprs):
+        return cls([parse_predicate(x) for x in exprs])
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_compiled'] = {}
+        return state
+
+    @property
+    def prefix(self):
+        """The longest prefix which every match must be under, or ``None``."""
+        prefixes = [p.value for p in self.predicates if p.field == 'prefix' and p.op == '=']
+        prefixes = [x for x in prefixes if x and x != '.']
+        return max(prefixes, key=len) if prefixes else None
+
+    def compile(self, columns):
+        """Return a function which tests the split values of a row with the given columns."""
+
+        columns = tuple(columns)
+        match = self._compiled.get(columns)
+        if match is not None:
+            return match
+
+        tests = []
+        for predicate in self.predicates:
+            try:
+                tests.append((columns.index(predicate.column), predicate.test_raw))
+            except ValueError:
+                tests = None
+                break
+
+        if tests is None:
+            match = lambda values: False
+        else:
+            def match(values):
+                for i, test in tests:
+                    if not test(values[i]):
+                        return False
+                return True
+
+        self._compiled[columns] = match
+        return match
+
+    def matches(self, entry):
+        for predicate in self.predicates:
+            if not predicate.test_entry(entry):
+                return False
+        return True
+
+    def iter_matching(self, lines, columns=None, where='line {}'):
+        """Yield entries for the matching rows of an index.
+
+        Conditions are tested on the raw fields of each row, so entries are
+        only built for rows that match.
+
+        :param columns: The columns in effect at the start of the lines (e.g.
+            in the middle of a file).
+
+        """
+
+        match = match_columns = None
+        for line_i, line in enumerate(lines):
+
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith('#'):
+                if line.startswith('#scan-start'):
+                    columns = json.loads(line.split(None, 1)[1]).get('columns')
+                continue
+
+            values = line.split('\t')
+            row_columns = columns
+            if row_columns is None and len(values) == len(LEGACY_COLUMNS):
+                row_columns = LEGACY_COLUMNS
+            if row_columns is None or len(row_columns) != len(values):
+                print('WARNING: Index parse failure at {}; {}'.format(where.format(line_i), values), file=sys.stderr)
+                continue
+
+            if row_columns is not match_columns:
+                match = self.compile(row_columns)
+                match_columns = row_columns
+            if match(values):
+                yield Entry(meta=None, **dict(zip(row_columns, values)))
+
+    def scan(self, path, processes=None, min_chunk_size=MIN_CHUNK_SIZE):
+        """Yield matching entries of an index file, in file order.
+
+        With more than one process, byte ranges of the file are queried in
+        parallel (see :func:`.split_ranges`).
+
+        """
+
+        ranges = split_ranges(path, processes * 4, min_chunk_size) if processes and processes > 1 else ()
+        if len(ranges) < 2:
+            with open(path, 'r', newline='\n') as fh:
+                for entry in self.iter_matching(fh):
+                    yield entry
+            return
+
+        jobs = [(self, path, start, end, columns) for start, end, columns in ranges]
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            for chunk in pool.imap(_query_range, jobs):
+                for entry in chunk:
+                    yield entry
+        finally:
+            pool.close()
+            pool.join()
+
+    def search(self, index):
+        """Yield matching entries of an :class:`.Index`, in path order.
+
+        A ``prefix`` condition seeks to it in the index's sorted paths,
+        instead of testing every entry.
+
+        """
+        prefix = self.prefix
+        for entry in index.iter_prefix(prefix) if prefix else index.sorted_by_path:
+            if self.matches(entry):
+                yield entry
+
+
+def _query_range(args):
+    query, path, start, end, columns = args
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        data = fh.read(end - start)
+    lines = data.decode('utf8').split('\n')
+    return list(query.iter_matching(lines, columns, 'line {{}} after byte {}'.format(start)))
+
+
+def _read_first_header(path):
+    with open(path) as fh:
+        line = fh.readline()
+    if line.startswith('#scan-start'):
+        return json.loads(line.split(None, 1)[1])
+    return {}
+
+
+def write_subindex(entries, out, header_extra=None):
+    """Write entries as a new index; returns how many were written."""
+
+    uuid = str(uuid4())
+    header = dict(header_extra or {})
+    header.update(
+        columns=COLUMNS,
+        started_at=datetime.datetime.utcnow().isoformat('T'),
+        uuid=uuid,
+    )
+    out.write('#scan-start {}\n'.format(json.dumps(header, sort_keys=True)))
+
+    count = 0
+    bytes_ = 0
+    for entry in entries:
+        out.write(format_entry(entry) + '\n')
+        count += 1
+        bytes_ += entry.size
+
+    out.write('#scan-end {}\n'.format(json.dumps(dict(
+        total_count=count,
+        total_bytes=bytes_,
+        ended_at=datetime.datetime.utcnow().isoformat('T'),
+        uuid=uuid,
+    ), sort_keys=True)))
+    return count
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Find entries of an index which match every condition, "
+        "e.g. `uindex-query INDEX 'size>10G' mtime>=2024-06-01 prefix=shows/xyz`.",
+        epilog="Fields are size, inode, uid, gid, mtime, ctime (with = != < <= > >=), "
+        "type, path (a glob), prefix (with = !=), and checksum (with = != or @ !@ a file of checksums).")
+
+    parser.add_argument('-c', '--columns',
+        help="Comma separated columns to print; defaults to entire rows.")
+    parser.add_argument('-o', '--out',
+        help="Write matches to this file as a new index.")
+    parser.add_argument('--count', action='store_true',
+        help="Only print how many entries (and bytes) matched.")
+
+    parser.add_argument('--snapshot', action='store_true',
+        help="Load the index via a cached snapshot next to it, and seek to prefixes "
+             "instead of scanning (outputs in path order).")
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+        help="Scan the index with N processes.")
+
+    parser.add_argument('index')
+    parser.add_argument('conditions', nargs='*', metavar='CONDITION')
+
+    args = parser.parse_args(argv)
+
+    columns = args.columns.split(',') if args.columns else None
+    for column in columns or ():
+        if column not in COLUMNS:
+            printerr("Unknown column {!r}; choose from {}.".format(column, ', '.join(COLUMNS)))
+            exit(2)
+    if args.out and (columns or args.count):
+        printerr("--out doesn't work with --columns or --count.")
+        exit(2)
+
+    try:
+        query = Query.parse(args.conditions)
+    except IOError as e:
+        printerr("Could not read checksums: {}".format(e))
+        exit(2)
+    except ValueError as e:
+        printerr("{} {!r}".format(e.args[0], e.args[-1]))
+        exit(2)
+
+    if args.snapshot:
+        entries = query.search(Index(args.index, snapshot=True, processes=args.jobs))
+    else:
+        entries = query.scan(args.index, processes=args.jobs)
+
+    if args.out:
+        header = _read_first_header(args.index)
+        header.update(
+            query=args.conditions,
+            source=os.path.abspath(args.index),
+        )
+        with open(args.out, 'w') as out:
+            write_subindex(entries, out, header)
+        return
+
+    count = 0
+    bytes_ = 0
+    for entry in entries:
+        count += 1
+        bytes_ += entry.size
+        if args.count:
+            continue
+        row = format_entry(entry)
+        if columns:
+            values = dict(zip(COLUMNS, row.split('\t')))
+            row = '\t'.join(values[x] for x in columns)
+        print(row)
+
+    if args.count:
+        print('{}\t{}'.format(count, bytes_))
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,323 @@
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .parse import LEGACY_COLUMNS, MIN_CHUNK_SIZE, split_ranges
+from .utils import format_bytes
+
+
+REPORTS = ('du', 'uid', 'gid', 'ext', 'age', 'size', 'dupes')
+
+DAY = 24 * 60 * 60
+AGE_BINS = (
+    ('1 day', DAY),
+    ('1 week', 7 * DAY),
+    ('1 month', 30 * DAY),
+    ('3 months', 91 * DAY),
+    ('1 year', 365 * DAY),
+    ('3 years', 3 * 365 * DAY),
+)
+SIZE_BINS = tuple((format_bytes(x), x) for x in (
+    4 * 1024,
+    64 * 1024,
+    1024 ** 2,
+    16 * 1024 ** 2,
+    256 * 1024 ** 2,
+    4 * 1024 ** 3,
+    64 * 1024 ** 3,
+))
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("uindex-report requires numpy; try `pip install numpy`.")
+
+
+def _factorize(keys):
+    # Returns (codes, names), where names[codes[i]] == keys[i].
+    codes = {}
+    array = np.fromiter((codes.setdefault(k, len(codes)) for k in keys), dtype=np.int64, count=len(keys))
+    return array, list(codes)
+
+
+def _extension(path):
+    name = path.rsplit('/', 1)[-1]
+    base, dot, ext = name.rpartition('.')
+    return ext.lower() if base else ''
+
+
+def _prefix(parts, depth):
+    return '/'.join(parts[:min(depth, len(parts) - 1)]) or '.'
+
+
+class Columns(object):
+
+    """The files of an index as NumPy column arrays.
+
+    Strings are stored as integer codes into lists of their distinct values:
+    ``prefixes[d]`` are the directories at depth ``d`` (starting at 1)
+    which contain each file, ``dirs`` their immediate directory, ``exts``
+    their extension, and ``checksums`` their checksum and size (so that
+    equal codes are duplicates).
+
+    :param list paths: The path of each file.
+    :param list checksums: The (raw) checksum of each file.
+    :param size: And the other fields are sequences of numbers.
+
+    """
+
+    def __init__(self, paths, checksums, size, mtime, uid, gid, depth=2):
+
+        _require_numpy()
+
+        self.size = np.asarray(size, dtype=np.int64)
+        self.mtime = np.asarray(mtime, dtype=np.float64)
+        self.uid = np.asarray(uid, dtype=np.int64)
+        self.gid = np.asarray(gid, dtype=np.int64)
+
+        split = [path.split('/') for path in paths]
+        self.depth = depth
+        self.prefixes = {}
+        for d in range(1, depth + 1):
+            self.prefixes[d] = _factorize([_prefix(parts, d) for parts in split])
+        self.dirs = _factorize(['/'.join(parts[:-1]) or '.' for parts in split])
+        self.exts = _factorize([_extension(path) for path in paths])
+        self.checksums = _factorize([(c.split(':')[-1], s) for c, s in zip(checksums, self.size.tolist())])
+
+    @classmethod
+    def load(cls, path, depth=2, processes=None, min_chunk_size=MIN_CHUNK_SIZE):
+        """Load the latest row for each path of an index file.
+
+        Rows are split into raw fields, and go straight into arrays. With
+        more than one process, byte ranges of the file are loaded in
+        parallel (see :func:`.split_ranges`).
+
+        """
+
+        _require_numpy()
+
+        ranges = split_ranges(path, processes * 4, min_chunk_size) if processes and processes > 1 else ()
+        if len(ranges) < 2:
+            with open(path, 'r', newline='\n') as fh:
+                parts = [_load_lines(fh, None, 'line {}')]
+        else:
+            pool = multiprocessing.Pool(min(processes, len(ranges)))
+            try:
+                parts = pool.map(_load_range, [(path, start, end, columns) for start, end, columns in ranges])
+            finally:
+                pool.close()
+                pool.join()
+
+        paths = [x for part in parts for x in part[0]]
+        checksums = [x for part in parts for x in part[1]]
+        numbers = [np.concatenate([part[2][i] for part in parts]) for i in range(5)]
+        is_dir = numbers.pop()
+
+        # The last row of each path wins (as in an Index), but in the order
+        # paths first appear.
+        latest = {}
+        for i, rel_path in enumerate(paths):
+            latest[rel_path] = i
+        keep = np.fromiter(latest.values(), dtype=np.int64, count=len(latest))
+        keep = keep[~is_dir[keep]]
+
+        return cls(
+            [paths[i] for i in keep],
+            [checksums[i] for i in keep],
+            *[x[keep] for x in numbers],
+            depth=depth
+        )
+
+    def __len__(self):
+        return len(self.size)
+
+    def group(self, codes, names, mask=None):
+        """Return ``[(name, bytes, count)]`` totalled by code, largest first."""
+        size = self.size
+        if mask is not None:
+            codes = codes[mask]
+            size = size[mask]
+        bytes_ = np.bincount(codes, weights=size, minlength=len(names))
+        counts = np.bincount(codes, minlength=len(names))
+        order = np.argsort(-bytes_, kind='stable')
+        return [(names[i], int(bytes_[i]), int(counts[i])) for i in order if counts[i]]
+
+    def group_values(self, values):
+        """As :meth:`group`, but by the distinct values of an integer array."""
+        names, codes = np.unique(values, return_inverse=True)
+        return self.group(codes.ravel(), [int(x) for x in names])
+
+    def histogram(self, values, bins):
+        """Return ``[(label, bytes, count)]`` for each of the ``(label, upper_bound)`` bins.
+
+        Anything beyond the last bound is in a final bin.
+
+        """
+        bounds = np.array([x for _, x in bins], dtype=np.float64)
+        codes = np.digitize(values, bounds, right=False)
+        labels = ['< {}'.format(label) for label, _ in bins] + ['>= {}'.format(bins[-1][0])]
+        bytes_ = np.bincount(codes, weights=self.size, minlength=len(labels))
+        counts = np.bincount(codes, minlength=len(labels))
+        return [(labels[i], int(bytes_[i]), int(counts[i])) for i in range(len(labels))]
+
+    def duplicates(self):
+        """Mask of files which duplicate an earlier file (in the index) with the same checksum and size."""
+        codes = self.checksums[0]
+        order = np.argsort(codes, kind='stable')
+        first = np.ones(len(codes), dtype=bool)
+        first[1:] = codes[order][1:] != codes[order][:-1]
+        mask = np.empty(len(codes), dtype=bool)
+        mask[order] = ~first
+        return mask
+
+    def report(self, name, depth=None, now=None):
+        """Return the rows of one of the :data:`REPORTS`.
+
+        :param int depth: The directory depth for ``du``; defaults to the deepest loaded.
+
+        """
+
+        if name == 'du':
+            return self.group(*self.prefixes[depth or self.depth])
+        if name == 'uid':
+            return self.group_values(self.uid)
+        if name == 'gid':
+            return self.group_values(self.gid)
+        if name == 'ext':
+            return self.group(*self.exts)
+        if name == 'age':
+            now = time.time() if now is None else now
+            return self.histogram(now - self.mtime, AGE_BINS)
+        if name == 'size':
+            return self.histogram(self.size, SIZE_BINS)
+        if name == 'dupes':
+            return self.group(*self.dirs, mask=self.duplicates())
+        raise ValueError("Unknown report.", name)
+
+
+_FIELDS = ('path', 'checksum', 'size', 'mtime', 'uid', 'gid', 'type')
+
+
+def _load_lines(lines, columns, where):
+
+    # Returns (paths, checksums, (size, mtime, uid, gid, is_dir)) of every
+    # row. The columns are those in effect at the start of the lines (e.g.
+    # in the middle of a file).
+
+    paths = []
+    checksums = []
+    size = []
+    mtime = []
+    uid = []
+    gid = []
+    is_dir = []
+
+    indices = indices_columns = None
+    for line_i, line in enumerate(lines):
+
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('#'):
+            if line.startswith('#scan-start'):
+                columns = json.loads(line.split(None, 1)[1]).get('columns')
+            continue
+
+        values = line.split('\t')
+        row_columns = columns
+        if row_columns is None and len(values) == len(LEGACY_COLUMNS):
+            row_columns = LEGACY_COLUMNS
+        if row_columns is None or len(row_columns) != len(values):
+            print('WARNING: Index parse failure at {}; {}'.format(where.format(line_i), values), file=sys.stderr)
+            continue
+
+        if row_columns is not indices_columns:
+            indices = [row_columns.index(x) if x in row_columns else None for x in _FIELDS]
+            indices_columns = row_columns
+        path_i, checksum_i, size_i, mtime_i, uid_i, gid_i, type_i = indices
+
+        paths.append(values[path_i])
+        checksums.append(values[checksum_i])
+        size.append(int(values[size_i]))
+        mtime.append(float(values[mtime_i]))
+        uid.append(int(values[uid_i]))
+        gid.append(int(values[gid_i]))
+        is_dir.append(type_i is not None and values[type_i] == '/')
+
+    return paths, checksums, (
+        np.array(size, dtype=np.int64),
+        np.array(mtime, dtype=np.float64),
+        np.array(uid, dtype=np.int64),
+        np.array(gid, dtype=np.int64),
+        np.array(is_dir, dtype=bool),
+    )
+
+
+def _load_range(args):
+    path, start, end, columns = args
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        data = fh.read(end - start)
+    lines = data.decode('utf8').split('\n')
+    return _load_lines(lines, columns, 'line {{}} after byte {}'.format(start))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Summarize an index: usage by directory, owner, "
+        "extension, age, size, and duplication.")
+
+    parser.add_argument('-r', '--report', action='append', choices=REPORTS,
+        help="Which report to print; can be used multiple times. Defaults to all of them.")
+    parser.add_argument('-d', '--depth', type=int, default=2,
+        help="How many directory levels to total for du.")
+    parser.add_argument('-n', '--top', type=int, default=20,
+        help="How many rows to print of each report (other than histograms); 0 for all.")
+
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+        help="Parse the index with N processes.")
+
+    parser.add_argument('index')
+
+    args = parser.parse_args(argv)
+
+    if np is None:
+        print("uindex-report requires numpy; try `pip install numpy`.", file=sys.stderr)
+        exit(2)
+
+    columns = Columns.load(args.index,
+        depth=args.depth,
+        processes=args.jobs,
+    )
+
+    print('{} files, {}'.format(len(columns), format_bytes(int(columns.size.sum()))))
+
+    sections = []
+    for name in args.report or REPORTS:
+        if name == 'du':
+            for depth in range(1, args.depth + 1):
+                sections.append(('du (depth {})'.format(depth), columns.report(name, depth), True))
+        else:
+            sections.append((name, columns.report(name), name not in ('age', 'size')))
+
+    for title, rows, limit in sections:
+        if limit and args.top:
+            rows = rows[:args.top]
+        print()
+        print('## {}'.format(title))
+        for key, bytes_, count in rows:
+            print('{:>10}\t{}\t{}'.format(format_bytes(bytes_), count, key))
+
+
+if __name__ == '__main__':
+    exit(main())
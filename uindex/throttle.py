@@ -0,0 +1,178 @@
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+
+from .utils import parse_bytes
+
+
+# How often the control file is checked for changes.
+CONTROL_POLL_INTERVAL = 1.0
+
+
+class TokenBucket(object):
+
+    """A thread-safe token bucket.
+
+    Callers may take more than the bucket holds; the bucket goes into debt,
+    and they (and anyone after them) wait until it is paid off.
+
+    :param float rate: Tokens per second; falsy for no limit.
+    :param float burst: How many tokens may accumulate; defaults to one second's worth.
+
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.lock = threading.Lock()
+        self.burst = burst
+        self.tokens = 0
+        self.last = time.time()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = float(rate) if rate else None
+            if self.rate:
+                self.tokens = min(self.tokens, self.burst or self.rate)
+
+    def take(self, amount=1):
+        """Take tokens, sleeping until they are available; returns how long we slept."""
+
+        if not self.rate:
+            return 0
+
+        with self.lock:
+            rate = self.rate
+            if not rate:
+                return 0
+            now = time.time()
+            self.tokens = min(self.burst or rate, self.tokens + (now - self.last) * rate)
+            self.last = now
+            self.tokens -= amount
+            delay = -self.tokens / rate if self.tokens < 0 else 0
+
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+def read_control_file(path):
+    """Read rates from a control file of ``bytes=SIZE`` and ``ops=N`` lines.
+
+    A value of ``0`` or ``none`` removes that limit. Returns a dict with
+    ``bytes`` and/or ``ops`` keys.
+
+    """
+
+    rates = {}
+    with open(path) as fh:
+        for line_i, line in enumerate(fh):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key, _, value = line.partition('=')
+            key = key.strip()
+            value = value.strip()
+            if key not in ('bytes', 'ops'):
+                raise ValueError("Unknown throttle control key on line {}.".format(line_i + 1), key)
+            if value.lower() in ('', '0', 'none'):
+                rates[key] = None
+            elif key == 'bytes':
+                rates[key] = parse_bytes(value)
+            else:
+                rates[key] = float(value)
+    return rates
+
+
+class Throttle(object):
+
+    """Limits on bytes read and filesystem operations (stat/listdir/open) per second.
+
+    One throttle is shared by the walker and every checksumming thread. Rates
+    can be changed while running via :meth:`set_rates`, or by a control file
+    (see :func:`read_control_file`) which is re-read whenever it changes, or
+    after :meth:`request_reload` (e.g. from a SIGHUP handler). If the control
+    file is removed, the original rates are restored.
+
+    :param bytes_per_sec: Bytes read per second; ``None`` for no limit.
+    :param ops_per_sec: Operations per second; ``None`` for no limit.
+    :param str control_path: Control file to watch.
+    :param float share: Fraction of every rate which this process may use
+        (e.g. when it is one of several shards).
+
+    """
+
+    def __init__(self, bytes_per_sec=None, ops_per_sec=None, control_path=None, share=1):
+
+        self.default_rates = dict(bytes=bytes_per_sec, ops=ops_per_sec)
+        self.share = float(share)
+        self.control_path = control_path
+
+        self.bytes = TokenBucket()
+        self.ops = TokenBucket()
+        self.set_rates(bytes_per_sec, ops_per_sec)
+
+        self.lock = threading.Lock()
+        self.throttled_seconds = 0
+
+        self._control_mtime = None
+        self._next_poll = 0
+        self._reload = bool(control_path)
+
+    def __bool__(self):
+        return bool(self.control_path or self.bytes.rate or self.ops.rate)
+
+    __nonzero__ = __bool__
+
+    def set_rates(self, bytes_per_sec=None, ops_per_sec=None):
+        self.bytes_per_sec = bytes_per_sec
+        self.ops_per_sec = ops_per_sec
+        self.bytes.set_rate(bytes_per_sec and bytes_per_sec * self.share)
+        self.ops.set_rate(ops_per_sec and ops_per_sec * self.share)
+
+    def request_reload(self):
+        """Re-read the control file at the next opportunity; safe to call from a signal handler."""
+        self._reload = True
+
+    def _poll(self):
+
+        now = time.time()
+        if not self._reload and now < self._next_poll:
+            return
+        self._next_poll = now + CONTROL_POLL_INTERVAL
+
+        try:
+            mtime = os.stat(self.control_path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._control_mtime and not self._reload:
+            return
+        self._reload = False
+        self._control_mtime = mtime
+
+        rates = dict(self.default_rates)
+        if mtime is not None:
+            try:
+                rates.update(read_control_file(self.control_path))
+            except (IOError, OSError, ValueError) as e:
+                print('# Could not read throttle control file:', e, file=sys.stderr)
+                return
+        self.set_rates(rates['bytes'], rates['ops'])
+
+    def _wait(self, bucket, amount):
+        if self.control_path:
+            self._poll()
+        delay = bucket.take(amount)
+        if delay:
+            with self.lock:
+                self.throttled_seconds += delay
+
+    def op(self, count=1):
+        """Account for ``count`` filesystem operations, waiting if over budget."""
+        self._wait(self.ops, count)
+
+    def read(self, size):
+        """Account for ``size`` bytes read, waiting if over budget."""
+        self._wait(self.bytes, size)
@@ -0,0 +1,249 @@
+from __future__ import print_function
+
+import argparse
+import errno
+import math
+import os
+import sys
+import time
+
+from .autotune import Autotuner, parse_threads
+from .create import Indexer, WalkItem, _checksum_path, _read_size, _threaded_map, printerr
+from .index import Index
+from .parse import iter_headers
+from .throttle import Throttle
+from .utils import parse_bytes
+
+
+OK = 'OK'
+FAIL = 'FAIL'           # The content no longer matches.
+MISSING = 'MISSING'     # The file is gone.
+CHANGED = 'CHANGED'     # The size or mtime changed, so it was (probably) legitimately modified.
+ERROR = 'ERROR'         # It could not be read.
+
+
+def read_history(path):
+    """Read a verification log into a map of path to the last time it was verified."""
+    history = {}
+    try:
+        fh = open(path)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return history
+    with fh:
+        for line in fh:
+            parts = line.rstrip('\n').split('\t', 2)
+            if len(parts) == 3:
+                history[parts[2]] = float(parts[0])
+    return history
+
+
+class Verifier(object):
+
+    """Re-checksums files from an index to check that they haven't changed.
+
+    The checksum parameters (algorithm, head, tail, and samples) of each
+    entry are taken from the prefix of its checksum, so indexes built with
+    different settings (or mixing them) are verified as they were created.
+    Old checksums without a prefix use those from the last ``#scan-start``.
+
+    :param index: An :class:`.Index`, or a path to one.
+    :param str root: What the paths in the index are relative to; defaults
+        to the ``root`` from the last ``#scan-start`` header.
+    :param str history_path: Where to log verification times; defaults to
+        next to the index (if given a path).
+    :param throttle: A :class:`.Throttle` to limit reading with.
+
+    """
+
+    def __init__(self, index, root=None, history_path=None, throttle=None, verbosity=0):
+
+        self.header = {}
+        if not isinstance(index, Index):
+            with open(index) as fh:
+                for header in iter_headers(fh):
+                    self.header = header
+            root = root or self.header.get('root')
+            history_path = history_path or (index + '.verify')
+            index = Index(index)
+
+        if not root:
+            raise ValueError("Index has no root; one must be given.")
+
+        self.index = index
+        self.root = root
+        self.history_path = history_path
+        self.throttle = throttle or Throttle()
+        self.verbosity = verbosity
+
+        self.indexers = {}
+        self.counts = dict((x, 0) for x in (OK, FAIL, MISSING, CHANGED, ERROR))
+
+    def _indexer_for(self, entry):
+
+        prefix = entry.raw_checksum.rsplit(':', 1)[0] if ':' in entry.raw_checksum else None
+        indexer = self.indexers.get(prefix)
+        if indexer is not None:
+            return indexer
+
+        if prefix:
+            params = entry.checksum_params
+            samples, _, sample_size = (params.get('s') or '').partition('x')
+            indexer = Indexer(self.root,
+                checksum_algo=params.get('algo'),
+                head=params.get('h'),
+                tail=params.get('t'),
+                samples=samples or None,
+                sample_size=sample_size or None,
+            )
+            if indexer.algo_key != prefix:
+                raise ValueError("Could not reproduce checksum parameters.", prefix)
+        else:
+            header = self.header
+            indexer = Indexer(self.root,
+                checksum_algo=header.get('checksum_algo') or 'sha256',
+                head=header.get('head') and str(header['head']),
+                tail=header.get('tail') and str(header['tail']),
+            )
+        indexer.throttle = self.throttle
+
+        self.indexers[prefix] = indexer
+        return indexer
+
+    def candidates(self, percent=None):
+        """Files to verify, least recently verified first.
+
+        :param float percent: Only return this percentage of them.
+
+        """
+
+        history = read_history(self.history_path) if self.history_path else {}
+        entries = [e for e in self.index.by_path.values() if e.type in ('F', '@', None)]
+        entries.sort(key=lambda e: (history.get(e.path, 0), e.path))
+        if percent is not None:
+            entries = entries[:int(math.ceil(len(entries) * percent / 100.0))]
+        return entries
+
+    def verify_entry(self, entry):
+        """Return the status of one entry."""
+
+        path = os.path.join(self.root, entry.path)
+        if self.throttle:
+            self.throttle.op()
+        try:
+            item = WalkItem(*os.path.split(path))
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return entry, MISSING
+            return entry, ERROR
+
+        st = item.stat
+        if st.st_size != entry.size or abs(entry.mtime - st.st_mtime) >= entry.epsilon:
+            return entry, CHANGED
+
+        try:
+            _, checksum = _checksum_path(item, self._indexer_for(entry), cache=False)
+        except (IOError, OSError):
+            return entry, ERROR
+        if not checksum:
+            return entry, ERROR
+        return entry, OK if checksum.split(':')[-1] == entry.checksum else FAIL
+
+    def cost(self, result):
+        """How many bytes verifying a result read (for an :class:`.Autotuner`)."""
+        entry, status = result
+        if status not in (OK, FAIL):
+            return 0
+        return _read_size(entry.size, self._indexer_for(entry))
+
+    def run(self, threads=1, percent=None, time_budget=None, out=None):
+        """Verify (some of) the index, logging results to the history.
+
+        :param threads: How many threads, or an :class:`.Autotuner`.
+        :param float percent: Only verify this percentage, least recently verified first.
+        :param float time_budget: Stop starting new files after this many seconds.
+        :param out: Where to report anything which isn't OK.
+
+        """
+
+        start = time.time()
+        entries = self.candidates(percent)
+
+        def iter_budgeted():
+            for entry in entries:
+                if time_budget is not None and time.time() - start > time_budget:
+                    return
+                yield entry
+
+        history = open(self.history_path, 'a') if self.history_path else None
+        try:
+            for entry, status in _threaded_map(threads, self.verify_entry, iter_budgeted()):
+                self.counts[status] += 1
+                if history is not None:
+                    history.write('{:.3f}\t{}\t{}\n'.format(time.time(), status, entry.path))
+                if out is not None and (status != OK or self.verbosity):
+                    out.write('{}\t{}\n'.format(status, entry.path))
+        finally:
+            if history is not None:
+                history.close()
+
+        return self.counts
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Check files against the checksums in an index.")
+
+    parser.add_argument('-C', '--root', type=os.path.abspath,
+        help="What paths in the index are relative to; defaults to the root it was created with.")
+    parser.add_argument('--history', metavar='FILE',
+        help="Where to log when files were verified; defaults to INDEX.verify.")
+
+    parser.add_argument('-p', '--percent', type=float,
+        help="Only verify this percentage of the files, least recently verified first.")
+    parser.add_argument('-b', '--time-budget', type=float, metavar='SECONDS',
+        help="Stop starting to verify files after this long.")
+
+    parser.add_argument('-t', '--threads', type=parse_threads, default=1,
+        help="How many threads to run at once, or auto (or auto:MAX).")
+    parser.add_argument('--max-bytes', type=parse_bytes, metavar='SIZE',
+        help="Read at most this many bytes per second.")
+    parser.add_argument('--max-ops', type=float, metavar='N',
+        help="Perform at most this many stat/open operations per second.")
+
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+        help="Also print files which are OK.")
+
+    parser.add_argument('index')
+
+    args = parser.parse_args(argv)
+
+    try:
+        verifier = Verifier(args.index,
+            root=args.root,
+            history_path=args.history,
+            throttle=Throttle(args.max_bytes, args.max_ops),
+            verbosity=args.verbose,
+        )
+    except ValueError as e:
+        printerr(e.args[0])
+        exit(2)
+
+    threads = args.threads
+    if isinstance(threads, str):
+        threads = Autotuner.from_spec(threads,
+            cost=verifier.cost,
+            log=printerr if args.verbose else None,
+        )
+
+    counts = verifier.run(threads=threads, percent=args.percent, time_budget=args.time_budget, out=sys.stdout)
+    printerr('{} ok, {} failed, {} missing, {} changed, {} errors.'.format(
+        counts[OK], counts[FAIL], counts[MISSING], counts[CHANGED], counts[ERROR]))
+
+    if counts[FAIL] or counts[ERROR]:
+        exit(1)
+
+
+if __name__ == '__main__':
+    exit(main())
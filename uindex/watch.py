@@ -0,0 +1,374 @@
+from __future__ import print_function
+
+from queue import Queue
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+
+from .changes import Change
+from .create import Indexer, printerr
+from .exclude import read_exclude_file
+
+
+# From <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF |
+    IN_ONLYDIR | IN_DONT_FOLLOW
+)
+
+_event_header = struct.Struct('iIII')
+
+
+class Inotify(object):
+
+    """Minimal ctypes wrapper around Linux's inotify."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """Return a list of ``(wd, mask, cookie, name)`` tuples, waiting up to ``timeout``."""
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        try:
+            buf = os.read(self.fd, 1024 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        pos = 0
+        while pos < len(buf):
+            wd, mask, cookie, size = _event_header.unpack_from(buf, pos)
+            pos += _event_header.size
+            name = buf[pos:pos + size].rstrip(b'\0')
+            pos += size
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(object):
+
+    """Keeps an index current by watching its tree with inotify.
+
+    Events are coalesced per path, and a path is only re-examined once
+    it has been quiet for ``debounce`` seconds. Re-examination (see
+    :meth:`.Indexer.apply_changes`) happens in a background thread, with a
+    pool of ``threads`` for checksumming, and the index is rewritten
+    every ``checkpoint`` seconds if anything changed. Reading is limited
+    by the indexer's :class:`.Throttle`.
+
+    """
+
+    def __init__(self, indexer, out_path, threads=1, debounce=2.0, checkpoint=300, header_extra=None):
+
+        self.indexer = indexer
+        self.out_path = out_path
+        self.threads = threads
+        self.debounce = debounce
+        self.checkpoint_interval = checkpoint
+        self.header_extra = header_extra
+
+        self.inotify = None
+        self.watches = {}
+        self.pending = {}
+        # Map of move cookies to (path, when) for the other half of the move.
+        self.renames = {}
+
+        self.batches = Queue()
+        self.dirty = False
+        self.last_checkpoint = time.time()
+        self.checkpoint_count = 0
+        self.stopped = threading.Event()
+
+    def _log(self, *args):
+        if self.indexer.verbosity:
+            printerr('#', *args)
+
+    def _add_watches(self, top):
+        for dir_path, dir_names, _ in os.walk(top):
+            try:
+                wd = self.inotify.add_watch(dir_path)
+            except OSError as e:
+                if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise
+            self.watches[wd] = dir_path
+            excluded = self.indexer.excluder.for_dir(dir_path)
+            dir_names[:] = [x for x in dir_names if not (excluded(x) or excluded(x, True))]
+
+    def _handle(self, wd, mask, cookie, name):
+
+        now = time.time()
+
+        if mask & IN_Q_OVERFLOW:
+            # We lost events, so everything must be looked at again.
+            self._log('inotify queue overflowed; re-examining everything')
+            self.pending[self.indexer.path_to_index] = now
+            return
+
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+
+        dir_path = self.watches.get(wd)
+        if dir_path is None or not name:
+            return
+        path = os.path.join(dir_path, name)
+        if self.indexer._is_excluded(path):
+            return
+
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self._add_watches(path)
+
+        old_path = None
+        if mask & IN_MOVED_FROM:
+            self.renames[cookie] = path, now
+        elif mask & IN_MOVED_TO:
+            old_path = (self.renames.pop(cookie, None) or (None, ))[0]
+
+        # Keep track of where it was renamed from until it settles.
+        previous = self.pending.get(path)
+        if isinstance(previous, tuple):
+            old_path = old_path or previous[1]
+        self.pending[path] = (now, old_path) if old_path else now
+
+    def _take_due(self):
+
+        cutoff = time.time() - self.debounce
+
+        # Both halves of a move arrive together, so a move which is still
+        # unmatched was out of the tree (and is pending as a deletion).
+        for cookie, (_, when) in list(self.renames.items()):
+            if when <= cutoff:
+                del self.renames[cookie]
+
+        changes = []
+        for path, value in list(self.pending.items()):
+            if isinstance(value, tuple):
+                last, old_path = value
+            else:
+                last, old_path = value, None
+            if last > cutoff:
+                continue
+            del self.pending[path]
+            if old_path:
+                changes.append(Change('R', None, old_path, path))
+            else:
+                changes.append(Change(None, None, path, None))
+
+        return changes
+
+    def _worker(self):
+
+        while True:
+
+            changes = self.batches.get()
+            if changes is None:
+                break
+
+            if changes:
+                self._log('re-examining {} changed paths'.format(len(changes)))
+                self.indexer.apply_changes(changes, threads=self.threads)
+                self.dirty = True
+                self._log('checksummed {} files'.format(self.indexer.added_count))
+
+            if self.dirty and time.time() - self.last_checkpoint >= self.checkpoint_interval:
+                self.checkpoint()
+
+        if self.dirty:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Atomically rewrite the index on disk."""
+        tmp_path = '{}.{}.tmp'.format(self.out_path, os.getpid())
+        with open(tmp_path, 'w') as out:
+            self.indexer.write_existing(out, self.header_extra)
+        os.rename(tmp_path, self.out_path)
+        self.dirty = False
+        self.last_checkpoint = time.time()
+        self.checkpoint_count += 1
+        self._log('checkpointed {} entries'.format(len(self.indexer.existing)))
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+
+        indexer = self.indexer
+
+        # Subscribe before the initial scan so we don't miss anything
+        # which happens during it.
+        self.inotify = Inotify()
+        self._add_watches(indexer.path_to_index)
+
+        if os.path.exists(self.out_path):
+            self._log('loading', self.out_path)
+            indexer.load_existing(self.out_path)
+            # Anything may have changed while we weren't watching.
+            self.pending[indexer.path_to_index] = 0
+        else:
+            self._log('indexing', indexer.path_to_index)
+            self.dirty = True
+            self.pending[indexer.path_to_index] = 0
+
+        worker = threading.Thread(target=self._worker)
+        worker.daemon = True
+        worker.start()
+
+        try:
+            while not self.stopped.is_set():
+                for event in self.inotify.read(min(1.0, self.debounce)):
+                    self._handle(*event)
+                changes = self._take_due()
+                if changes or (self.dirty and time.time() - self.last_checkpoint >= self.checkpoint_interval):
+                    self.batches.put(changes)
+        finally:
+            self.batches.put(None)
+            worker.join()
+            self.inotify.close()
+
+
+def main(argv=None):
+
+    from .utils import parse_bytes
+
+    parser = argparse.ArgumentParser(description="Keep an index current by watching for changes.")
+
+    parser.add_argument('-D', '--include-dotfiles', action='store_true',
+        help="Don't exclude files that start with dots.")
+    parser.add_argument('-e', '--exclude', action='append', default=[],
+        help="Exclude files that match this regex; can be used multiple times.")
+    parser.add_argument('-g', '--exclude-glob', action='append', default=[],
+        help="Exclude files that match this gitignore-style glob; can be used multiple times.")
+    parser.add_argument('--exclude-from', action='append', default=[], metavar='FILE',
+        help="Exclude files that match gitignore-style globs from this file.")
+
+    parser.add_argument('-o', '--out', required=True,
+        help="Index to keep current; it is created if it does not exist.")
+
+    parser.add_argument('--head',
+        help="How much of front of file to checksum.")
+    parser.add_argument('--tail',
+        help="How much of end of file to checksum.")
+    parser.add_argument('--samples', type=int, metavar='N',
+        help="Only checksum the size, head, tail, and N evenly spaced blocks of each file.")
+    parser.add_argument('--sample-size', metavar='SIZE',
+        help="How large each sampled block is; defaults to 1M.")
+    parser.add_argument('-H', '--checksum-algo', default='sha256',
+        help="Which hashlib algorithm to use.")
+
+    parser.add_argument('-t', '--threads', type=int, default=1,
+        help="How many threads to checksum with.")
+    parser.add_argument('--debounce', type=float, default=2.0, metavar='SECONDS',
+        help="How long a path must be quiet before it is re-examined.")
+    parser.add_argument('--checkpoint', type=float, default=300, metavar='SECONDS',
+        help="How often to rewrite the index, if it changed.")
+    parser.add_argument('--max-bytes', type=parse_bytes, metavar='SIZE',
+        help="Read at most this many bytes per second.")
+    parser.add_argument('--max-ops', type=float, metavar='N',
+        help="Perform at most this many stat/listdir/open operations per second.")
+    parser.add_argument('--throttle-control', metavar='FILE',
+        help="File of bytes=SIZE and ops=N lines to override --max-bytes and --max-ops while running; "
+             "it is re-read when it changes, or on SIGHUP.")
+
+    parser.add_argument('-C', '--root', type=os.path.abspath,
+        help="Root from which relative paths will be derived.")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+        help="Print out progress.")
+
+    parser.add_argument('path', type=os.path.abspath)
+
+    args = parser.parse_args(argv)
+
+    indexer = Indexer(
+        path_to_index=args.path,
+        root=args.root,
+        excludes=args.exclude,
+        exclude_globs=args.exclude_glob + [x for path in args.exclude_from for x in read_exclude_file(path)],
+        include_dotfiles=args.include_dotfiles,
+        checksum_algo=args.checksum_algo,
+        head=args.head,
+        tail=args.tail,
+        samples=args.samples,
+        sample_size=args.sample_size,
+        max_bytes=args.max_bytes,
+        max_ops=args.max_ops,
+        throttle_control=args.throttle_control and os.path.abspath(args.throttle_control),
+        verbosity=args.verbose,
+    )
+
+    watcher = Watcher(indexer, args.out,
+        threads=args.threads,
+        debounce=args.debounce,
+        checkpoint=args.checkpoint,
+        header_extra=dict(
+            cli=dict(
+                argv=sys.argv,
+                cwd=os.getcwd(),
+            )
+        ),
+    )
+
+    def on_signal(signum, frame):
+        watcher.stop()
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    if args.throttle_control and hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: indexer.throttle.request_reload())
+
+    watcher.run()
+
+
+if __name__ == '__main__':
+    exit(main())